@@ -0,0 +1,10 @@
+"""Benchmarks for TOASTER.
+
+    synthetic_db.py: Fill a database with realistically sized
+        synthetic content.
+    run_benchmarks.py: Time the toolkit's main query paths
+        against such a database.
+    fake_psrchive.py: Stand-in PSRCHIVE command line tools.
+    pipeline_benchmarks.py: Time ingest, reduction and diagnostics
+        end-to-end using the stand-in tools.
+"""
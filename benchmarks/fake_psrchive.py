@@ -0,0 +1,499 @@
+#!/usr/bin/env python
+"""Stand-in PSRCHIVE command line tools for benchmarking.
+
+    TOASTER shells out to 'vap', 'pam', 'pat', 'psrstat', 'psrplot',
+    'psredit' and 'psrchive'. This module implements deterministic,
+    dependency-free fakes of the subset of these tools (and their
+    output formats) that TOASTER uses, so that ingest, 'toastit' and
+    diagnostics can be benchmarked without PSRCHIVE installed.
+
+    Fake archives are files whose first line is a JSON-encoded
+    header, followed by padding to give them a realistic size.
+    See 'make_fake_archive'.
+
+    Each fake tool sleeps for a configurable latency before exiting,
+    and may log its wall-clock time, so TOASTER's own overhead can be
+    separated from time spent in external tools. Configuration is
+    done with environment variables:
+        TOASTER_FAKE_LATENCY: Seconds each call takes. (Default: 0)
+        TOASTER_FAKE_LATENCY_<TOOL>: Per-tool override
+            (e.g. TOASTER_FAKE_LATENCY_PAT).
+        TOASTER_FAKE_LATENCY_PER_PROFILE: Extra seconds per
+            profile (nsub*nchan) for 'pam', 'pat' and 'psrstat'.
+            (Default: 0)
+        TOASTER_FAKE_LOG: File to append a JSON line to for
+            every call. (Default: don't log)
+
+    Use 'installed(...)' to put the fake tools first in PATH, so
+    that 'utils.execute' runs them in place of the real ones.
+
+    Usage (as a tool):
+        fake_psrchive.py <tool> [arguments...]
+"""
+import sys
+import os
+import os.path
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import contextlib
+
+# The fake tools provided by this module
+TOOLS = ['vap', 'pam', 'pat', 'psrstat', 'psrplot', 'psredit', 'psrchive']
+
+# Options, per tool, that take a value
+VALUE_OPTS = {'vap': ['-c'],
+              'pam': ['-e', '-u', '-E', '-d', '-D', '--setnchn',
+                      '--setnsub', '--settsub', '--setnbin', '--receiver',
+                      '--inst', '--site', '--name'],
+              'pat': ['-f', '-A', '-s', '-C', '-K', '-j', '-c', '-g'],
+              'psrstat': ['-c', '-j', '-J'],
+              'psrplot': ['-p', '-c', '-j', '-D', '-s', '-l'],
+              'psredit': ['-c', '-e'],
+              'psrchive': []}
+
+# A 1x1 pixel PNG, used for all plots
+PNG_DATA = b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01' \
+           b'\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f\x15\xc4\x89\x00' \
+           b'\x00\x00\rIDATx\x9cc\xf8\x0f\x00\x00\x01\x01\x00\x05\x18' \
+           b'\xd8N\x00\x00\x00\x00IEND\xaeB`\x82'
+
+DEFAULT_HEADER = {'nbin': 1024,
+                  'nchan': 32,
+                  'npol': 4,
+                  'nsub': 16,
+                  'type': 'Pulsar',
+                  'telescop': 'Effelsberg',
+                  'site': 'g',
+                  'name': 'J1713+0747',
+                  'ra': '17:13:49.5',
+                  'dec': '+07:47:37.5',
+                  'freq': 1380.0,
+                  'bw': 200.0,
+                  'dm': 15.99,
+                  'rm': 0.0,
+                  'scale': 'FluxDen',
+                  'state': 'Stokes',
+                  'length': 3600.0,
+                  'rcvr': 'P217-3',
+                  'basis': 'Linear',
+                  'backend': 'PSRIX',
+                  'mjd': 56000.5,
+                  'tbin': 6.4e-5}
+
+
+def make_fake_archive(fn, padding=1024**2, **header):
+    """Write a fake archive.
+
+        Inputs:
+            fn: The name of the file to write.
+            padding: The number of bytes of (deterministic) data
+                following the header. (Default: 1 MB)
+            ** Any other keyword arguments are header values that
+                override those in 'DEFAULT_HEADER'.
+
+        Output:
+            None
+    """
+    hdr = dict(DEFAULT_HEADER)
+    hdr.update(header)
+    write_archive(fn, hdr, padding)
+
+
+def read_header(fn):
+    """Read a fake archive's header (and padding size).
+
+        Input:
+            fn: The name of the fake archive.
+
+        Outputs:
+            hdr: A dictionary of header values.
+            padding: The number of bytes of padding.
+    """
+    with open(fn, 'rb') as ff:
+        line = ff.readline()
+        hdr = json.loads(line.decode('utf-8'))
+        ff.seek(0, os.SEEK_END)
+        padding = ff.tell() - len(line)
+    return hdr, padding
+
+
+def write_archive(fn, hdr, padding):
+    """Write a fake archive's header and padding.
+
+        Inputs:
+            fn: The name of the file to write.
+            hdr: A dictionary of header values.
+            padding: The number of bytes of padding.
+
+        Output:
+            None
+    """
+    seed = hashlib.md5(json.dumps(hdr, sort_keys=True).encode('utf-8')).digest()
+    block = (seed*(65536//len(seed)+1))[:65536]
+    with open(fn, 'wb') as ff:
+        ff.write((json.dumps(hdr, sort_keys=True) + "\n").encode('utf-8'))
+        remaining = padding
+        while remaining > 0:
+            ff.write(block[:remaining])
+            remaining -= len(block)
+
+
+def get_header_value(hdr, key):
+    """Return a header value formatted the way 'vap' would.
+
+        Inputs:
+            hdr: A dictionary of header values.
+            key: The header key.
+
+        Output:
+            valstr: The formatted value ('*' if it is not defined).
+    """
+    if key == 'intmjd':
+        return "%d" % int(hdr['mjd'])
+    elif key == 'fracmjd':
+        return "%.15f" % (hdr['mjd'] % 1)
+    elif key not in hdr:
+        return "*"
+    val = hdr[key]
+    if isinstance(val, float):
+        return "%.10g" % val
+    return str(val)
+
+
+def pseudo_random(*args):
+    """Return a deterministic number in [0, 1) computed from the arguments.
+    """
+    digest = hashlib.md5(repr(args).encode('utf-8')).hexdigest()
+    return int(digest[:8], 16)/float(16**8)
+
+
+def parse_argv(tool, argv):
+    """Split a fake tool's command line into options and files.
+
+        Inputs:
+            tool: The name of the tool.
+            argv: The tool's command line arguments.
+
+        Outputs:
+            opts: A list of (option, value) pairs, in order. The
+                value is None for flags.
+            files: A list of file names.
+    """
+    opts = []
+    files = []
+    ii = 0
+    while ii < len(argv):
+        arg = argv[ii]
+        if arg in VALUE_OPTS[tool]:
+            opts.append((arg, argv[ii+1]))
+            ii += 1
+        elif arg.startswith('-') and len(arg) > 1:
+            opts.append((arg, None))
+        else:
+            files.append(arg)
+        ii += 1
+    return opts, files
+
+
+def write_plot(device):
+    """Write a plot to a PGPLOT-style device string (e.g. 'fn.png/PNG').
+    """
+    fn = device.rsplit('/', 1)[0] if '/' in device else device
+    with open(fn, 'wb') as ff:
+        ff.write(PNG_DATA)
+
+
+def vap(opts, files):
+    keys = []
+    for opt, val in opts:
+        if opt == '-c':
+            keys.extend(val.split(','))
+    if not opts or ('-n', None) not in opts:
+        sys.stdout.write("filename %s\n" % " ".join(keys))
+    for fn in files:
+        hdr, padding = read_header(fn)
+        vals = [get_header_value(hdr, key) for key in keys]
+        sys.stdout.write("%s %s\n" % (fn, " ".join(vals)))
+    return files
+
+
+def psredit(opts, files):
+    keys = []
+    for opt, val in opts:
+        if opt == '-c':
+            keys.extend(val.split(','))
+    for fn in files:
+        hdr, padding = read_header(fn)
+        for key in keys:
+            sys.stdout.write("%s\n" % get_header_value(hdr, key))
+    return files
+
+
+def pam(opts, files):
+    ext = None
+    outdir = None
+    outfiles = []
+    for fn in files:
+        hdr, padding = read_header(fn)
+        nprof = hdr['nsub']*hdr['nchan']*hdr['npol']
+        for opt, val in opts:
+            if opt == '-e':
+                ext = val
+            elif opt == '-u':
+                outdir = val
+            elif opt == '-E':
+                hdr['ephemeris'] = os.path.basename(val)
+            elif opt in ('-d', '-D'):
+                hdr['dm'] = float(val)
+            elif opt == '--update_dm':
+                hdr['dm_updated'] = True
+            elif opt == '--setnchn':
+                hdr['nchan'] = min(hdr['nchan'], int(val))
+            elif opt == '--setnsub':
+                hdr['nsub'] = min(hdr['nsub'], int(val))
+            elif opt == '--settsub':
+                hdr['nsub'] = max(1, min(hdr['nsub'],
+                                         int(hdr['length']/float(val)+0.5)))
+            elif opt == '--setnbin':
+                hdr['nbin'] = min(hdr['nbin'], int(val))
+            elif opt == '-T':
+                hdr['nsub'] = 1
+            elif opt == '-F':
+                hdr['nchan'] = 1
+            elif opt == '-p':
+                hdr['npol'] = 1
+            elif opt == '--receiver':
+                with open(val, 'r') as ff:
+                    hdr['rcvr'] = ff.read().split()[0]
+            elif opt == '--inst':
+                hdr['backend'] = val
+            elif opt == '--site':
+                hdr['site'] = val
+            elif opt == '--name':
+                hdr['name'] = val
+        # Scale the data size with the number of profiles
+        padding = padding*hdr['nsub']*hdr['nchan']*hdr['npol']//nprof
+        if ext is not None:
+            outfn = os.path.splitext(fn)[0] + "." + ext
+        else:
+            outfn = fn
+        if outdir is not None:
+            outfn = os.path.join(outdir, os.path.basename(outfn))
+        write_archive(outfn, hdr, padding)
+        outfiles.append(outfn)
+    return outfiles
+
+
+def pat(opts, files):
+    opts = dict(opts)
+    cols = opts.get('-C', '').split()
+    if opts.get('-f', '').startswith('tempo2'):
+        sys.stdout.write("FORMAT 1\n")
+    itoa = 0
+    for fn in files:
+        hdr, padding = read_header(fn)
+        nchan, nsub = hdr['nchan'], hdr['nsub']
+        chanbw = hdr['bw']/nchan
+        for isub in range(nsub):
+            mjd = hdr['mjd'] + (isub+0.5)*hdr['length']/nsub/86400.0
+            imjd = int(mjd)
+            fmjdstr = ("%.13f" % (mjd-imjd))[1:]
+            for ichan in range(nchan):
+                freq = hdr['freq'] - hdr['bw']/2.0 + (ichan+0.5)*chanbw
+                err = 0.1 + 10*pseudo_random(fn, isub, ichan)
+                flags = []
+                for col in cols:
+                    if col == 'gof':
+                        flags.append("-gof %.3f" %
+                                     (0.9 + 0.2*pseudo_random(fn, isub, ichan, col)))
+                    elif col == 'nsubint':
+                        flags.append("-nsubint %d" % nsub)
+                    else:
+                        flags.append("-%s %s" % (col, get_header_value(hdr, col)))
+                sys.stdout.write(" %s %.8f %d%s %.3f %s %s\n" %
+                                 (os.path.basename(fn), freq, imjd,
+                                  fmjdstr, err, hdr.get('site', '@'),
+                                  " ".join(flags)))
+                itoa += 1
+                if '-t' in opts and '-K' in opts:
+                    # One diagnostic plot per TOA
+                    device = opts['-K']
+                    if itoa > 1:
+                        fn_dev, sep, dev = device.rpartition('/')
+                        device = "%s_%d/%s" % (fn_dev, itoa, dev)
+                    write_plot(device)
+    return files
+
+
+def psrstat(opts, files):
+    exprs = []
+    quiet = False
+    for opt, val in opts:
+        if opt == '-c':
+            exprs.extend(val.split(','))
+        elif opt in ('-Q', '-Qq', '-qQ'):
+            quiet = True
+    for fn in files:
+        hdr, padding = read_header(fn)
+        vals = []
+        for expr in exprs:
+            if expr == 'snr':
+                vals.append("%.3f" % (10 + 990*pseudo_random(fn, expr)))
+            elif expr == 'int:wt':
+                nprof = hdr['nsub']*hdr['nchan']
+                vals.append(",".join(["%d" % (pseudo_random(fn, ii) > 0.05)
+                                      for ii in range(nprof)]))
+            else:
+                vals.append(get_header_value(hdr, expr))
+        if quiet:
+            sys.stdout.write("%s\n" % " ".join(vals))
+        else:
+            sys.stdout.write("%s %s\n" % (fn, " ".join(["%s=%s" % kv for kv
+                                                        in zip(exprs, vals)])))
+    return files
+
+
+def psrplot(opts, files):
+    for opt, val in opts:
+        if opt == '-D':
+            write_plot(val)
+    return files
+
+
+def psrchive(opts, files):
+    sys.stdout.write("fake-psrchive-0.0 (TOASTER benchmark stand-in)\n")
+    return []
+
+
+def get_latency(tool, files):
+    """Return the number of seconds a call to the tool should take.
+
+        Inputs:
+            tool: The name of the tool.
+            files: The (fake) archives the tool operated on.
+
+        Output:
+            latency: The number of seconds.
+    """
+    latency = float(os.environ.get("TOASTER_FAKE_LATENCY_%s" % tool.upper(),
+                                   os.environ.get("TOASTER_FAKE_LATENCY", 0)))
+    perprof = float(os.environ.get("TOASTER_FAKE_LATENCY_PER_PROFILE", 0))
+    if perprof and tool in ('pam', 'pat', 'psrstat'):
+        for fn in files:
+            if os.path.isfile(fn):
+                hdr, padding = read_header(fn)
+                latency += perprof*hdr['nsub']*hdr['nchan']
+    return latency
+
+
+def main(argv):
+    start = time.time()
+    if argv and argv[0] in ('-h', '--help'):
+        sys.stdout.write(__doc__)
+        return 0
+    if not argv or argv[0] not in TOOLS:
+        sys.stderr.write("Unrecognized fake tool. Choose one of: %s\n" %
+                         ", ".join(TOOLS))
+        return 1
+    tool = argv[0]
+    opts, files = parse_argv(tool, argv[1:])
+    try:
+        used = globals()[tool](opts, files)
+    except (IOError, OSError, ValueError, KeyError) as exc:
+        sys.stderr.write("%s: %s\n" % (tool, exc))
+        return 1
+    sys.stdout.flush()
+    time.sleep(get_latency(tool, used))
+
+    logfn = os.environ.get("TOASTER_FAKE_LOG")
+    if logfn:
+        entry = json.dumps({'tool': tool,
+                            'argv': argv[1:],
+                            'wall': time.time() - start}) + "\n"
+        # Appending a single short write is atomic
+        fd = os.open(logfn, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        os.write(fd, entry.encode('utf-8'))
+        os.close(fd)
+    return 0
+
+
+@contextlib.contextmanager
+def installed(bindir=None, latency=None, per_profile=None, logfn=None,
+              tool_latencies={}):
+    """A context manager that puts the fake tools first in PATH.
+
+        Inputs:
+            bindir: The directory to write the tools' wrappers to.
+                (Default: a temporary directory, removed on exit)
+            latency: Seconds each call takes. (Default: 0)
+            per_profile: Extra seconds per profile for 'pam', 'pat'
+                and 'psrstat'. (Default: 0)
+            logfn: File to log each call to. (Default: don't log)
+            tool_latencies: A dictionary of per-tool latencies,
+                overriding 'latency'.
+
+        Output:
+            bindir: The directory containing the fake tools.
+    """
+    tmpbindir = bindir is None
+    if tmpbindir:
+        bindir = tempfile.mkdtemp(prefix='toaster_fakebin')
+    elif not os.path.isdir(bindir):
+        os.makedirs(bindir)
+    script = os.path.abspath(__file__)
+    if script.endswith('.pyc'):
+        script = script[:-1]
+    for tool in TOOLS:
+        wrapper = os.path.join(bindir, tool)
+        with open(wrapper, 'w') as ff:
+            ff.write('#!/bin/sh\nexec "%s" "%s" %s "$@"\n' %
+                     (sys.executable, script, tool))
+        os.chmod(wrapper, 0o755)
+
+    oldenv = dict(os.environ)
+    os.environ['PATH'] = bindir + os.pathsep + os.environ.get('PATH', '')
+    if latency is not None:
+        os.environ['TOASTER_FAKE_LATENCY'] = str(latency)
+    if per_profile is not None:
+        os.environ['TOASTER_FAKE_LATENCY_PER_PROFILE'] = str(per_profile)
+    for tool, toollatency in tool_latencies.items():
+        os.environ['TOASTER_FAKE_LATENCY_%s' % tool.upper()] = str(toollatency)
+    if logfn is not None:
+        os.environ['TOASTER_FAKE_LOG'] = logfn
+    try:
+        yield bindir
+    finally:
+        os.environ.clear()
+        os.environ.update(oldenv)
+        if tmpbindir:
+            shutil.rmtree(bindir)
+
+
+def summarize_log(logfn):
+    """Summarize the fake tools' log.
+
+        Input:
+            logfn: The log file written by the fake tools.
+
+        Output:
+            summary: A dictionary, keyed by tool name, of dictionaries
+                with the number of calls and total wall-clock time.
+    """
+    summary = {}
+    if not os.path.isfile(logfn):
+        return summary
+    with open(logfn, 'r') as ff:
+        for line in ff:
+            entry = json.loads(line)
+            toolsum = summary.setdefault(entry['tool'], {'calls': 0,
+                                                         'wall': 0.0})
+            toolsum['calls'] += 1
+            toolsum['wall'] += entry['wall']
+    return summary
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
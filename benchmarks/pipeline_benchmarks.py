@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+"""Benchmark TOASTER's data-handling throughput (ingest, 'toastit'
+    and diagnostics) end-to-end, using the stand-in PSRCHIVE tools
+    in 'fake_psrchive.py'.
+
+    A fresh database is created and filled with an observatory,
+    pulsars, master parfiles and master templates. Fake archives are
+    then loaded, reduced and diagnosed. For each phase, the total
+    wall-clock time is split into time spent in the (fake) external
+    tools and TOASTER's own overhead.
+
+    NOTE: The version fingerprint is computed once up-front, so the
+        pipeline's git checks are not included in the timings. Use
+        '--debug-gittest' to benchmark a tree with local changes.
+"""
+import os
+import os.path
+import json
+import time
+import shutil
+import random
+import tempfile
+import warnings
+
+from toaster import config
+from toaster import utils
+from toaster import errors
+from toaster.utils import notify
+from toaster.benchmarks import fake_psrchive
+from toaster.benchmarks import synthetic_db
+
+
+def setup_database(db, workdir, num_pulsars, rng):
+    """Fill an empty database with what is needed to load
+        and reduce fake archives.
+
+        Inputs:
+            db: A connected database object.
+            workdir: The directory to write parfiles and templates to.
+            num_pulsars: The number of pulsars.
+            rng: A random number generator.
+
+        Output:
+            psrnames: A list of the pulsars' names.
+    """
+    from toaster.toolkit.parfiles import load_parfile
+    from toaster.toolkit.templates import load_template
+    from toaster.utils import cache
+
+    import pwd
+    name, abbrev, code, aliases = synthetic_db.TELESCOPES[0]
+    frontend, freq, band = synthetic_db.FRONTENDS[0]
+    backend = synthetic_db.BACKENDS[0]
+    db.execute(db.users.insert(),
+               {'user_name': pwd.getpwuid(os.getuid())[0],
+                'real_name': 'Benchmark User',
+                'email_address': 'bench@example.org',
+                'active': True, 'admin': True}).close()
+    db.execute(db.telescopes.insert(),
+               {'telescope_id': 1, 'telescope_name': name,
+                'telescope_abbrev': abbrev, 'telescope_code': code,
+                'itrf_x': 0.0, 'itrf_y': 0.0, 'itrf_z': 0.0}).close()
+    db.execute(db.telescope_aliases.insert(),
+               [{'telescope_id': 1, 'telescope_alias': alias}
+                for alias in aliases]).close()
+    db.execute(db.obssystems.insert(),
+               {'obssystem_id': 1,
+                'name': "%s_%s_%s" % (abbrev, frontend, backend),
+                'telescope_id': 1, 'frontend': frontend,
+                'backend': backend, 'band_descriptor': band,
+                'clock': "%s_clock" % abbrev}).close()
+
+    psrnames = []
+    for psrid, (jname, bname) in \
+            enumerate(synthetic_db.get_pulsar_names(rng, num_pulsars), start=1):
+        db.execute(db.pulsars.insert(),
+                   {'pulsar_id': psrid, 'pulsar_name': jname}).close()
+        db.execute(db.pulsar_aliases.insert(),
+                   {'pulsar_id': psrid, 'pulsar_alias': jname}).close()
+        psrnames.append(jname)
+    for update in (cache.get_userid_cache, cache.get_pulsarid_cache,
+                   cache.get_pulsaralias_cache, cache.get_pulsarname_cache,
+                   cache.get_telescopeinfo_cache, cache.get_obssystemid_cache,
+                   cache.get_obssysinfo_cache):
+        update(db, update=True)
+
+    for psrname in psrnames:
+        parfn = os.path.join(workdir, "%s.par" % psrname)
+        with open(parfn, 'w') as ff:
+            ff.write("PSRJ %s\n" % psrname)
+            ff.write("RAJ %s:%s:00.0\n" % (psrname[1:3], psrname[3:5]))
+            ff.write("DECJ %s:%s:00.0\n" % (psrname[5:8], psrname[8:10]))
+            ff.write("F0 %.12f\n" % rng.uniform(1, 700))
+            ff.write("F1 %.6e\n" % -rng.uniform(1e-20, 1e-13))
+            ff.write("PEPOCH 56000\n")
+            ff.write("DM %.4f\n" % rng.uniform(2, 500))
+        load_parfile.load_parfile(parfn, is_master=True, existdb=db)
+
+        stdfn = os.path.join(workdir, "%s.std" % psrname)
+        fake_psrchive.make_fake_archive(stdfn, padding=4096, name=psrname,
+                                        nsub=1, nchan=1, npol=1)
+        load_template.load_template(stdfn, "Benchmark template",
+                                    is_master=True, existdb=db)
+    return psrnames
+
+
+def make_archives(workdir, psrnames, num_files, padding, nsub, nchan, rng):
+    """Write fake raw data files.
+
+        Inputs:
+            workdir: The directory to write the files to.
+            psrnames: The pulsars to write files for.
+            num_files: The number of files.
+            padding: The size of each file's data, in bytes.
+            nsub: The number of sub-integrations per file.
+            nchan: The number of channels per file.
+            rng: A random number generator.
+
+        Output:
+            fns: A list of the files' names.
+    """
+    fns = []
+    for ii in range(num_files):
+        psrname = psrnames[ii % len(psrnames)]
+        mjd = 56000 + rng.uniform(0, 3000)
+        fn = os.path.join(workdir, "%s_%.6f.ar" % (psrname, mjd))
+        fake_psrchive.make_fake_archive(fn, padding=padding, name=psrname,
+                                        mjd=mjd, nsub=nsub, nchan=nchan)
+        fns.append(fn)
+    return fns
+
+
+def run_phase(name, func, items, logfn):
+    """Run and time a benchmark phase.
+
+        Inputs:
+            name: The name of the phase.
+            func: The function to call for each item.
+            items: The items to process.
+            logfn: The fake tools' log file.
+
+        Outputs:
+            results: The return values of 'func'.
+            stats: A dictionary of timing statistics.
+    """
+    if os.path.exists(logfn):
+        os.remove(logfn)
+    notify.print_info("Running phase '%s' on %d items" % (name, len(items)), 1)
+    results = []
+    start = time.time()
+    for item in items:
+        results.append(func(item))
+    wall = time.time() - start
+    tools = fake_psrchive.summarize_log(logfn)
+    toolwall = sum([tool['wall'] for tool in tools.values()])
+    stats = {'items': len(items),
+             'wall': wall,
+             'per_item': wall/max(len(items), 1),
+             'tool_wall': toolwall,
+             'overhead': wall - toolwall,
+             'tools': tools}
+    print("%-12s %5d items  %8.3f s total  %7.3f s/item  "
+          "(tools: %7.3f s, TOASTER: %7.3f s)" %
+          (name, len(items), wall, stats['per_item'], toolwall,
+           stats['overhead']))
+    for toolname in sorted(tools):
+        print("    %-10s %6d calls %8.3f s" %
+              (toolname, tools[toolname]['calls'], tools[toolname]['wall']))
+    return results, stats
+
+
+def main():
+    workdir = tempfile.mkdtemp(prefix='toaster_bench', dir=args.workdir)
+    logfn = os.path.join(workdir, 'fake_tools.log')
+    rng = random.Random(args.seed)
+
+    dbfn = os.path.join(workdir, 'toaster_bench.db')
+    config.cfg['dburl'] = "sqlite:///%s" % dbfn
+    config.cfg['archive'] = True
+    config.cfg['move_on_archive'] = True
+    config.cfg['data_archive_location'] = os.path.join(workdir, 'archive')
+    config.cfg['base_tmp_dir'] = os.path.join(workdir, 'tmp')
+    os.makedirs(config.cfg.base_tmp_dir)
+
+    from toaster import database
+    from toaster import manipulators
+    from toaster import diagnostics
+    from toaster import toastit
+    from toaster.toolkit.rawfiles import load_rawfile
+    from toaster.toolkit.parfiles import general as parfiles_general
+    from toaster.toolkit.templates import general as templates_general
+    from toaster.utils import version
+    database.schema.metadata.create_all(database.get_toaster_engine())
+
+    results = {'date': utils.give_utc_now(),
+               'num_files': args.num_files,
+               'latency': args.latency,
+               'per_profile': args.per_profile,
+               'nsub': args.nsub,
+               'nchan': args.nchan,
+               'phases': {}}
+    try:
+        with fake_psrchive.installed(latency=args.latency,
+                                     per_profile=args.per_profile,
+                                     logfn=logfn) as bindir:
+            config.cfg['psrchive_dir'] = bindir
+            db = database.Database()
+            db.connect()
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', errors.ToasterWarning)
+                psrnames = setup_database(db, workdir, args.num_pulsars, rng)
+                version.warm_version_cache()
+            fns = make_archives(workdir, psrnames, args.num_files,
+                                args.padding, args.nsub, args.nchan, rng)
+
+            # Ingest
+            rawfile_ids, results['phases']['ingest'] = \
+                    run_phase('ingest', lambda fn: load_rawfile.load_rawfile(fn, db),
+                              fns, logfn)
+
+            # Reduction
+            def reduce_rawfile(rawfile_id):
+                rawinfo = toastit.rawfiles_general.get_rawfile_info(rawfile_id,
+                                                                    existdb=db)
+                parfile_id = parfiles_general.get_master_parfile(
+                                        rawinfo['pulsar_id'])[0]
+                template_id = templates_general.get_master_template(
+                                        rawinfo['pulsar_id'],
+                                        rawinfo['obssystem_id'],
+                                        existdb=db)[0]
+                manip = manipulators.load_manipulator(args.manip_name)
+                manip.parse_args(args.manip_args)
+                toastit.pipeline_core(manip, rawfile_id, parfile_id,
+                                      template_id, db)
+            junk, results['phases']['toastit'] = \
+                    run_phase('toastit', reduce_rawfile, rawfile_ids, logfn)
+
+            # Diagnostics
+            def diagnose(fn):
+                for diagname in diagnostics.registered_diagnostics:
+                    diagcls = diagnostics.get_diagnostic_class(diagname)
+                    try:
+                        diagcls(fn)
+                    except errors.DiagnosticNotApplicable:
+                        pass
+            archived = []
+            for rawfile_id in rawfile_ids:
+                archived.append(toastit.rawfiles_general.get_rawfile_from_id(
+                                        rawfile_id, db, verify_md5=False))
+            junk, results['phases']['diagnostics'] = \
+                    run_phase('diagnostics', diagnose, archived, logfn)
+            db.close()
+    finally:
+        if args.keep:
+            notify.print_info("Benchmark files kept in %s" % workdir, 1)
+        else:
+            shutil.rmtree(workdir)
+
+    if args.outfn is not None:
+        with open(args.outfn, 'w') as ff:
+            json.dump(results, ff, indent=2, sort_keys=True)
+        notify.print_info("Wrote results to %s" % args.outfn, 1)
+
+
+if __name__ == '__main__':
+    parser = utils.DefaultArguments(description="Benchmark ingest, "
+                                                "reduction and diagnostics "
+                                                "using stand-in PSRCHIVE "
+                                                "tools.")
+    parser.add_argument('-n', '--num-files', dest='num_files', type=int,
+                        default=20,
+                        help="Number of fake archives to process. "
+                             "(Default: 20)")
+    parser.add_argument('--num-pulsars', dest='num_pulsars', type=int,
+                        default=5,
+                        help="Number of pulsars. (Default: 5)")
+    parser.add_argument('--file-size', dest='padding', type=int,
+                        default=16*1024**2,
+                        help="Size of each fake archive's data, in bytes. "
+                             "(Default: 16 MB)")
+    parser.add_argument('--nsub', dest='nsub', type=int, default=16,
+                        help="Number of sub-integrations in each fake "
+                             "archive. (Default: 16)")
+    parser.add_argument('--nchan', dest='nchan', type=int, default=32,
+                        help="Number of channels in each fake archive. "
+                             "(Default: 32)")
+    parser.add_argument('--latency', dest='latency', type=float,
+                        default=0.0,
+                        help="Seconds each call to a fake tool takes. "
+                             "(Default: 0)")
+    parser.add_argument('--latency-per-profile', dest='per_profile',
+                        type=float, default=0.0,
+                        help="Extra seconds per profile for 'pam', 'pat' "
+                             "and 'psrstat'. (Default: 0)")
+    parser.add_argument('--manipulator', dest='manip_name', type=str,
+                        default='pamit',
+                        help="The manipulator to reduce data with. "
+                             "(Default: pamit)")
+    parser.add_argument('--manipulator-arg', dest='manip_args',
+                        action='append', default=[],
+                        help="An argument to pass to the manipulator. "
+                             "Multiple --manipulator-arg options can be "
+                             "provided.")
+    parser.add_argument('--workdir', dest='workdir', type=str, default=None,
+                        help="Directory in which to create the benchmark's "
+                             "working directory. (Default: a system-default "
+                             "temporary directory)")
+    parser.add_argument('--keep', dest='keep', action='store_true',
+                        default=False,
+                        help="Keep the working directory (DB, archive "
+                             "and diagnostics) when done.")
+    parser.add_argument('--seed', dest='seed', type=int, default=1,
+                        help="Random number generator seed. (Default: 1)")
+    parser.add_argument('-o', '--outfile', dest='outfn', type=str,
+                        default=None,
+                        help="File to write JSON results to.")
+    args = parser.parse_args()
+    main()
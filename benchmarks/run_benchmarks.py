@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+"""Time TOASTER's main query paths against a database
+    (typically one filled by 'synthetic_db.py').
+
+    Each benchmark is run several times, and the minimum, median and
+    mean wall-clock times are reported, along with the number of rows
+    returned. Results can be saved as JSON and compared against a
+    previously saved baseline to catch regressions.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import argparse
+import warnings
+
+from toaster import config
+from toaster import utils
+from toaster import errors
+from toaster.utils import notify
+
+
+def make_args(tool, argv):
+    """Build the arguments a toolkit tool would get from
+        its command line.
+
+        Inputs:
+            tool: The toolkit module.
+            argv: A list of command line arguments.
+
+        Output:
+            args: The parsed arguments.
+    """
+    parser = argparse.ArgumentParser()
+    tool.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def get_benchmarks(psrname, timfile_id):
+    """Return the list of benchmarks to run.
+
+        Inputs:
+            psrname: The pulsar to use for per-pulsar queries.
+            timfile_id: The timfile to use for timfile queries.
+
+        Output:
+            benchmarks: A list of (name, function) tuples. Each
+                function takes a DB object and returns the
+                number of rows it handled.
+    """
+    from toaster.toolkit.timfiles import create_timfile
+    from toaster.toolkit.timfiles import write_timfile
+    from toaster.toolkit.timfiles import describe_timfiles
+    from toaster.toolkit.rawfiles import get_rawfile_id
+    from toaster.toolkit.pulsars import show_pulsars
+    from toaster.toolkit.processing import describe_processing
+    from toaster.toolkit.toas import load_toa
+
+    def bench_create_timfile(db):
+        args = make_args(create_timfile, ['-p', psrname])
+        return len(create_timfile.get_toas(args, db))
+
+    def bench_write_timfile(db):
+        toas, timfile = write_timfile.get_timfile(timfile_id, db)
+        tmpfd, tmpfn = tempfile.mkstemp(suffix='.tim')
+        os.close(tmpfd)
+        try:
+            write_timfile.write_timfile(toas, timfile, outname=tmpfn)
+        finally:
+            os.remove(tmpfn)
+        return len(toas)
+
+    def bench_get_rawfiles(db):
+        args = make_args(get_rawfile_id, ['-p', psrname])
+        return len(get_rawfile_id.get_rawfiles(args))
+
+    def bench_get_pulsarinfo(db):
+        return len(show_pulsars.get_pulsarinfo(existdb=db))
+
+    def bench_get_timfiles(db):
+        return len(describe_timfiles.get_timfiles())
+
+    def bench_get_procjobs(db):
+        args = make_args(describe_processing, ['-p', psrname])
+        return len(describe_processing.get_procjobs(args, db))
+
+    def bench_load_toas(db):
+        # Copy existing TOAs, then roll back so the DB is left untouched
+        select = db.select([db.toas]).limit(1000)
+        result = db.execute(select)
+        toainfo = []
+        for row in result.fetchall():
+            values = dict(row)
+            del values['toa_id']
+            toainfo.append(values)
+        result.close()
+        trans = db.begin()
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', errors.ToasterWarning)
+                load_toa.load_toas(toainfo, db)
+        finally:
+            if db.open_transactions and db.open_transactions[-1] is trans:
+                db.rollback()
+        return len(toainfo)
+
+    return [('create_timfile.get_toas', bench_create_timfile),
+            ('write_timfile', bench_write_timfile),
+            ('get_rawfile_id.get_rawfiles', bench_get_rawfiles),
+            ('show_pulsars.get_pulsarinfo', bench_get_pulsarinfo),
+            ('describe_timfiles.get_timfiles', bench_get_timfiles),
+            ('describe_processing.get_procjobs', bench_get_procjobs),
+            ('load_toa.load_toas', bench_load_toas)]
+
+
+def pick_targets(db):
+    """Pick the pulsar with the most TOAs, and its largest timfile.
+
+        Input:
+            db: A connected database object.
+
+        Outputs:
+            psrname: The pulsar's name.
+            timfile_id: The timfile's ID.
+    """
+    import sqlalchemy as sa
+    numtoas = sa.func.count(db.toa_tim.c.toa_id).label('numtoas')
+    select = db.select([db.timfiles.c.timfile_id,
+                        db.pulsars.c.pulsar_name,
+                        numtoas],
+                from_obj=[db.timfiles.
+                          join(db.pulsars,
+                               db.pulsars.c.pulsar_id ==
+                               db.timfiles.c.pulsar_id).
+                          join(db.toa_tim,
+                               db.toa_tim.c.timfile_id ==
+                               db.timfiles.c.timfile_id)]).\
+                group_by(db.timfiles.c.timfile_id,
+                         db.pulsars.c.pulsar_name).\
+                order_by(numtoas.desc()).\
+                limit(1)
+    result = db.execute(select)
+    row = result.fetchone()
+    result.close()
+    if row is None:
+        raise errors.DatabaseError("The database has no timfiles to "
+                                   "benchmark. Was it filled using "
+                                   "'synthetic_db.py'?")
+    return row['pulsar_name'], row['timfile_id']
+
+
+def run_benchmark(func, db, repeat):
+    """Time a benchmark.
+
+        Inputs:
+            func: The benchmark function.
+            db: A connected database object.
+            repeat: The number of times to run the benchmark.
+
+        Output:
+            stats: A dictionary of timing statistics.
+    """
+    times = []
+    for ii in range(repeat):
+        start = time.time()
+        nrows = func(db)
+        times.append(time.time() - start)
+    times.sort()
+    if repeat % 2:
+        median = times[repeat//2]
+    else:
+        median = 0.5*(times[repeat//2-1] + times[repeat//2])
+    return {'min': times[0],
+            'median': median,
+            'mean': sum(times)/repeat,
+            'nrows': nrows,
+            'repeat': repeat}
+
+
+def compare(results, baseline, threshold):
+    """Print a comparison of results against a baseline.
+
+        Inputs:
+            results: The current results.
+            baseline: The baseline results.
+            threshold: The ratio above which a benchmark is
+                reported as a regression.
+
+        Output:
+            nregress: The number of regressions found.
+    """
+    nregress = 0
+    print("%-36s %10s %10s %8s" % ("Benchmark", "Base (s)", "Now (s)", "Ratio"))
+    for name in sorted(results['benchmarks']):
+        now = results['benchmarks'][name]['min']
+        if name not in baseline['benchmarks']:
+            print("%-36s %10s %10.4f %8s" % (name, '-', now, '-'))
+            continue
+        base = baseline['benchmarks'][name]['min']
+        ratio = now/base if base else float('inf')
+        flag = ""
+        if ratio > threshold:
+            flag = "  <-- REGRESSION"
+            nregress += 1
+        print("%-36s %10.4f %10.4f %8.2f%s" % (name, base, now, ratio, flag))
+    return nregress
+
+
+def main():
+    config.cfg['dburl'] = args.dburl
+    from toaster import database
+    db = database.Database()
+    db.connect()
+
+    psrname, timfile_id = pick_targets(db)
+    notify.print_info("Benchmarking with pulsar %s and timfile ID %d" %
+                      (psrname, timfile_id), 1)
+
+    results = {'dburl': args.dburl,
+               'date': utils.give_utc_now(),
+               'python': platform.python_version(),
+               'host': platform.node(),
+               'pulsar': psrname,
+               'timfile_id': timfile_id,
+               'benchmarks': {}}
+    for name, func in get_benchmarks(psrname, timfile_id):
+        if args.only and name not in args.only:
+            continue
+        notify.print_info("Running %s" % name, 2)
+        stats = run_benchmark(func, db, args.repeat)
+        results['benchmarks'][name] = stats
+        print("%-36s min=%.4f s median=%.4f s mean=%.4f s (%d rows)" %
+              (name, stats['min'], stats['median'], stats['mean'],
+               stats['nrows']))
+    db.close()
+
+    if args.outfn is not None:
+        with open(args.outfn, 'w') as ff:
+            json.dump(results, ff, indent=2, sort_keys=True)
+        notify.print_info("Wrote results to %s" % args.outfn, 1)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as ff:
+            baseline = json.load(ff)
+        nregress = compare(results, baseline, args.threshold)
+        if nregress:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = utils.DefaultArguments(description="Time TOASTER's main "
+                                                "query paths.")
+    parser.add_argument('--db-url', dest='dburl', type=str,
+                        default='sqlite:///toaster_bench.db',
+                        help="The URL of the database to benchmark. "
+                             "(Default: sqlite:///toaster_bench.db)")
+    parser.add_argument('--repeat', dest='repeat', type=int, default=5,
+                        help="Number of times to run each benchmark. "
+                             "(Default: 5)")
+    parser.add_argument('--only', dest='only', action='append',
+                        default=[],
+                        help="Only run the named benchmark. Multiple "
+                             "--only options can be provided.")
+    parser.add_argument('-o', '--outfile', dest='outfn', type=str,
+                        default=None,
+                        help="File to write JSON results to.")
+    parser.add_argument('--compare', dest='baseline', type=str,
+                        default=None,
+                        help="A JSON results file to compare against. "
+                             "Exit with a non-zero status if any "
+                             "benchmark regressed.")
+    parser.add_argument('--threshold', dest='threshold', type=float,
+                        default=1.25,
+                        help="Slow-down ratio (compared to the baseline) "
+                             "considered a regression. (Default: 1.25)")
+    args = parser.parse_args()
+    main()
@@ -0,0 +1,438 @@
+#!/usr/bin/env python
+"""Fill a database with synthetic, but realistically sized, TOASTER
+    content so the toolkit's query paths can be benchmarked.
+
+    The tables are created from 'database/schema.py'. Pulsars (with
+    aliases), telescopes, observing systems, parfiles, templates,
+    rawfiles, processing jobs, TOAs and timfiles are all generated
+    with a fixed random seed, so two databases generated with the
+    same arguments are identical.
+
+    NOTE: The files referred to by the database do not exist.
+"""
+import os
+import pwd
+import random
+import bisect
+import hashlib
+
+from toaster import config
+from toaster import utils
+from toaster import errors
+from toaster.utils import notify
+
+# Number of rows inserted per 'executemany'
+CHUNKSIZE = 20000
+
+TELESCOPES = [('Effelsberg', 'EFF', 'g', ['effelsberg', 'eff', 'g']),
+              ('Jodrell', 'JB', '8', ['jodrell', 'jb', '8', 'jbo']),
+              ('Nancay', 'NRT', 'f', ['nancay', 'ncy', 'f']),
+              ('WSRT', 'WSRT', 'i', ['wsrt', 'we', 'i']),
+              ('Sardinia', 'SRT', 'z', ['sardinia', 'srt', 'z'])]
+FRONTENDS = [('P217-3', 1380.0, 'L'), ('S110-1', 2640.0, 'S'),
+             ('P200-3', 1400.0, 'L'), ('7BEAM', 1360.0, 'L')]
+BACKENDS = ['PSRIX', 'ASTERIX', 'DFB', 'ROACH', 'BON']
+
+
+def get_pulsar_names(rng, num):
+    """Generate unique pulsar J-names, and B-names for some of them.
+    """
+    names = set()
+    pulsars = []
+    while len(pulsars) < num:
+        ra = "%02d%02d" % (rng.randint(0, 23), rng.randint(0, 59))
+        dec = "%+03d%02d" % (rng.randint(-89, 89), rng.randint(0, 59))
+        jname = "J%s%s" % (ra, dec)
+        if jname in names:
+            continue
+        names.add(jname)
+        if rng.random() < 0.2:
+            bname = "B%s%s" % (ra, dec[:3])
+            if bname in names:
+                bname = None
+            else:
+                names.add(bname)
+        else:
+            bname = None
+        pulsars.append((jname, bname))
+    return pulsars
+
+
+def weighted_choices(rng, population, weights, k):
+    """Choose 'k' elements of 'population' (with replacement),
+        with the given relative weights. This is how Python 3's
+        'random.choices' works, but is also available in Python 2.
+    """
+    cumweights = []
+    total = 0.0
+    for weight in weights:
+        total += weight
+        cumweights.append(total)
+    return [population[min(bisect.bisect(cumweights, rng.random()*total),
+                           len(population)-1)]
+            for ii in range(k)]
+
+
+def insert_rows(conn, table, rows):
+    """Insert rows in chunks. Return the number inserted.
+    """
+    for ii in range(0, len(rows), CHUNKSIZE):
+        conn.execute(table.insert(), rows[ii:ii+CHUNKSIZE])
+    return len(rows)
+
+
+def generate(engine, num_pulsars=2000, num_rawfiles=100000,
+             num_toas=10000000, num_timfiles=200, reprocess_frac=0.1,
+             seed=1):
+    """Generate synthetic DB content.
+
+        Inputs:
+            engine: The SQLAlchemy engine of the (empty) DB to fill.
+            num_pulsars: Number of pulsars. (Default: 2000)
+            num_rawfiles: Number of rawfiles. (Default: 10^5)
+            num_toas: Approximate number of TOAs. (Default: 10^7)
+            num_timfiles: Number of timfiles. (Default: 200)
+            reprocess_frac: Fraction of rawfiles that have been
+                processed twice. (Default: 0.1)
+            seed: Random number generator seed. (Default: 1)
+
+        Output:
+            counts: A dictionary of the number of rows per table.
+    """
+    from toaster.database import schema
+    tables = schema.metadata.tables
+    rng = random.Random(seed)
+    counts = {}
+
+    conn = engine.connect()
+    trans = conn.begin()
+    try:
+        # Users - the current user must exist for the toolkit to work
+        username = pwd.getpwuid(os.getuid())[0]
+        users = [{'user_id': 1, 'user_name': username,
+                  'real_name': 'Benchmark User',
+                  'email_address': 'bench@example.org',
+                  'active': True, 'admin': True}]
+        for ii in range(2, 21):
+            users.append({'user_id': ii, 'user_name': 'user%d' % ii,
+                          'real_name': 'Synthetic User %d' % ii,
+                          'email_address': 'user%d@example.org' % ii,
+                          'active': True, 'admin': False})
+        counts['users'] = insert_rows(conn, tables['users'], users)
+        userids = [user['user_id'] for user in users]
+
+        versions = []
+        for ii in range(1, 6):
+            versions.append({'version_id': ii,
+                             'pipeline_githash': hashlib.sha1(("pipe%d" % ii).encode()).hexdigest(),
+                             'psrchive_githash': hashlib.sha1(("psrchive%d" % ii).encode()).hexdigest(),
+                             'tempo2_cvsrevno': 'Not available'})
+        counts['versions'] = insert_rows(conn, tables['versions'], versions)
+
+        # Telescopes and observing systems
+        telescopes, telaliases, obssystems = [], [], []
+        for telid, (name, abbrev, code, aliases) in \
+                        enumerate(TELESCOPES, start=1):
+            telescopes.append({'telescope_id': telid,
+                               'telescope_name': name,
+                               'telescope_abbrev': abbrev,
+                               'telescope_code': code,
+                               'itrf_x': rng.uniform(-5e6, 5e6),
+                               'itrf_y': rng.uniform(-5e6, 5e6),
+                               'itrf_z': rng.uniform(-5e6, 5e6)})
+            for alias in aliases:
+                telaliases.append({'telescope_id': telid,
+                                   'telescope_alias': alias})
+            for frontend, freq, band in FRONTENDS:
+                for backend in BACKENDS:
+                    obssystems.append({'obssystem_id': len(obssystems)+1,
+                                       'name': "%s_%s_%s" % (abbrev, frontend, backend),
+                                       'telescope_id': telid,
+                                       'frontend': frontend,
+                                       'backend': backend,
+                                       'band_descriptor': band,
+                                       'clock': "%s_clock" % abbrev,
+                                       'freq': freq})
+        counts['telescopes'] = insert_rows(conn, tables['telescopes'], telescopes)
+        counts['telescope_aliases'] = insert_rows(conn, tables['telescope_aliases'],
+                                                  telaliases)
+        obssysfreqs = dict((obssys['obssystem_id'], obssys.pop('freq'))
+                           for obssys in obssystems)
+        counts['obssystems'] = insert_rows(conn, tables['obssystems'], obssystems)
+        obssysinfo = dict((obssys['obssystem_id'], obssys) for obssys in obssystems)
+        telnames = dict((tel['telescope_id'], tel['telescope_name'])
+                        for tel in telescopes)
+
+        # Pulsars and aliases
+        pulsars, psraliases, parfiles, masterpars = [], [], [], []
+        psrnames = {}
+        for psrid, (jname, bname) in \
+                enumerate(get_pulsar_names(rng, num_pulsars), start=1):
+            pulsars.append({'pulsar_id': psrid, 'pulsar_name': jname})
+            psrnames[psrid] = jname
+            for alias in (jname, bname, jname.lower()):
+                if alias is not None:
+                    psraliases.append({'pulsar_id': psrid,
+                                       'pulsar_alias': alias})
+            f0 = rng.uniform(1, 700)
+            dm = rng.uniform(2, 500)
+            for ii in range(rng.randint(1, 3)):
+                parid = len(parfiles)+1
+                parfiles.append({'parfile_id': parid,
+                                 'filename': "%s_%d.par" % (jname, parid),
+                                 'filepath': "/archive/parfiles/%s" % jname,
+                                 'md5sum': hashlib.md5(("par%d" % parid).encode()).hexdigest(),
+                                 'user_id': rng.choice(userids),
+                                 'pulsar_id': psrid,
+                                 'psrj': jname,
+                                 'raj': "%s:%s:00.0" % (jname[1:3], jname[3:5]),
+                                 'decj': "%s:%s:00.0" % (jname[5:8], jname[8:10]),
+                                 'f0': f0, 'f1': -rng.uniform(1e-20, 1e-13),
+                                 'dm': dm, 'pepoch': 55000.0})
+            masterpars.append({'parfile_id': parid, 'pulsar_id': psrid})
+        counts['pulsars'] = insert_rows(conn, tables['pulsars'], pulsars)
+        counts['pulsar_aliases'] = insert_rows(conn, tables['pulsar_aliases'],
+                                               psraliases)
+        counts['parfiles'] = insert_rows(conn, tables['parfiles'], parfiles)
+        counts['master_parfiles'] = insert_rows(conn, tables['master_parfiles'],
+                                                masterpars)
+        psr_parids = {}
+        for par in parfiles:
+            psr_parids.setdefault(par['pulsar_id'], []).append(par['parfile_id'])
+
+        # Some pulsars are observed much more often than others
+        weights = [1.0/(ii**0.8) for ii in range(1, num_pulsars+1)]
+        rng.shuffle(weights)
+        # Each pulsar is observed with a handful of observing systems
+        psr_obssys = {}
+        for psrid in psrnames:
+            psr_obssys[psrid] = rng.sample(sorted(obssysinfo),
+                                           rng.randint(1, 4))
+
+        # Templates - one per pulsar/obssystem, the last one is the master
+        templates, mastertemps = [], []
+        psrobs_tempid = {}
+        for psrid in sorted(psr_obssys):
+            for obssysid in psr_obssys[psrid]:
+                for ii in range(rng.randint(1, 2)):
+                    tempid = len(templates)+1
+                    templates.append({'template_id': tempid,
+                                      'pulsar_id': psrid,
+                                      'obssystem_id': obssysid,
+                                      'user_id': rng.choice(userids),
+                                      'nbin': 1024,
+                                      'filepath': "/archive/templates/%s" %
+                                                  psrnames[psrid],
+                                      'filename': "%s_%d.std" %
+                                                  (psrnames[psrid], tempid),
+                                      'md5sum': hashlib.md5(("temp%d" % tempid).encode()).hexdigest(),
+                                      'comments': 'Synthetic template'})
+                psrobs_tempid[(psrid, obssysid)] = tempid
+                mastertemps.append({'template_id': tempid,
+                                    'pulsar_id': psrid,
+                                    'obssystem_id': obssysid})
+        counts['templates'] = insert_rows(conn, tables['templates'], templates)
+        counts['master_templates'] = insert_rows(conn, tables['master_templates'],
+                                                 mastertemps)
+
+        # Rawfiles
+        rawfiles = []
+        psrids = sorted(psrnames)
+        rawpsrids = weighted_choices(rng, psrids, weights, num_rawfiles)
+        for rawid, psrid in enumerate(rawpsrids, start=1):
+            obssysid = rng.choice(psr_obssys[psrid])
+            obssys = obssysinfo[obssysid]
+            mjd = rng.uniform(50000, 59000)
+            nchan = rng.choice([1, 8, 16, 32])
+            nsub = rng.choice([1, 2, 4, 8])
+            rawfiles.append({'rawfile_id': rawid,
+                             'filename': "%s_%s_%.6f.ar" %
+                                         (psrnames[psrid], obssys['backend'], mjd),
+                             'filepath': "/archive/%s/%s/%s" %
+                                         (psrnames[psrid].upper(),
+                                          telnames[obssys['telescope_id']].lower(),
+                                          obssys['frontend'].lower()),
+                             'filesize': rng.randint(10**6, 2*10**9),
+                             'md5sum': hashlib.md5(("raw%d" % rawid).encode()).hexdigest(),
+                             'user_id': rng.choice(userids),
+                             'pulsar_id': psrid,
+                             'obssystem_id': obssysid,
+                             'nbin': rng.choice([256, 512, 1024]),
+                             'nchan': nchan,
+                             'npol': rng.choice([1, 4]),
+                             'nsub': nsub,
+                             'type': 'Pulsar',
+                             'telescop': telnames[obssys['telescope_id']],
+                             'name': psrnames[psrid],
+                             'freq': obssysfreqs[obssysid],
+                             'bw': rng.choice([100.0, 200.0, 400.0]),
+                             'dm': rng.uniform(2, 500),
+                             'length': rng.uniform(60, 3600),
+                             'mjd': mjd,
+                             'rcvr': obssys['frontend'],
+                             'backend': obssys['backend']})
+        counts['rawfiles'] = insert_rows(conn, tables['rawfiles'], rawfiles)
+        notify.print_info("Inserted %d rawfiles" % len(rawfiles), 1)
+
+        # A few rawfiles have been replaced
+        replacements = []
+        for obsolete in rng.sample(range(1, num_rawfiles), num_rawfiles//200):
+            replacements.append({'obsolete_rawfile_id': obsolete,
+                                 'replacement_rawfile_id': obsolete+1,
+                                 'user_id': rng.choice(userids),
+                                 'comments': 'Synthetic replacement'})
+        counts['replacement_rawfiles'] = insert_rows(conn,
+                                                     tables['replacement_rawfiles'],
+                                                     replacements)
+
+        # Processing jobs - every rawfile is processed at least once
+        procjobs = []
+        for raw in rawfiles:
+            nproc = 2 if rng.random() < reprocess_frac else 1
+            for ii in range(nproc):
+                procjobs.append({'process_id': len(procjobs)+1,
+                                 'version_id': rng.choice(versions)['version_id'],
+                                 'rawfile_id': raw['rawfile_id'],
+                                 'template_id': psrobs_tempid[(raw['pulsar_id'],
+                                                               raw['obssystem_id'])],
+                                 'parfile_id': rng.choice(psr_parids[raw['pulsar_id']]),
+                                 'user_id': rng.choice(userids),
+                                 'manipulator': 'pamit',
+                                 'manipulator_args': "--nsub %d --nchan %d" %
+                                                     (raw['nsub'], raw['nchan']),
+                                 'nchan': raw['nchan'],
+                                 'nsub': raw['nsub'],
+                                 'toa_fitting_method': 'FDM'})
+        counts['process'] = insert_rows(conn, tables['process'], procjobs)
+        notify.print_info("Inserted %d processing jobs" % len(procjobs), 1)
+
+        # TOAs - spread (approximately) num_toas over the processing jobs
+        rawinfo = dict((raw['rawfile_id'], raw) for raw in rawfiles)
+        toas_per_job = float(num_toas)/len(procjobs)
+        toas = []
+        toaid = 0
+        psr_toaids = {}
+        for proc in procjobs:
+            raw = rawinfo[proc['rawfile_id']]
+            ntoas = int(toas_per_job) + (rng.random() < (toas_per_job % 1))
+            for ii in range(ntoas):
+                toaid += 1
+                toas.append({'toa_id': toaid,
+                             'process_id': proc['process_id'],
+                             'template_id': proc['template_id'],
+                             'rawfile_id': proc['rawfile_id'],
+                             'pulsar_id': raw['pulsar_id'],
+                             'obssystem_id': raw['obssystem_id'],
+                             'imjd': int(raw['mjd']),
+                             'fmjd': raw['mjd'] % 1 + ii*1e-5,
+                             'freq': raw['freq'] - raw['bw']/2.0 +
+                                     raw['bw']*(ii % raw['nchan'] + 0.5)/raw['nchan'],
+                             'toa_unc_us': rng.uniform(0.1, 50),
+                             'bw': raw['bw']/raw['nchan'],
+                             'length': raw['length']/raw['nsub'],
+                             'nbin': raw['nbin'],
+                             'goodness_of_fit': rng.uniform(0.8, 1.5)})
+                psr_toaids.setdefault(raw['pulsar_id'], []).append(toaid)
+            if len(toas) >= CHUNKSIZE:
+                insert_rows(conn, tables['toas'], toas)
+                toas = []
+        insert_rows(conn, tables['toas'], toas)
+        counts['toas'] = toaid
+        notify.print_info("Inserted %d TOAs" % toaid, 1)
+
+        # Timfiles - for the pulsars with the most TOAs
+        timfiles, mastertims = [], []
+        bypopularity = sorted(psr_toaids, key=lambda psrid: len(psr_toaids[psrid]),
+                              reverse=True)
+        numtoatim = 0
+        for timid in range(1, num_timfiles+1):
+            psrid = bypopularity[(timid-1) % len(bypopularity)]
+            timfiles.append({'timfile_id': timid,
+                             'user_id': rng.choice(userids),
+                             'comments': 'Synthetic timfile %d' % timid,
+                             'version_id': rng.choice(versions)['version_id'],
+                             'pulsar_id': psrid,
+                             'input_args': 'create_timfile.py -p %s' %
+                                           psrnames[psrid]})
+            if timid <= len(bypopularity):
+                mastertims.append({'timfile_id': timid, 'pulsar_id': psrid})
+        counts['timfiles'] = insert_rows(conn, tables['timfiles'], timfiles)
+        for tim in timfiles:
+            toaids = psr_toaids[tim['pulsar_id']]
+            for ii in range(0, len(toaids), CHUNKSIZE):
+                rows = [{'timfile_id': tim['timfile_id'], 'toa_id': timtoaid}
+                        for timtoaid in toaids[ii:ii+CHUNKSIZE]]
+                numtoatim += insert_rows(conn, tables['toa_tim'], rows)
+        counts['toa_tim'] = numtoatim
+        counts['master_timfiles'] = insert_rows(conn, tables['master_timfiles'],
+                                                mastertims)
+    except:
+        trans.rollback()
+        raise
+    else:
+        trans.commit()
+    finally:
+        conn.close()
+    return counts
+
+
+def main():
+    # Point TOASTER at the benchmark DB before any engine is created
+    config.cfg['dburl'] = args.dburl
+    from toaster import database
+    engine = database.get_toaster_engine(args.dburl)
+    schema = database.schema
+    if engine.table_names():
+        if not args.overwrite:
+            raise errors.DatabaseError("The database (%s) already has "
+                                       "tables. Use --overwrite to "
+                                       "replace its content." % args.dburl)
+        schema.metadata.drop_all(engine)
+    schema.metadata.create_all(engine)
+    if engine.dialect.name == 'sqlite':
+        # Durability is irrelevant for a throw-away DB
+        engine.execute("PRAGMA synchronous=OFF")
+        engine.execute("PRAGMA journal_mode=MEMORY")
+
+    notify.print_info("Generating synthetic DB at %s (%s)" %
+                      (args.dburl, utils.give_utc_now()), 1)
+    counts = generate(engine, args.num_pulsars, args.num_rawfiles,
+                      args.num_toas, args.num_timfiles,
+                      args.reprocess_frac, args.seed)
+    for table in sorted(counts):
+        print("%s: %d rows" % (table, counts[table]))
+    notify.print_success("Synthetic DB created (%s)" % utils.give_utc_now())
+
+
+if __name__ == '__main__':
+    parser = utils.DefaultArguments(description="Fill a database with "
+                                                "synthetic TOASTER content "
+                                                "for benchmarking.")
+    parser.add_argument('--db-url', dest='dburl', type=str,
+                        default='sqlite:///toaster_bench.db',
+                        help="The URL of the database to fill. "
+                             "(Default: sqlite:///toaster_bench.db)")
+    parser.add_argument('--overwrite', dest='overwrite',
+                        action='store_true', default=False,
+                        help="Drop existing tables before filling the DB.")
+    parser.add_argument('--num-pulsars', dest='num_pulsars', type=int,
+                        default=2000,
+                        help="Number of pulsars. (Default: 2000)")
+    parser.add_argument('--num-rawfiles', dest='num_rawfiles', type=int,
+                        default=100000,
+                        help="Number of rawfiles. (Default: 100000)")
+    parser.add_argument('--num-toas', dest='num_toas', type=int,
+                        default=10000000,
+                        help="Approximate number of TOAs. "
+                             "(Default: 10000000)")
+    parser.add_argument('--num-timfiles', dest='num_timfiles', type=int,
+                        default=200,
+                        help="Number of timfiles. (Default: 200)")
+    parser.add_argument('--reprocess-fraction', dest='reprocess_frac',
+                        type=float, default=0.1,
+                        help="Fraction of rawfiles processed twice. "
+                             "(Default: 0.1)")
+    parser.add_argument('--seed', dest='seed', type=int, default=1,
+                        help="Random number generator seed. (Default: 1)")
+    args = parser.parse_args()
+    main()
@@ -3,10 +3,9 @@ import glob
 import tempfile
 import warnings
 
-import config
-
-import errors
-import utils
+from toaster import errors
+from toaster import utils
+from toaster.utils import datafile
 
 
 def get_header_params(fn):
@@ -21,7 +20,7 @@ def get_header_params(fn):
                 the values are the values reported by 'psredit'.
     """
     params_to_get = ['rcvr', 'backend', 'telescop']
-    return utils.get_header_vals(fn, params_to_get)
+    return datafile.get_header_vals(fn, params_to_get)
 
 
 def correct_header(fn, rcvr=None, backend=None):
@@ -51,6 +50,8 @@ def correct_header(fn, rcvr=None, backend=None):
                         errors.ToasterWarning)
     else:
         stdout, stderr = utils.execute(cmd)
+        # The header params read before are no longer valid
+        datafile.clear_header_cache(fn)
 
 
 def main():
@@ -98,6 +98,8 @@ def begin_event(conn):
 
 # Cache of database engines
 engines = {}
+# URLs of databases that have already been checked for tables
+verified_urls = set()
 
 
 def get_toaster_engine(url=None):
@@ -134,12 +136,15 @@ class Database(object):
         self.conn = None  # No connection is established
                           # until self.connect() is called
         self.engine = get_toaster_engine()
-        if not self.is_created():
-            raise errors.DatabaseError("The database (%s) does not appear "
-                                       "to have any tables. Be sure to run "
-                                       "'create_tables.py' before attempting "
-                                       "to connect to the database." %
-                                       self.engine.url.database)
+        # Only inspect the schema the first time a database is used
+        if str(self.engine.url) not in verified_urls:
+            if not self.is_created():
+                raise errors.DatabaseError("The database (%s) does not appear "
+                                           "to have any tables. Be sure to run "
+                                           "'create_tables.py' before attempting "
+                                           "to connect to the database." %
+                                           self.engine.url.database)
+            verified_urls.add(str(self.engine.url))
         self.autocommit = autocommit
 
         # The database description (metadata)
@@ -200,6 +205,8 @@ class Database(object):
             self.conn = self.engine.connect()
             self.conn.execution_options(autocommit=self.autocommit)
             self.open_transactions = []
+            # Functions to call if each open transaction is rolled back
+            self.rollback_callbacks = []
             self.result = None
             if self.engine.dialect.name == 'sqlite':
                 result = self.execute("PRAGMA foreign_keys=ON")
@@ -256,6 +263,7 @@ class Database(object):
                           errors.ToasterWarning)
         trans = self.conn.begin()
         self.open_transactions.append(trans)
+        self.rollback_callbacks.append([])
         return trans
 
     def commit(self):
@@ -274,6 +282,10 @@ class Database(object):
         else:
             raise errors.DatabaseError("Cannot commit. No open database transactions.")
         trans.commit()
+        callbacks = self.rollback_callbacks.pop()
+        if self.rollback_callbacks:
+            # The enclosing transaction may still be rolled back
+            self.rollback_callbacks[-1].extend(callbacks)
 
     def rollback(self):
         """Roll back the most recently opened transaction.
@@ -288,6 +300,43 @@ class Database(object):
                            "database object", 'database', stepsback=2)
         trans = self.open_transactions.pop()
         trans.rollback()
+        callbacks = self.rollback_callbacks.pop()
+        while callbacks:
+            func, args = callbacks.pop()
+            func(*args)
+
+    def on_rollback(self, func, *args):
+        """Arrange for a function to be called if the current
+            transaction is rolled back (e.g. to remove a file that
+            was created for rows inserted by the transaction).
+            Nothing is done if no transaction is open, since changes
+            are then committed straight away.
+
+            Inputs:
+                func: The function to call.
+                *args: Arguments to call the function with.
+
+            Outputs:
+                None
+        """
+        if self.open_transactions:
+            self.rollback_callbacks[-1].append((func, args))
+
+    def get_current_time(self):
+        """Return the database server's current time. Times that
+            are compared between hosts (e.g. lease expiry times) should
+            use this, rather than each host's clock.
+
+            Inputs:
+                None
+
+            Output:
+                now: The current time (a datetime.datetime object).
+        """
+        result = self.execute(self.select([sa.func.now()]))
+        now = result.scalar()
+        result.close()
+        return now
 
     def close(self):
         """Close the established connection. 
@@ -103,6 +103,10 @@ sa.Table('process', metadata,
          sa.Column('nchan', sa.Integer, nullable=False),
          sa.Column('nsub', sa.Integer, nullable=False),
          sa.Column('toa_fitting_method', sa.String(12), nullable=False),
+         # Identifies the inputs/configuration of the processing job
+         # (see 'get_processing_fingerprint' in 'toastit.py')
+         sa.Column('fingerprint', sa.String(64), nullable=True,
+                   index=True),
          mysql_engine='InnoDB', mysql_charset='ascii')
 
 # Define toa_diagnostics table
@@ -359,6 +363,103 @@ sa.Table('proc_diagnostic_plots', metadata,
          sa.UniqueConstraint('process_id', 'plot_type'),
          mysql_engine='InnoDB', mysql_charset='ascii')
 
+# Define proc_diagnostics_queue table
+# (processing diagnostics still to be computed for a processing
+# job, see 'toolkit/processing/diagnose_processing.py')
+sa.Table('proc_diagnostics_queue', metadata,
+         sa.Column('proc_diagnostics_queue_id', sa.Integer, primary_key=True,
+                   autoincrement=True, nullable=False),
+         sa.Column('process_id', sa.Integer,
+                   sa.ForeignKey("process.process_id", name="fk_procdiagqueue_proc"),
+                   nullable=False, unique=True),
+         # Comma-separated list of diagnostic names
+         sa.Column('diagnostics', sa.String(256), nullable=False),
+         # The manipulated archive to compute diagnostics for
+         sa.Column('filename', sa.String(256), nullable=False),
+         sa.Column('filepath', sa.String(512), nullable=False),
+         sa.Column('suffix', sa.String(64), nullable=False),
+         sa.Column('status', sa.String(16), nullable=False,
+                   default='pending'),
+         sa.Column('message', sa.Text, nullable=True),
+         sa.Column('add_time', sa.DateTime, nullable=False,
+                   default=sa.func.now()),
+         sa.Column('start_time', sa.DateTime, nullable=True),
+         sa.Column('finish_time', sa.DateTime, nullable=True),
+         sa.Index('idx_procdiagqueue_status', 'status'),
+         mysql_engine='InnoDB', mysql_charset='ascii')
+
+# Define processing_jobs table
+# (processing jobs queued for 'toaster_worker.py', see
+# 'toolkit/processing/processing_jobs.py')
+sa.Table('processing_jobs', metadata,
+         sa.Column('processing_job_id', sa.Integer, primary_key=True,
+                   autoincrement=True, nullable=False),
+         sa.Column('rawfile_id', sa.Integer,
+                   sa.ForeignKey("rawfiles.rawfile_id", name="fk_procjob_raw"),
+                   nullable=False),
+         sa.Column('parfile_id', sa.Integer,
+                   sa.ForeignKey("parfiles.parfile_id", name="fk_procjob_par"),
+                   nullable=True),
+         sa.Column('template_id', sa.Integer,
+                   sa.ForeignKey("templates.template_id",
+                                 name="fk_procjob_temp"),
+                   nullable=False),
+         # The raw file's pulsar (used to share workers between pulsars)
+         sa.Column('pulsar_id', sa.Integer,
+                   sa.ForeignKey("pulsars.pulsar_id", name="fk_procjob_psr"),
+                   nullable=True),
+         sa.Column('manipulator', sa.String(32), nullable=False),
+         sa.Column('manipulator_args', sa.String(512), nullable=False,
+                   default=''),
+         sa.Column('force', sa.Boolean, nullable=False, default=False),
+         # Jobs with higher priority are claimed first
+         sa.Column('priority', sa.Integer, nullable=False, default=0),
+         # The host the raw file is local to (see 'utils/locality.py')
+         sa.Column('locality', sa.String(64), nullable=True),
+         sa.Column('status', sa.String(16), nullable=False,
+                   default='queued'),
+         # The number of times the job has been claimed
+         sa.Column('attempts', sa.Integer, nullable=False, default=0),
+         sa.Column('max_attempts', sa.Integer, nullable=False, default=3),
+         # The worker (host:pid) that claimed the job, and when
+         # its claim expires if it isn't renewed
+         sa.Column('worker', sa.String(128), nullable=True),
+         sa.Column('lease_expires', sa.DateTime, nullable=True),
+         sa.Column('process_id', sa.Integer,
+                   sa.ForeignKey("process.process_id", name="fk_procjob_proc"),
+                   nullable=True),
+         sa.Column('message', sa.Text, nullable=True),
+         sa.Column('user_id', sa.Integer,
+                   sa.ForeignKey("users.user_id", name="fk_procjob_user"),
+                   nullable=False),
+         sa.Column('add_time', sa.DateTime, nullable=False,
+                   default=sa.func.now()),
+         sa.Column('start_time', sa.DateTime, nullable=True),
+         sa.Column('finish_time', sa.DateTime, nullable=True),
+         sa.Index('idx_procjob_status', 'status'),
+         sa.Index('idx_procjob_locality', 'locality'),
+         sa.Index('idx_procjob_priority', 'priority'),
+         mysql_engine='InnoDB', mysql_charset='ascii')
+
+# Define header_cache table
+# (header params read from archives, see 'utils/datafile.py')
+sa.Table('header_cache', metadata,
+         sa.Column('header_cache_id', sa.Integer, primary_key=True,
+                   autoincrement=True, nullable=False),
+         # SHA-1 of the file's absolute path
+         sa.Column('path_hash', sa.String(40), nullable=False,
+                   unique=True),
+         sa.Column('filename', sa.String(256), nullable=False),
+         sa.Column('filepath', sa.String(512), nullable=False),
+         sa.Column('inode', sa.BigInteger, nullable=False),
+         sa.Column('filesize', sa.BigInteger, nullable=False),
+         sa.Column('mtime', sa.Float(53), nullable=False),
+         # JSON-encoded dictionary of header params
+         sa.Column('header', sa.Text, nullable=False),
+         sa.Column('add_time', sa.DateTime, nullable=False,
+                   default=sa.func.now()),
+         mysql_engine='InnoDB', mysql_charset='ascii')
+
 # Define parfiles table
 sa.Table('parfiles', metadata,
          sa.Column('parfile_id', sa.Integer, primary_key=True,
@@ -463,3 +564,37 @@ sa.Table('master_parfiles', metadata,
                    sa.ForeignKey('pulsars.pulsar_id', name="fk_mp_psr"),
                    nullable=False, unique=True),
          mysql_engine='InnoDB', mysql_charset='ascii')
+
+# Create syscall_usage table
+# (resources used by external commands, see 'utils/sysusage.py')
+sa.Table('syscall_usage', metadata,
+         sa.Column('syscall_usage_id', sa.Integer, primary_key=True,
+                   autoincrement=True, nullable=False),
+         sa.Column('run_id', sa.String(64), nullable=False),
+         sa.Column('program', sa.String(64), nullable=False),
+         sa.Column('command', sa.String(64), nullable=False),
+         sa.Column('cmdline', sa.Text, nullable=False),
+         sa.Column('caller', sa.String(128), nullable=False),
+         sa.Column('exit_status', sa.Integer, nullable=False),
+         sa.Column('wall', sa.Float(53), nullable=False),
+         sa.Column('utime', sa.Float(53), nullable=True),
+         sa.Column('stime', sa.Float(53), nullable=True),
+         sa.Column('maxrss_kb', sa.Integer, nullable=True),
+         sa.Column('add_time', sa.DateTime, nullable=False,
+                   default=sa.func.now()),
+         sa.Index('idx_syscall_usage_run', 'run_id'),
+         mysql_engine='InnoDB', mysql_charset='ascii')
+
+# Create process_timings table
+# (wall-clock time of each stage of a processing run, see
+# 'utils/timing.py')
+sa.Table('process_timings', metadata,
+         sa.Column('process_timing_id', sa.Integer, primary_key=True,
+                   autoincrement=True, nullable=False),
+         sa.Column('process_id', sa.Integer,
+                   sa.ForeignKey("process.process_id", name="fk_proctime_proc"),
+                   nullable=False),
+         sa.Column('stage', sa.String(32), nullable=False),
+         sa.Column('seconds', sa.Float(53), nullable=False),
+         sa.UniqueConstraint('process_id', 'stage'),
+         mysql_engine='InnoDB', mysql_charset='ascii')
@@ -18,6 +18,25 @@ MODE_DEFS = {'syscalls': 'Print commands being executed as system calls.',
              'config': "Display what config files are loaded.",
              'database': "Display DB connection/transaction info.",
              'toaparse': "Display info when parsing TOAs from timfiles.",
+             'staging': "Display how files are staged (reflinked, "
+                        "hardlinked or copied) through the pipeline.",
+             'sysusage': "Display resources used by each external "
+                         "command, and a summary when exiting.",
+             'diagnostics': "Display how diagnostics are computed.",
+             'diskcache': "Display hits, misses and evictions of "
+                          "on-disk caches (e.g. of manipulated archives).",
+             'headers': "Display how file headers are read and cached.",
+             'backends': "Display which archive backend is used.",
+             'locality': "Display which host files are local to, and "
+                         "how processing jobs are claimed.",
+             'journal': "Display how batch journals (--resume) are "
+                        "read.",
+             'timing': "Display the time spent in each stage of the "
+                       "pipeline.",
+             'scratch': "Display how scratch space is reserved and "
+                        "released.",
+             'scheduling': "Display how processing jobs are ordered by "
+                           "priority, fair-share and manipulator caps.",
              'timfile': None}
 
 ONMODES = {}
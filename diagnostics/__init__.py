@@ -1,10 +1,21 @@
 import os.path
+import sys
+import json
+import pickle
+import traceback
+import tempfile
+import warnings
+import multiprocessing
 
 from toaster import config
 from toaster import errors
+from toaster import database
 from toaster.diagnostics import base
 from toaster.utils import datafile
 from toaster.utils import notify
+from toaster.utils import sysusage
+from toaster.utils import diskcache
+from toaster.utils import version
 
 
 registered_diagnostics = ['composite',
@@ -16,6 +27,9 @@ registered_diagnostics = ['composite',
                           'masked_percentage',
                           ]
 
+# PSRCHIVE's version (for identifying cached diagnostic results)
+psrchive_version_cache = {}
+
 
 def get_diagnostic_class(diagnostic_name):
     """Given a diagnostic name return the corresponding diagnostic
@@ -39,6 +53,358 @@ def get_diagnostic_class(diagnostic_name):
     return diagcls
 
 
+def get_diagnostic_cache():
+    """Return the cache of diagnostic results.
+
+        Inputs:
+            None
+
+        Output:
+            diagcache: A DiskCache object. None if the cache
+                is disabled.
+    """
+    if not config.cfg.diagnostic_cache_dir:
+        return None
+    return diskcache.DiskCache(config.cfg.diagnostic_cache_dir,
+                               config.cfg.diagnostic_cache_max_size,
+                               name='diagnostic')
+
+
+def get_psrchive_version():
+    """Return PSRCHIVE's version, for identifying cached diagnostics.
+
+        Inputs:
+            None
+
+        Output:
+            psrchive_version: PSRCHIVE's git hash (or version string).
+                None if it cannot be determined.
+    """
+    if 'psrchive' not in psrchive_version_cache:
+        try:
+            psrchive_version_cache['psrchive'] = \
+                    version.get_version_fingerprint()[1]
+        except errors.ToasterError as exc:
+            warnings.warn("Cannot determine PSRCHIVE's version (%s). "
+                          "Diagnostic results will not be cached." % str(exc),
+                          errors.ToasterWarning)
+            psrchive_version_cache['psrchive'] = None
+    return psrchive_version_cache['psrchive']
+
+
+def get_diagnostic_cache_key(diag, md5sum, psrchive_version):
+    """Return the key identifying a diagnostic's result in the cache.
+
+        Inputs:
+            diag: The diagnostic object.
+            md5sum: The MD5 sum of the diagnosed file.
+            psrchive_version: PSRCHIVE's version.
+
+        Output:
+            key: The cache key.
+    """
+    return "|".join([md5sum, diag.name, str(diag.version),
+                     psrchive_version])
+
+
+def get_diagnostic_workdir(workdir=None):
+    """Return the directory that cached diagnostic plots are
+        restored into.
+
+        Input:
+            workdir: The caller's work directory.
+                (Default: 'base_tmp_dir', or the system's
+                temporary directory)
+
+        Output:
+            workdir: The directory.
+    """
+    if workdir is None:
+        workdir = config.cfg.base_tmp_dir or tempfile.gettempdir()
+    return workdir
+
+
+def fetch_cached_diagnostic(diagcache, diag, key, workdir=None):
+    """Set a diagnostic's value from the cache.
+
+        Inputs:
+            diagcache: The DiskCache object.
+            diag: The diagnostic object.
+            key: The diagnostic's cache key.
+            workdir: The directory to restore cached plots into.
+                (Default: see 'get_diagnostic_workdir')
+
+        Output:
+            hit: True if the diagnostic's value was found in the cache.
+    """
+    data = diagcache.fetch_data(key)
+    if data is None:
+        return False
+    entry = json.loads(data)
+    if entry['type'] == 'float':
+        diag.set_diagnostic(entry['value'])
+    else:
+        # Re-create the plot, named as the diagnostic would name it
+        if entry['relative']:
+            plotfn = os.path.basename(diag.fn) + entry['plotname']
+        else:
+            plotfn = entry['plotname']
+        plotfn = os.path.join(get_diagnostic_workdir(workdir), plotfn)
+        if not diagcache.fetch(key + "|plot", plotfn):
+            return False
+        diag.set_diagnostic(plotfn)
+    notify.print_debug("Using cached '%s' diagnostic for %s" %
+                       (diag.name, diag.fn), 'diagnostics')
+    return True
+
+
+def store_cached_diagnostic(diagcache, diag, key):
+    """Add a computed diagnostic's value to the cache.
+
+        Inputs:
+            diagcache: The DiskCache object.
+            diag: The diagnostic object.
+            key: The diagnostic's cache key.
+
+        Outputs:
+            None
+    """
+    if isinstance(diag, base.PlotDiagnostic):
+        # Plots are named after the diagnosed file. Store the
+        # rest of the name so it can be re-created for other files.
+        plotname = os.path.basename(diag.diagnostic)
+        archivefn = os.path.basename(diag.fn)
+        relative = plotname.startswith(archivefn)
+        if relative:
+            plotname = plotname[len(archivefn):]
+        diagcache.put(key + "|plot", diag.diagnostic)
+        entry = {'type': 'plot',
+                 'plotname': plotname,
+                 'relative': relative}
+    else:
+        entry = {'type': 'float',
+                 'value': diag.diagnostic}
+    diagcache.put_data(key, json.dumps(entry))
+
+
+def compute_diagnostics(diags, nthreads=None, workdir=None):
+    """Compute (lazily constructed) diagnostics concurrently.
+        Each diagnostic is dominated by an external command
+        (e.g. 'psrstat', 'psrplot'), so they are computed by
+        a pool of processes (running external commands from
+        several threads isn't safe in Python 2).
+
+        If the diagnostic cache is enabled (see the
+        'diagnostic_cache_dir' configuration) results are taken
+        from the cache when possible, and added to it otherwise.
+        Results are identified by the diagnosed file's MD5 sum,
+        the diagnostic's name and version, and PSRCHIVE's version.
+
+        Inputs:
+            diags: A list of diagnostic objects.
+            nthreads: The maximum number of diagnostics to compute
+                at once. (Default: use the 'diagnostic_threads'
+                configuration)
+            workdir: The directory to restore cached diagnostic
+                plots into (e.g. the job's scratch space).
+                (Default: see 'get_diagnostic_workdir')
+
+        Output:
+            errs: A list of the exception raised while computing each
+                diagnostic (None for diagnostics that were computed).
+                Their tracebacks can be shown with
+                'print_diagnostic_error'.
+    """
+    diagcache = get_diagnostic_cache()
+    keys = {}
+    if diagcache is not None:
+        psrchive_version = get_psrchive_version()
+        md5sums = {}
+        for diag in diags:
+            if diag.computed or not diag.cacheable or \
+                    (psrchive_version is None):
+                continue
+            if diag.fn not in md5sums:
+                md5sums[diag.fn] = datafile.get_md5sum(diag.fn)
+            key = get_diagnostic_cache_key(diag, md5sums[diag.fn],
+                                           psrchive_version)
+            if not fetch_cached_diagnostic(diagcache, diag, key, workdir):
+                keys[id(diag)] = key
+
+    todo = [diag for diag in diags if not diag.computed]
+    if nthreads is None:
+        nthreads = config.cfg.diagnostic_threads
+    nthreads = max(1, min(nthreads, len(todo)))
+    if nthreads == 1:
+        errs = [_compute_diagnostic(diag) for diag in todo]
+    else:
+        errs = _compute_diagnostics_in_pool(todo, nthreads)
+    for diag, err in zip(todo, errs):
+        if (err is None) and (id(diag) in keys):
+            store_cached_diagnostic(diagcache, diag, keys[id(diag)])
+    errs_by_diag = dict(zip([id(diag) for diag in todo], errs))
+    return [errs_by_diag.get(id(diag)) for diag in diags]
+
+
+def _compute_diagnostic(diag):
+    """Compute a diagnostic, returning the exception raised (if any).
+        The exception's traceback is kept, formatted, as its
+        'diagnostic_traceback' attribute (see 'print_diagnostic_error').
+    """
+    try:
+        diag.compute()
+    except Exception as exc:
+        exc.diagnostic_traceback = traceback.format_exc()
+        return exc
+    return None
+
+
+def print_diagnostic_error(err):
+    """Print the traceback of an exception returned by
+        'compute_diagnostics' to stderr.
+
+        Input:
+            err: The exception.
+
+        Outputs:
+            None
+    """
+    tbtext = getattr(err, 'diagnostic_traceback', None)
+    if tbtext is None:
+        tbtext = "%s: %s\n" % (type(err).__name__, str(err))
+    sys.stderr.write(tbtext)
+
+
+# The diagnostics being computed by a pool of processes. The
+# pool's processes inherit them when they are forked, so the
+# diagnostics (and their shared FileContexts) aren't pickled.
+pool_diags = []
+
+# DB engines inherited by a pool process. They are kept (but not
+# used), so their connections, which belong to the parent, aren't
+# closed when they are garbage collected.
+inherited_engines = {}
+
+
+def _init_pool_process():
+    """Prepare a newly forked pool process.
+    """
+    inherited_engines.update(database.engines)
+    database.engines.clear()
+    # Only report the commands run by this process
+    del sysusage.usage_records[:]
+
+
+def _compute_pool_diagnostic(index):
+    """Compute one of 'pool_diags' in a pool process.
+
+        Input:
+            index: The diagnostic's index in 'pool_diags'.
+
+        Outputs:
+            value: The diagnostic's value (None if it failed).
+            err: The exception raised (None if the diagnostic
+                was computed).
+            records: Records of the external commands that were
+                run (see 'utils/sysusage.py').
+    """
+    diag = pool_diags[index]
+    err = _compute_diagnostic(diag)
+    records = list(sysusage.usage_records)
+    del sysusage.usage_records[:]
+    if err is not None:
+        try:
+            pickle.loads(pickle.dumps(err))
+        except Exception:
+            # The exception can't be sent to the parent as it is
+            tbtext = err.diagnostic_traceback
+            err = errors.ToasterError("%s: %s" % (type(err).__name__,
+                                                  str(err)))
+            err.diagnostic_traceback = tbtext
+        return None, err, records
+    return diag.diagnostic, None, records
+
+
+def _compute_diagnostics_in_pool(diags, nprocs):
+    """Compute diagnostics with a pool of processes.
+
+        Inputs:
+            diags: A list of diagnostic objects.
+            nprocs: The number of processes.
+
+        Output:
+            errs: A list of the exception raised while computing each
+                diagnostic (None for diagnostics that were computed).
+    """
+    notify.print_debug("Computing %d diagnostics using %d processes" %
+                       (len(diags), nprocs), 'diagnostics')
+    # Parse headers once, rather than in each process
+    for diag in diags:
+        if diag.needs_params:
+            try:
+                diag.get_params()
+            except Exception:
+                # The diagnostic will fail (and report it) when computed
+                pass
+    pool_diags[:] = diags
+    try:
+        pool = multiprocessing.Pool(nprocs, _init_pool_process)
+        try:
+            results = pool.map(_compute_pool_diagnostic, range(len(diags)))
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        del pool_diags[:]
+    errs = []
+    for diag, (value, err, records) in zip(diags, results):
+        sysusage.usage_records.extend(records)
+        if err is None:
+            diag.set_diagnostic(value)
+        errs.append(err)
+    return errs
+
+
+def run_diagnostics(fn, diagnames, nthreads=None, params=None,
+                    workdir=None):
+    """Compute diagnostics of a file. Diagnostics that aren't
+        applicable to the file are skipped.
+
+        Inputs:
+            fn: The file to diagnose.
+            diagnames: A list of names of registered diagnostics.
+            nthreads: The maximum number of diagnostics to compute
+                at once. (Default: use the 'diagnostic_threads'
+                configuration)
+            params: The file's parsed header (as returned by
+                'datafile.prep_file'), if the caller already has it.
+                (Default: parse the header once, if any of the
+                diagnostics need it)
+            workdir: The directory to restore cached diagnostic
+                plots into. (Default: see 'get_diagnostic_workdir')
+
+        Output:
+            diags: A list of the computed diagnostics.
+    """
+    context = base.FileContext(fn, params)
+    diags = [get_diagnostic_class(diagname)(fn, lazy=True, context=context)
+             for diagname in diagnames]
+    errs = compute_diagnostics(diags, nthreads, workdir)
+    computed = []
+    for diag, err in zip(diags, errs):
+        if err is None:
+            computed.append(diag)
+        elif isinstance(err, errors.DiagnosticNotApplicable):
+            notify.print_info("Diagnostic isn't applicable: %s. "
+                              "Skipping..." % str(err), 1)
+        else:
+            # Show where the diagnostic failed, since the traceback
+            # of re-raising the exception doesn't
+            print_diagnostic_error(err)
+            raise err
+    return computed
+
+
 def get_custom_float_diagnostic(fn, diagnostic_name, diagnostic_value):
     """Create and return a custom float diagnostic object.
     
@@ -70,6 +436,8 @@ def get_custom_diagnostic_plot(fn, diagnostic_name, diagnostic_plotfn):
 class CustomFloatDiagnostic(base.FloatDiagnostic):
     """A FloatDiagnostic object for custom (one-time use) diagnostics.
     """
+    cacheable = False
+
     def __init__(self, fn, name, value):
         self.name = name
         self.value = value
@@ -82,6 +450,8 @@ class CustomFloatDiagnostic(base.FloatDiagnostic):
 class CustomPlotDiagnostic(base.PlotDiagnostic):
     """A PlotDiagnostic object for custom (one-time use) diagnostics.
     """
+    cacheable = False
+
     def __init__(self, fn, name, plotfn):
         self.name = name
         if not os.path.isfile(plotfn):
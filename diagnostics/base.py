@@ -1,8 +1,45 @@
 import os.path
+import threading
 
 from toaster import utils
 from toaster import database
 from toaster import errors
+from toaster.utils import datafile
+
+
+class FileContext(object):
+    """Information about a file that is shared by all of the
+        diagnostics of the file, so it is only determined once.
+    """
+    def __init__(self, fn, params=None):
+        """Constructor for FileContext objects.
+
+            Inputs:
+                fn: The file being diagnosed.
+                params: The file's parsed header, with resolved IDs
+                    (as returned by 'datafile.prep_file'), if the
+                    caller already has it. (Default: parse the header
+                    when it is first needed)
+        """
+        self.fn = fn
+        self.params = params
+        self.lock = threading.Lock()
+
+    def get_params(self):
+        """Return the file's parsed header, parsing it if necessary.
+
+            Inputs:
+                None
+
+            Output:
+                params: A dictionary of header values and IDs (see
+                    'datafile.prep_file').
+        """
+        # Diagnostics of the file may share the context between threads
+        with self.lock:
+            if self.params is None:
+                self.params = datafile.prep_file(self.fn)
+        return self.params
 
 
 class BaseDiagnostic(object):
@@ -10,12 +47,80 @@ class BaseDiagnostic(object):
     """
     name = NotImplemented
     description = None
+    # Increment the version whenever a change would alter the
+    # diagnostic's result. Cached results of other versions
+    # are ignored (see 'diagnostics.compute_diagnostics').
+    version = 1
+    # Set to False if the diagnostic's result shouldn't be cached
+    cacheable = True
+    # Set to True if the diagnostic uses the file's parsed header
+    # (see 'get_params')
+    needs_params = False
 
-    def __init__(self, fn):
+    def __init__(self, fn, lazy=False, context=None):
+        """Constructor for diagnostic objects.
+
+            Inputs:
+                fn: The file to diagnose.
+                lazy: Don't compute the diagnostic until 'compute'
+                    is called, or the 'diagnostic' attribute is used.
+                    (Default: compute the diagnostic now)
+                context: A FileContext object for 'fn', shared with
+                    other diagnostics of the same file.
+                    (Default: create a new context)
+        """
         if not os.path.isfile(fn):
             raise errors.FileError("Input file (%s) doesn't exist!" % fn)
         self.fn = fn
-        self.diagnostic = self._compute()
+        self.context = context or FileContext(fn)
+        self._diagnostic = None
+        self.computed = False
+        if not lazy:
+            self.compute()
+
+    def compute(self):
+        """Compute the diagnostic, unless it has been already.
+
+            Inputs:
+                None
+
+            Output:
+                diagnostic: The diagnostic's value.
+        """
+        if not self.computed:
+            self._diagnostic = self._compute()
+            self.computed = True
+        return self._diagnostic
+
+    def get_params(self):
+        """Return the diagnosed file's parsed header (see
+            'datafile.prep_file'). This is shared with the other
+            diagnostics of the file, so it is only read once.
+
+            Inputs:
+                None
+
+            Output:
+                params: A dictionary of header values and IDs.
+        """
+        return self.context.get_params()
+
+    def set_diagnostic(self, value):
+        """Set the diagnostic's value (e.g. from a cache),
+            rather than computing it.
+
+            Input:
+                value: The diagnostic's value.
+
+            Outputs:
+                None
+        """
+        self._diagnostic = value
+        self.computed = True
+
+    @property
+    def diagnostic(self):
+        return self.compute()
 
     def _compute(self):
         raise NotImplementedError("The compute method must be defined by " \
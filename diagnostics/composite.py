@@ -5,12 +5,12 @@ import shutil
 from toaster import utils
 from toaster import errors
 from toaster.utils import notify
-from toaster.utils import datafile 
 from toaster.diagnostics import base
 
 
 class CompositePlotDiagnostic(base.PlotDiagnostic):
     name = 'Composite'
+    needs_params = True
     description = "A composite plot including a profile, " \
                   "a time vs. phase plot, a freq vs. phase " \
                   "plot, and some text information. NOTE: " \
@@ -21,7 +21,7 @@ class CompositePlotDiagnostic(base.PlotDiagnostic):
         notify.print_info("Creating composite summary plot for %s" % self.fn, 3)
         handle, tmpfn = tempfile.mkstemp(suffix=".png")
         os.close(handle)
-        params = datafile.prep_file(self.fn)
+        params = self.get_params()
         
         if (params['nsub'] > 1) and (params['nchan'] > 1):
             self.__plot_all(tmpfn, params)
@@ -8,10 +8,11 @@ import base
 
 class FreqVsPhasePlotDiagnostic(base.PlotDiagnostic):
     name = 'Freq vs. Phase'
+    needs_params = True
 
     def _compute(self):
         utils.print_info("Creating freq vs. phase plot for %s" % self.fn, 3)
-        params = utils.prep_file(self.fn)
+        params = self.get_params()
         if not (params['nchan'] > 1):
             raise errors.DiagnosticNotApplicable("Archive (%s) only has " \
                         "a single channel. Freq vs. phase diagnostic " \
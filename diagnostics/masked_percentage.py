@@ -1,7 +1,7 @@
 import numpy as np
 
-from toaster import utils
 from toaster.utils import notify
+from toaster.utils import backends
 from toaster.diagnostics import base
 
 
@@ -10,10 +10,9 @@ class MaskedPercentageDiagnostic(base.FloatDiagnostic):
     description = "Percentage of profiles that are fully masked."
 
     def _compute(self):
-        notify.print_info("Calling psrstat to get weights for %s" % self.fn, 3)
-        cmd = ["psrstat", self.fn, "-c", "int:wt", "-Qq"]
-        outstr, errstr = utils.execute(cmd)
-        wtstrs = outstr.strip().split(',')
+        notify.print_info("Getting weights of %s" % self.fn, 3)
+        outvals = backends.get_backend().get_stats(self.fn, ['int:wt'])
+        wtstrs = outvals[0].strip().split(',')
         weights = np.array([float(wt) for wt in wtstrs])
         maskpcnt = 100.0*np.sum(weights > 0)/weights.size
         return maskpcnt
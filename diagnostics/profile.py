@@ -11,7 +11,6 @@ class ProfilePlotDiagnostic(base.PlotDiagnostic):
 
     def _compute(self):
         utils.print_info("Creating profile plot for %s" % self.fn, 3)
-        params = utils.prep_file(self.fn)
         handle, tmpfn = tempfile.mkstemp(suffix=".png")
         os.close(handle)
         cmd = ["psrplot", "-p", "flux", "-j", "TDFp", "-c", \
@@ -1,6 +1,6 @@
-from toaster import utils
 from toaster.diagnostics import base
 from toaster.utils import notify
+from toaster.utils import backends
 
 
 class SNRDiagnostic(base.FloatDiagnostic):
@@ -9,10 +9,10 @@ class SNRDiagnostic(base.FloatDiagnostic):
                   "data as determined by 'psrstat'."
 
     def _compute(self):
-        notify.print_info("Calling psrstat to get SNR for %s" % self.fn, 3)
-        cmd = ["psrstat", "-Qq", "-j", "DTFp", "-c", "snr", self.fn]
-        outstr, errstr = utils.execute(cmd)
-        snr = float(outstr)
+        notify.print_info("Computing SNR of %s" % self.fn, 3)
+        outvals = backends.get_backend().get_stats(self.fn, ['snr'],
+                                                   jobs="DTFp")
+        snr = float(outvals[0])
         return snr
 
 
@@ -12,7 +12,6 @@ class StokesPlotDiagnostic(base.PlotDiagnostic):
 
     def _compute(self):
         utils.print_info("Creating profile plot (w/ polarization) for %s" % self.fn, 3)
-        params = utils.prep_file(self.fn)
         handle, tmpfn = tempfile.mkstemp(suffix=".png")
         os.close(handle)
         cmd = ["psrplot", "-p", "stokes", "-j", "TDF", "-c", \
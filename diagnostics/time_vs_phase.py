@@ -8,10 +8,11 @@ import base
 
 class TimeVsPhasePlotDiagnostic(base.PlotDiagnostic):
     name = 'Time vs. Phase'
+    needs_params = True
 
     def _compute(self):
         utils.print_info("Creating time vs. phase plot for %s" % self.fn, 3)
-        params = utils.prep_file(self.fn)
+        params = self.get_params()
         if not (params['nsub'] > 1):
             raise errors.DiagnosticNotApplicable("Archive (%s) only has " \
                         "a single subint. Time vs. phase diagnostic " \
@@ -83,6 +83,10 @@ class DiagnosticAlreadyExists(ToasterError):
     pass
 
 
+class ScratchSpaceError(ToasterError):
+    pass
+
+
 # Custom Warnings
 class ToasterWarning(Warning):
     def __str__(self):
@@ -11,6 +11,7 @@ from toaster import errors
 from toaster import utils
 from toaster import debug
 from toaster.utils import notify
+from toaster.utils import staging
 
 registered_manipulators = ["pamit"]
 
@@ -22,8 +23,18 @@ class BaseManipulator(object):
         
         Manipulator objects take an input list of archives,
         manipulate them, and return a single output archive.
+
+        NOTE: The input archives are staged into the manipulator's
+            working directory as private files (see 'utils/staging.py'),
+            so they may be modified in place. They never share their
+            data with the archived files they came from.
     """
     name = NotImplemented
+    # Set to True if the manipulator's '_manipulate' method takes
+    # a 'parfile' argument, and installs that ephemeris (updating
+    # the DM) itself. This lets the pipeline avoid a separate pass
+    # over the full-resolution data.
+    accepts_ephemeris = False
 
     def __init__(self):
         self.parser = argparse.ArgumentParser(add_help=False,
@@ -44,6 +55,25 @@ class BaseManipulator(object):
         tmp = self.parser.parse_args(args)
         self.kwargs = dict(tmp._get_kwargs())
 
+    def get_normalised_args(self):
+        """Return the manipulator's arguments as a canonical string.
+            Unlike 'self.argstr', this doesn't depend on how
+            the arguments were written on the command line (e.g.
+            their order, or whether defaults were given explicitly).
+
+            Inputs:
+                None
+
+            Output:
+                normargs: The normalised arguments.
+        """
+        kwargs = getattr(self, 'kwargs', None)
+        if kwargs is None:
+            # No arguments were parsed. Use the defaults.
+            kwargs = dict(self.parser.parse_args([])._get_kwargs())
+        return " ".join(["%s=%r" % (key, kwargs[key])
+                         for key in sorted(kwargs)])
+
     def _manipulate(self, infns, outname):
         raise NotImplementedError("The '_manipulate' method of Manipulator "
                                   "classes must be defined.")
@@ -66,7 +96,8 @@ class BaseManipulator(object):
         """
         pass
 
-    def run(self, infns, outname, tmpdir=None, **override_kwargs):
+    def run(self, infns, outname, tmpdir=None, parfile=None,
+            **override_kwargs):
         """Set up a temporary directory to run the manipulator
             method in, load the archives, run the manipulator,
             get the result of the manipulator, break down the
@@ -81,6 +112,10 @@ class BaseManipulator(object):
                 tmpdir: Location of the temporary directory.
                     (Default: let python's 'tempfile' module
                         put the temp dir in a standard location.)
+                parfile: An ephemeris to install (and update the DM
+                    from) as part of the manipulation. Only allowed
+                    if the manipulator accepts ephemerides.
+                    (Default: Don't install an ephemeris.)
                 ** Other key-word arguments are used to override 
                     default arguments parsed by the manipulator's
                     parser.
@@ -88,16 +123,24 @@ class BaseManipulator(object):
             Outputs:
                 None
         """
+        if parfile is not None and not self.accepts_ephemeris:
+            raise ManipulatorError("The '%s' manipulator cannot install "
+                                   "an ephemeris." % self.name)
         manip_kwargs = {}
         #manip_kwargs.update(self.default_kwargs)
         manip_kwargs.update(self.kwargs)
         manip_kwargs.update(**override_kwargs)
+        if parfile is not None:
+            manip_kwargs['parfile'] = parfile
 
         workdir = tempfile.mkdtemp(dir=tmpdir, suffix='toaster')
         newfns = []
         for fn in infns:
             newfn = os.path.join(workdir, os.path.split(fn)[-1])
-            shutil.copy(fn, newfn)
+            staging.stage_file(fn, newfn)
+            # Manipulators may modify their inputs in place (e.g.
+            # with 'pam -m'). Don't let that write through a hardlink.
+            staging.make_private(newfn)
             newfns.append(newfn)
         try:
             self._manipulate(newfns, outname, **manip_kwargs)
@@ -235,7 +278,8 @@ def run_manipulator(prepped_manipfunc, infns, outname=None,
     newfns = []
     for fn in infns:
         newfn = os.path.join(workdir, os.path.split(fn)[-1])
-        shutil.copy(fn, newfn)
+        staging.stage_file(fn, newfn)
+        staging.make_private(newfn)
         newfns.append(newfn)
     try:
         prepped_manipfunc(newfns, outname)
@@ -1,19 +1,20 @@
 """Use pam to scrunch an archive and (optionally) reinstall an
     ephmemeris.
 """
-import shutil
 import argparse
 
 import manipulators
-import utils
+from toaster.utils import staging
+from toaster.utils import backends
 
 
 class PamitManipulator(manipulators.BaseManipulator):
     name = 'pamit'
     description = "Use pam to scrunch the archive."
+    accepts_ephemeris = True
 
     def _manipulate(self, infns, outname, nsub=1, nchan=1,
-                    nbin=None, tsub=None):
+                    nbin=None, tsub=None, parfile=None):
         """Scrunch the given archive in polarization, as well as
             in frequency to 'nchan' channels, and in time to 
             'nsub' subints. Also bin scrunch to 'nbin'.
@@ -34,6 +35,9 @@ class PamitManipulator(manipulators.BaseManipulator):
                     (Default: Don't bin scrunch.)
                 tsub: Number of seconds to include in each subint.
                     This overrides 'nsub'. (Default: use 'nsub')
+                parfile: An ephemeris to install, and update the DM
+                    from, before scrunching. (Default: Don't
+                    install an ephemeris.)
 
             Outputs:
                 None
@@ -47,19 +51,14 @@ class PamitManipulator(manipulators.BaseManipulator):
 
         # Copy input archive to outname and modify that file in place
         # infns is a list of one (we ensure this above)
-        shutil.copy(infns[0], outname)
-
-        cmd = ["pam", "-m", "--setnchn", str(nchan), outname]
-        if tsub is not None:
-            cmd += ["--settsub", "%f" % tsub]
-        else:
-            cmd += ["--setnsub", "%d" % nsub]
-
-        if nbin is not None:
-            cmd += ["--setnbin", "%d" % nbin]
+        staging.stage_file(infns[0], outname)
+        staging.make_private(outname)
 
         # Scrunch the heck out of it
-        utils.execute(cmd)
+        # (if given, the ephemeris is installed in the same pass, so
+        # the data are only read/written once)
+        backends.get_backend().scrunch(outname, nsub=nsub, nchan=nchan,
+                                       nbin=nbin, tsub=tsub, parfile=parfile)
 
     def _add_arguments(self, parser):
         """Add any arguments to subparser that are required 
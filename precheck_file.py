@@ -2,9 +2,11 @@
 import sys
 import glob
 
-import config
-import utils
-import errors
+from toaster import config
+from toaster import utils
+from toaster import errors
+from toaster.utils import notify
+from toaster.utils import datafile
 
 
 def main():
@@ -19,6 +21,9 @@ def main():
                          "You should consider including some next time...\n")
         sys.exit(1)
     
+    # Read the headers of many files with each 'vap' call
+    datafile.prefetch_header_vals(infiles)
+
     # Enter information in rawfiles table
     # create diagnostic plots and metrics.
     # Also fill-in raw_diagnostics and raw_diagnostic_plots tables
@@ -28,18 +33,18 @@ def main():
                 print("Checking %s (%s)" % (fn, utils.give_utc_now()))
 
             # Check the file and parse the header
-            params = utils.prep_file(fn)
+            params = datafile.prep_file(fn)
             
             # Find where the file will be moved to.
-            destdir = utils.get_archive_dir(fn, params=params)
+            destdir = datafile.get_archive_dir(fn, params=params)
             
-            utils.print_info("%s will get archived to %s (%s)" % \
+            notify.print_info("%s will get archived to %s (%s)" % \
                         (fn, destdir, utils.give_utc_now()), 1)
 
-            utils.print_info("Finished with %s - pre-check successful (%s)" % \
+            notify.print_info("Finished with %s - pre-check successful (%s)" % \
                         (fn, utils.give_utc_now()), 1)
 
-        except (errors.ToasterError, msg):
+        except errors.ToasterError as msg:
             sys.stderr.write("Pre-check of %s failed!\n%s\nSkipping...\n" % \
                                 (fn, msg))
     
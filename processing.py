@@ -13,6 +13,10 @@ import database
 import errors
 
 toolkit = ['describe_processing', \
+           'run_queued_diagnostics', \
+           'processing_jobs', \
+           'plan_reprocessing', \
+           'prefetch_archives', \
           ]
 
 
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+"""A thin client for the TOASTER daemon (see 'toasterd.py').
+
+    The client forwards a TOASTER command line to a running daemon
+    over a Unix domain socket, and prints what the daemon sends back.
+    If no daemon is listening, the program is run locally instead,
+    so the client can always be used in place of the program itself.
+
+    Usage:
+        toaster_client.py <program> [arguments...]
+
+    For example, the following are equivalent:
+        rawfiles.py show -p J1713+0747
+        toaster_client.py rawfiles.py show -p J1713+0747
+
+    NOTE: This module deliberately avoids importing the bulk of
+        TOASTER. Only the configuration module is loaded.
+"""
+import sys
+import os
+import os.path
+import socket
+import subprocess
+import json
+
+from toaster import config
+
+
+def get_socket_path():
+    """Return the path of the daemon's Unix domain socket.
+
+        The 'TOASTER_DAEMON_SOCKET' environment variable takes
+        precedence over the 'daemon_socket' configuration.
+
+        Inputs:
+            None
+
+        Output:
+            sockpath: The socket's path (or None, if not configured).
+    """
+    return os.environ.get("TOASTER_DAEMON_SOCKET", config.cfg.daemon_socket)
+
+
+def send_message(sock, message):
+    """Send a message (a dictionary) over a socket, as a line of JSON.
+
+        Inputs:
+            sock: The socket.
+            message: The dictionary to send.
+
+        Outputs:
+            None
+    """
+    sock.sendall((json.dumps(message) + "\n").encode('utf-8'))
+
+
+def send_request(sockpath, request, stdinfile=None):
+    """Send a request to the daemon and wait for its response.
+
+        stdin is only read if the daemon asks for it (i.e. when
+        the program reads its stdin), so input that isn't meant
+        for the program is left alone (e.g. in 'while read' loops).
+
+        Inputs:
+            sockpath: The path of the daemon's socket.
+            request: A dictionary describing the request.
+            stdinfile: The file to read the program's stdin from,
+                if the daemon asks for it. (Default: the program's
+                stdin is empty)
+
+        Outputs:
+            response: The dictionary sent back by the daemon.
+            stdindata: The data read from 'stdinfile' (None if
+                the daemon didn't ask for it). If a socket.error is
+                raised this is kept as the exception's 'stdindata'
+                attribute.
+    """
+    request = dict(request, stdin=(stdinfile is not None))
+    stdindata = None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(sockpath)
+        send_message(sock, request)
+        sockfile = sock.makefile('rb')
+        while True:
+            line = sockfile.readline()
+            if not line:
+                raise socket.error("The TOASTER daemon closed the "
+                                   "connection without responding.")
+            message = json.loads(line.decode('utf-8'))
+            if not message.get('stdin_request'):
+                response = message
+                break
+            # The program is reading its stdin
+            stdindata = stdinfile.read()
+            if isinstance(stdindata, bytes):
+                stdindata = stdindata.decode('utf-8')
+            send_message(sock, {'stdin': stdindata})
+        sockfile.close()
+    except socket.error as exc:
+        exc.stdindata = stdindata
+        raise
+    finally:
+        sock.close()
+    return response, stdindata
+
+
+def run_locally(prog, argv, stdindata=None):
+    """Run the requested program in place of the daemon.
+
+        Inputs:
+            prog: The name of the TOASTER program to run.
+            argv: The program's command line arguments.
+            stdindata: Data already read from stdin that must
+                be passed on to the program. (Default: the program
+                inherits stdin)
+
+        Outputs:
+            None - this function does not return.
+    """
+    basedir = os.path.dirname(os.path.abspath(__file__))
+    progname = os.path.basename(prog)
+    if not progname.endswith('.py'):
+        progname += '.py'
+    candidates = [os.path.join(basedir, progname)]
+    toolkitdir = os.path.join(basedir, 'toolkit')
+    for subdir in sorted(os.listdir(toolkitdir)):
+        candidates.append(os.path.join(toolkitdir, subdir, progname))
+    for path in candidates:
+        if not os.path.isfile(path):
+            continue
+        cmd = [sys.executable, path] + list(argv)
+        if stdindata is None:
+            os.execv(sys.executable, cmd)
+        else:
+            if not isinstance(stdindata, bytes):
+                stdindata = stdindata.encode('utf-8')
+            pipe = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+            pipe.communicate(stdindata)
+            sys.exit(pipe.returncode)
+    sys.stderr.write("Unrecognized TOASTER program: %s\n" % prog)
+    sys.exit(1)
+
+
+def main(argv):
+    if not argv:
+        sys.stderr.write(__doc__)
+        sys.exit(1)
+    prog, args = argv[0], argv[1:]
+
+    sockpath = get_socket_path()
+    if not sockpath or not os.path.exists(sockpath):
+        # No daemon is running
+        run_locally(prog, args)
+
+    if sys.stdin.isatty():
+        stdinfile = None
+    else:
+        stdinfile = sys.stdin
+    request = {'prog': os.path.basename(prog),
+               'argv': args,
+               'cwd': os.getcwd(),
+               'toaster_cfg': os.environ.get("TOASTER_CFG", "")}
+    try:
+        response, stdindata = send_request(sockpath, request, stdinfile)
+    except socket.error as exc:
+        # Stale socket file, or the daemon went away
+        run_locally(prog, args, exc.stdindata)
+
+    if response.get('fallback'):
+        # The daemon cannot serve this request (e.g. different configs)
+        run_locally(prog, args, stdindata)
+    sys.stdout.write(response['stdout'])
+    sys.stdout.flush()
+    sys.stderr.write(response['stderr'])
+    sys.stderr.flush()
+    sys.exit(response['status'])
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
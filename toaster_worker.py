@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+"""A worker that runs processing jobs from the DB queue.
+
+    Processing jobs are queued with 'toastit.py --enqueue' (see
+    'toolkit/processing/processing_jobs.py'). Each worker claims one
+    job at a time, runs it with 'toastit.pipeline_core', and records
+    the result in the queue. Several workers, on the same or on
+    different hosts sharing the archive filesystem, can share the
+    queue. Start one worker per core to be used.
+
+    While a job runs its worker renews its lease on the job. If the
+    worker dies the lease expires and the job is run again by another
+    worker. A worker that has lost its lease rolls the job back, rather
+    than loading its results. Jobs that fail are queued again, until they have been
+    attempted 'processing_job_max_attempts' times.
+
+    Workers prefer jobs whose raw files are local to their host (see
+    'utils/locality.py'), so data are read over the network only when
+    a worker would otherwise be idle.
+
+    Jobs with higher priority ('toastit.py --priority') are run first,
+    and jobs of equal priority are shared fairly between users (or
+    pulsars). See 'processing_job_fair_share' and
+    'processing_job_manipulator_caps' in the configuration.
+
+    SIGTERM (or Ctrl-C) stops the worker once its current job is done.
+"""
+import signal
+import traceback
+
+from toaster import utils
+from toaster import errors
+from toaster import database
+from toaster import toastit
+from toaster.utils import notify
+from toaster.utils import locality
+from toaster.utils import sysusage
+from toaster.toolkit.processing import processing_jobs
+
+
+class Worker(object):
+    def __init__(self, name=None, localities=None, steal=True):
+        if name is None:
+            name = processing_jobs.get_worker_name()
+        if not localities:
+            localities = [locality.get_host_locality()]
+        self.name = name
+        self.localities = [locality.normalise_host(local_to)
+                           for local_to in localities]
+        self.steal = steal
+        self.stopping = False
+        self.ndone = 0
+        self.nfailed = 0
+
+    def stop(self, signum=None, frame=None):
+        if not self.stopping:
+            notify.print_info("Worker %s will stop after its current "
+                              "job" % self.name, 1)
+        self.stopping = True
+
+    def run_job(self, row, existdb=None):
+        """Run a claimed processing job, and record its result.
+
+            Inputs:
+                row: The claimed job.
+                existdb: An (optional) existing database connection object.
+                    (Default: Establish a db connection)
+
+            Output:
+                success: True if the job was run successfully.
+        """
+        db = existdb or database.Database()
+        db.connect()
+
+        job_id = row['processing_job_id']
+        processing_jobs.set_processing_job_status(job_id, 'running',
+                                                  worker=self.name,
+                                                  existdb=db)
+        renewer = processing_jobs.LeaseRenewer(job_id, self.name)
+        renewer.start()
+
+        def check_lease(db):
+            # Renewing the lease in the job's transaction also stops
+            # another worker claiming the job before it is committed
+            if renewer.lost or \
+                    not processing_jobs.renew_processing_job_lease(
+                                job_id, self.name, existdb=db):
+                raise errors.ToasterError("Worker %s lost its lease on "
+                                          "processing job (ID: %d). Not "
+                                          "loading its results." %
+                                          (self.name, job_id))
+        try:
+            manip = processing_jobs.get_job_manipulator(row)
+            process_id = toastit.pipeline_core(manip, row['rawfile_id'],
+                                               row['parfile_id'],
+                                               row['template_id'],
+                                               existdb=db,
+                                               force=row['force'],
+                                               before_load=check_lease)
+        except Exception as exc:
+            renewer.stop()
+            traceback.print_exc()
+            status = processing_jobs.release_failed_processing_job(
+                                row, self.name, str(exc), existdb=db)
+            if status is None:
+                outcome = "the worker had lost its lease"
+            else:
+                outcome = "the job is now '%s'" % status
+            notify.print_info("Processing job (ID: %d) failed (%s)" %
+                              (job_id, outcome), 1)
+            success = False
+        else:
+            renewer.stop()
+            if not processing_jobs.set_processing_job_status(
+                        job_id, 'done', worker=self.name,
+                        process_id=process_id, existdb=db):
+                notify.print_info("Worker %s lost its lease on processing "
+                                  "job (ID: %d) before it finished. Its "
+                                  "results (process ID: %d) are in the DB, "
+                                  "but another worker may have re-run it." %
+                                  (self.name, job_id, process_id), 0)
+            else:
+                notify.print_info("Processing job (ID: %d) done "
+                                  "(process ID: %d)" %
+                                  (job_id, process_id), 1)
+            success = True
+        finally:
+            # Save (and forget) the resource usage of the job's
+            # external commands, rather than keeping them until exit
+            sysusage.finish_run()
+            if not existdb:
+                db.close()
+        return success
+
+    def run(self, max_jobs=None, poll_interval=None, existdb=None):
+        """Claim and run jobs until the queue is empty, 'max_jobs'
+            jobs are done, or the worker is stopped.
+
+            Inputs:
+                max_jobs: The maximum number of jobs to run.
+                    (Default: no limit)
+                poll_interval: Keep running, checking the queue for new
+                    jobs every 'poll_interval' seconds.
+                    (Default: stop once the queue is empty)
+                existdb: An (optional) existing database connection object.
+                    (Default: Establish a db connection)
+
+            Outputs:
+                None
+        """
+        db = existdb or database.Database()
+        db.connect()
+
+        try:
+            while not self.stopping:
+                if (max_jobs is not None) and \
+                        (self.ndone+self.nfailed >= max_jobs):
+                    break
+                row = processing_jobs.claim_processing_job(self.name,
+                                                           self.localities,
+                                                           self.steal,
+                                                           existdb=db)
+                if row is None:
+                    if poll_interval is None:
+                        break
+                    utils.sleep(poll_interval)
+                    continue
+                if self.run_job(row, existdb=db):
+                    self.ndone += 1
+                else:
+                    self.nfailed += 1
+        finally:
+            if not existdb:
+                db.close()
+
+
+def main():
+    worker = Worker(args.name, args.localities, args.steal)
+    signal.signal(signal.SIGTERM, worker.stop)
+    notify.print_success("TOASTER worker %s started, local to %s (%s)" %
+                         (worker.name, ", ".join(worker.localities),
+                          utils.give_utc_now()))
+    try:
+        worker.run(args.max_jobs, args.poll_interval)
+    except KeyboardInterrupt:
+        pass
+    notify.print_info("Worker %s ran %d processing jobs (%d failed) (%s)" %
+                      (worker.name, worker.ndone+worker.nfailed,
+                       worker.nfailed, utils.give_utc_now()), 0)
+    if worker.nfailed:
+        raise errors.ToasterError("%d processing jobs failed. Please "
+                                  "review error output." % worker.nfailed)
+
+
+if __name__ == '__main__':
+    parser = utils.DefaultArguments(description="Run processing jobs "
+                                                "queued with 'toastit.py "
+                                                "--enqueue'.")
+    parser.add_argument('--name', dest='name', type=str, default=None,
+                        help="The name of the worker, recorded with the "
+                             "jobs it runs. It must be unique. "
+                             "(Default: 'host:pid')")
+    parser.add_argument('-n', '--max-jobs', dest='max_jobs',
+                        type=int, default=None,
+                        help="The maximum number of jobs to run. "
+                             "(Default: no limit)")
+    parser.add_argument('--poll-interval', dest='poll_interval',
+                        type=float, default=None,
+                        help="Keep running, checking the queue for new "
+                             "jobs every POLL_INTERVAL seconds. "
+                             "(Default: exit once the queue is empty)")
+    parser.add_argument('--locality', dest='localities', type=str,
+                        default=[], action='append',
+                        help="A host whose data are local to this worker. "
+                             "Jobs local to these hosts are run first. "
+                             "Multiple --locality options may be "
+                             "provided. (Default: this host)")
+    parser.add_argument('--no-steal', dest='steal', action='store_false',
+                        default=True,
+                        help="Only run jobs local to this worker. "
+                             "(Default: also run other jobs when there "
+                             "are no local jobs)")
+    args = parser.parse_args()
+    main()
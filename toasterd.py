@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+"""A long-running TOASTER daemon.
+
+    Every TOASTER program pays for interpreter start-up, module
+    imports, config loading, DB engine creation, schema inspection
+    and cache warm-up before doing any real work. The daemon does
+    all of this once, then serves toolkit command lines sent over
+    a Unix domain socket by 'toaster_client.py'.
+
+    Each request is run in a forked child of the daemon, so the
+    child starts with warm modules, caches and version fingerprint,
+    and any changes it makes to global state (e.g. verbosity,
+    debug modes, configs) are discarded when it exits.
+
+    NOTE: Requests are run with the daemon's user ID. The socket
+        is only accessible by the user who started the daemon.
+"""
+import sys
+import os
+import os.path
+import json
+import time
+import tempfile
+import traceback
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from toaster import config
+from toaster import utils
+from toaster import errors
+from toaster import database
+from toaster.utils import notify
+from toaster.utils import cache
+from toaster.utils import version
+from toaster.utils import sysusage
+from toaster.utils import profiling
+
+# Multi-purpose programs that can be served, and the
+# toolkit sub-package each one draws its tools from
+PROGRAMS = {'obssystem': 'obssystems',
+            'parfiles': 'parfiles',
+            'processing': 'processing',
+            'pulsar': 'pulsars',
+            'rawfiles': 'rawfiles',
+            'templates': 'templates',
+            'timfile': 'timfiles',
+            'toa': 'toas'}
+
+# Parsers are built once, in the daemon, so forked children
+# don't need to import the toolkit
+parsers = {}
+
+
+def get_program_parser(prog):
+    """Return an argument parser for a TOASTER program. The parser's
+        'func' default is the function to call with the parsed arguments.
+
+        Input:
+            prog: The name of a multi-purpose program (e.g. 'rawfiles.py'),
+                or of a single toolkit tool (e.g. 'get_rawfile_id.py').
+
+        Output:
+            parser: The argument parser.
+    """
+    progname = os.path.basename(prog)
+    if progname.endswith('.py'):
+        progname = progname[:-3]
+    if progname in parsers:
+        return parsers[progname]
+
+    if progname in PROGRAMS:
+        mod = __import__('toaster.%s' % progname, globals(), locals(),
+                         ['toolkit'])
+        parser = utils.DefaultArguments(prog='%s.py' % progname,
+                                        description=mod.__doc__)
+        subparsers = parser.add_subparsers(help='Available functionality. '
+                                                'To get more detailed help '
+                                                'for each function '
+                                                'provide the "-h/--help" '
+                                                'argument following the '
+                                                'function.')
+        pkg = __import__('toaster.toolkit.%s' % PROGRAMS[progname],
+                         globals(), locals(), mod.toolkit)
+        for tool_name in mod.toolkit:
+            tool = getattr(pkg, tool_name)
+            toolparser = subparsers.add_parser(tool.SHORTNAME,
+                                               help=tool.DESCRIPTION)
+            toolparser.set_defaults(func=tool.main)
+            tool.add_arguments(toolparser)
+    else:
+        tool = None
+        for pkgname in PROGRAMS.values():
+            toolkitdir = os.path.join(os.path.dirname(__file__),
+                                      'toolkit', pkgname)
+            if os.path.isfile(os.path.join(toolkitdir, progname+'.py')):
+                pkg = __import__('toaster.toolkit.%s' % pkgname,
+                                 globals(), locals(), [progname])
+                tool = getattr(pkg, progname)
+                break
+        if tool is None or not hasattr(tool, 'SHORTNAME'):
+            raise errors.UnrecognizedValueError("The program '%s' cannot "
+                                                "be served by the TOASTER "
+                                                "daemon." % prog)
+        parser = utils.DefaultArguments(prog='%s.py' % progname,
+                                        description=tool.DESCRIPTION)
+        parser.set_defaults(func=tool.main)
+        tool.add_arguments(parser)
+    parsers[progname] = parser
+    return parser
+
+
+class RequestStdin(object):
+    """A stand-in for a request's stdin. The client's stdin is
+        only fetched (see 'toaster_client.send_request') when the
+        program first reads it, so the client doesn't consume
+        input that isn't meant for the program.
+    """
+    def __init__(self, rfile, wfile, available):
+        """Constructor for RequestStdin objects.
+
+            Inputs:
+                rfile: The file to read the client's messages from.
+                wfile: The file to write messages to the client to.
+                available: If True, the client has stdin to send.
+                    Otherwise the program's stdin is empty.
+
+            Output:
+                stdin: The RequestStdin object.
+        """
+        self.rfile = rfile
+        self.wfile = wfile
+        self.available = available
+        self.stream = None
+
+    def get_stream(self):
+        """Return the stdin data (as a file object), fetching
+            it from the client the first time.
+        """
+        if self.stream is None:
+            data = ""
+            if self.available:
+                self.wfile.write((json.dumps({'stdin_request': True}) +
+                                  "\n").encode('utf-8'))
+                self.wfile.flush()
+                message = json.loads(self.rfile.readline().decode('utf-8'))
+                data = message['stdin'] or ""
+            self.stream = StringIO(data)
+        return self.stream
+
+    def __getattr__(self, name):
+        # e.g. read, readline, readlines, close
+        return getattr(self.get_stream(), name)
+
+    def __iter__(self):
+        return iter(self.get_stream())
+
+    def isatty(self):
+        return False
+
+
+def run_request(request, stdin):
+    """Run a TOASTER command line, capturing its output.
+
+        NOTE: This changes the working directory, and the
+            standard streams of the current process. It should
+            only be called in a forked child.
+
+        Inputs:
+            request: A dictionary describing the request (as
+                sent by 'toaster_client.py').
+            stdin: The program's stdin (a RequestStdin object).
+
+        Output:
+            response: A dictionary with the exit status, and
+                the stdout and stderr output of the command.
+    """
+    os.chdir(request['cwd'])
+    sys.argv = [request['prog']] + request['argv']
+    sys.stdin = stdin
+    # Don't account for commands run by the daemon itself
+    del sysusage.usage_records[:]
+
+    # Redirect at the file descriptor level so the output
+    # of external commands is captured too
+    outfile = tempfile.TemporaryFile()
+    errfile = tempfile.TemporaryFile()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(outfile.fileno(), 1)
+    os.dup2(errfile.fileno(), 2)
+    try:
+        parser = get_program_parser(request['prog'])
+        args = parser.parse_args(request['argv'])
+        args.func(args)
+    except SystemExit as exc:
+        if exc.code is None:
+            status = 0
+        elif isinstance(exc.code, int):
+            status = exc.code
+        else:
+            sys.stderr.write("%s\n" % exc.code)
+            status = 1
+    except:
+        traceback.print_exc()
+        status = 1
+    else:
+        status = 0
+    # Forked children exit without running 'atexit' handlers
+    profiling.finish()
+    sysusage.finish_run()
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    outfile.seek(0)
+    errfile.seek(0)
+    response = {'status': status,
+                'stdout': outfile.read().decode('utf-8', 'replace'),
+                'stderr': errfile.read().decode('utf-8', 'replace')}
+    outfile.close()
+    errfile.close()
+    return response
+
+
+class ToolRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = json.loads(self.rfile.readline().decode('utf-8'))
+        if request['toaster_cfg'] != os.environ.get("TOASTER_CFG", ""):
+            # The client is using a different set of configs
+            response = {'fallback': True}
+        else:
+            response = run_request(request,
+                                   RequestStdin(self.rfile, self.wfile,
+                                                request['stdin']))
+        self.wfile.write((json.dumps(response) + "\n").encode('utf-8'))
+
+
+class ToasterDaemon(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    def __init__(self, sockpath, refresh_interval=30):
+        self.refresh_interval = refresh_interval
+        self.last_warm = None
+        socketserver.UnixStreamServer.__init__(self, sockpath,
+                                               ToolRequestHandler)
+        os.chmod(sockpath, 0o600)
+
+    def server_bind(self):
+        # Create the socket accessible only by its owner. Changing
+        # its permissions after binding would leave a window in
+        # which other users could connect.
+        oldumask = os.umask(0o077)
+        try:
+            socketserver.UnixStreamServer.server_bind(self)
+        finally:
+            os.umask(oldumask)
+
+    def warm(self):
+        """Load everything a request might need: toolkit modules,
+            the DB engine (and schema check), caches and the
+            version fingerprint.
+
+            Inputs:
+                None
+
+            Outputs:
+                None
+        """
+        notify.print_info("Warming up TOASTER daemon (%s)" %
+                          utils.give_utc_now(), 2)
+        for prog in PROGRAMS:
+            get_program_parser(prog)
+        db = database.Database()
+        db.connect()
+        cache.get_userid_cache(db, update=True)
+        cache.get_userinfo_cache(db, update=True)
+        cache.get_pulsarid_cache(db, update=True)
+        cache.get_pulsaralias_cache(db, update=True)
+        cache.get_pulsarname_cache(db, update=True)
+        cache.get_obssystemid_cache(db, update=True)
+        cache.get_obssysinfo_cache(db, update=True)
+        cache.get_telescopeinfo_cache(db, update=True)
+        db.close()
+        # Don't share pooled DB connections with forked children
+        db.engine.dispose()
+        try:
+            version.warm_version_cache()
+        except errors.ToasterError as exc:
+            notify.print_info("Version fingerprint not cached: %s" %
+                              str(exc), 1)
+        self.last_warm = time.time()
+
+    def process_request(self, request, client_address):
+        # Refresh caches in the daemon (not the child) so
+        # all future requests see up-to-date information.
+        # Entries added in between (e.g. by an earlier request)
+        # are found because lookups that miss reload their cache.
+        if (self.last_warm is None) or \
+                (time.time() - self.last_warm > self.refresh_interval):
+            self.warm()
+        socketserver.ForkingMixIn.process_request(self, request,
+                                                  client_address)
+
+
+def main():
+    sockpath = args.sockpath
+    if sockpath is None:
+        sockpath = config.cfg.daemon_socket
+    if sockpath is None:
+        raise errors.BadInputError("No socket path provided, and the "
+                                   "'daemon_socket' configuration "
+                                   "is not set.")
+    if os.path.exists(sockpath):
+        raise errors.FileError("The socket (%s) already exists. Is "
+                               "another daemon running? If not, remove "
+                               "the file." % sockpath)
+    server = ToasterDaemon(sockpath, args.refresh_interval)
+    try:
+        server.warm()
+        notify.print_success("TOASTER daemon listening on %s (%s)" %
+                             (sockpath, utils.give_utc_now()))
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(sockpath)
+
+
+if __name__ == '__main__':
+    parser = utils.DefaultArguments(description="Run a long-lived TOASTER "
+                                                "daemon that serves toolkit "
+                                                "commands sent by "
+                                                "'toaster_client.py'.")
+    parser.add_argument('--socket', dest='sockpath', type=str,
+                        default=None,
+                        help="The Unix domain socket to listen on. "
+                             "(Default: use the 'daemon_socket' "
+                             "configuration.)")
+    parser.add_argument('--refresh-interval', dest='refresh_interval',
+                        type=float, default=30,
+                        help="Number of seconds after which the daemon's "
+                             "caches are refreshed before serving the "
+                             "next request. (Default: 30 s)")
+    args = parser.parse_args()
+    main()
@@ -13,6 +13,7 @@ import shutil
 import traceback
 import shlex
 import random
+import hashlib
 
 from toaster import config
 from toaster import utils
@@ -25,16 +26,22 @@ from toaster.toolkit.rawfiles import load_rawfile
 from toaster.toolkit.parfiles import load_parfile
 from toaster.toolkit.templates import load_template
 from toaster.toolkit.processing import diagnose_processing
+from toaster.toolkit.processing import processing_jobs
 import toaster.toolkit.toas.general as toas_general
 import toaster.toolkit.parfiles.general as parfiles_general
 import toaster.toolkit.templates.general as templates_general
 import toaster.toolkit.rawfiles.general as rawfiles_general
 
-from toaster import diagnostics
 from toaster.utils import notify
 from toaster.utils import datafile
 from toaster.utils import cache
 from toaster.utils import version
+from toaster.utils import staging
+from toaster.utils import diskcache
+from toaster.utils import backends
+from toaster.utils import journal
+from toaster.utils import timing
+from toaster.utils import scratch
 
 
 ###############################################################################
@@ -47,8 +54,12 @@ SUCCESSMSGS = ["Your data are freshly toasted",
                "Your data are golden brown",
                "Your data would go great with butter and jam"]
 
+# Maximum number of archives to generate TOAs for
+# with a single call to 'pat' (see 'pipeline_batch')
+PAT_BATCH_SIZE = 50
 
-def make_proc_diagnostics_dir(fn, proc_id):
+
+def make_proc_diagnostics_dir(fn, proc_id, params=None):
     """Given an archive, create the appropriate diagnostics
         directory, and cross-references.
 
@@ -56,12 +67,15 @@ def make_proc_diagnostics_dir(fn, proc_id):
             fn: The file to create a diagnostic directory for.
             proc_id: The processing ID number to create a diagnostic
                 directory for.
+            params: The file's parsed header (as returned by
+                'datafile.prep_file'). (Default: parse the header)
 
         Outputs:
             diagdir: The diagnostic directory's name.
     """
     diagnostics_location = os.path.join(config.cfg.data_archive_location, "diagnostics")
-    params = datafile.prep_file(fn)
+    if params is None:
+        params = datafile.prep_file(fn)
     basedir = datafile.get_archive_dir(fn, params=params,
                                        data_archive_location=diagnostics_location)
     diagdir = os.path.join(basedir, "procid_%d" % proc_id)
@@ -86,8 +100,132 @@ def make_proc_diagnostics_dir(fn, proc_id):
     return diagdir
 
 
+def get_input_md5sums(rawfile_id, parfile_id, template_id, existdb=None):
+    """Return the MD5 sums of a processing job's input files.
+
+        Inputs:
+            rawfile_id: The ID number of the raw data file.
+            parfile_id: The ID number of the parfile (or None).
+            template_id: The ID number of the template.
+            existdb: An existing database connection object.
+                (Default: establish a new DB connection)
+
+        Output:
+            md5sums: A list of the rawfile, parfile and template
+                MD5 sums (the string "None" if there is no parfile).
+    """
+    db = existdb or database.Database()
+    db.connect()
+
+    md5sums = []
+    for table, idcol, id in ((db.rawfiles, 'rawfile_id', rawfile_id),
+                             (db.parfiles, 'parfile_id', parfile_id),
+                             (db.templates, 'template_id', template_id)):
+        if id is None:
+            md5sums.append("None")
+            continue
+        select = db.select([table.c.md5sum]).\
+                    where(table.c[idcol] == id)
+        result = db.execute(select)
+        row = result.fetchone()
+        result.close()
+        if row is None:
+            raise errors.DatabaseError("There is no %s with ID=%d" %
+                                       (idcol[:-3], id))
+        md5sums.append(row['md5sum'])
+
+    if not existdb:
+        db.close()
+    return md5sums
+
+
+def get_processing_fingerprint(manip, md5sums, version_id):
+    """Compute a fingerprint identifying a processing job. Two jobs
+        with the same fingerprint would produce the same TOAs.
+
+        Inputs:
+            manip: A manipulator instance.
+            md5sums: The MD5 sums of the job's input files
+                (see 'get_input_md5sums').
+            version_id: The ID number of the pipeline/psrchive versions.
+
+        Output:
+            fingerprint: The fingerprint (a hex string).
+    """
+    ingredients = list(md5sums) + [manip.name, manip.get_normalised_args(),
+                                   config.cfg.toa_fitting_method,
+                                   str(version_id)]
+    return hashlib.sha1("|".join(ingredients).encode('utf-8')).hexdigest()
+
+
+def get_manip_cache():
+    """Return the cache of manipulated archives.
+
+        Inputs:
+            None
+
+        Output:
+            manipcache: A DiskCache object. None if the cache
+                is disabled.
+    """
+    if not config.cfg.manip_cache_dir:
+        return None
+    return diskcache.DiskCache(config.cfg.manip_cache_dir,
+                               config.cfg.manip_cache_max_size,
+                               name='manipulated archive')
+
+
+def get_manip_cache_key(manip, md5sums, version_id):
+    """Return the key identifying a manipulated archive in the cache.
+        Unlike the processing fingerprint, this doesn't depend on
+        the template or the TOA fitting method.
+
+        Inputs:
+            manip: A manipulator instance.
+            md5sums: The MD5 sums of the job's input files
+                (see 'get_input_md5sums').
+            version_id: The ID number of the pipeline/psrchive versions.
+
+        Output:
+            key: The cache key.
+    """
+    rawfile_md5, parfile_md5 = md5sums[:2]
+    return "|".join([rawfile_md5, parfile_md5, manip.name,
+                     manip.get_normalised_args(), str(version_id)])
+
+
+def get_process_id_by_fingerprint(fingerprint, existdb=None):
+    """Return the ID of an existing processing job with the
+        given fingerprint.
+
+        Inputs:
+            fingerprint: The processing job's fingerprint.
+            existdb: An existing database connection object.
+                (Default: establish a new DB connection)
+
+        Output:
+            process_id: The ID of the (most recent) matching processing
+                job. None if there is no match.
+    """
+    db = existdb or database.Database()
+    db.connect()
+
+    select = db.select([db.process.c.process_id]).\
+                where(db.process.c.fingerprint == fingerprint).\
+                order_by(db.process.c.process_id.desc())
+    result = db.execute(select)
+    row = result.fetchone()
+    result.close()
+
+    if not existdb:
+        db.close()
+    if row is None:
+        return None
+    return row['process_id']
+
+
 def fill_process_table(version_id, rawfile_id, parfile_id, template_id,
-                       manip, nchan, nsub, existdb=None):
+                       manip, nchan, nsub, fingerprint=None, existdb=None):
     db = existdb or database.Database()
     db.connect()
 
@@ -101,6 +239,7 @@ def fill_process_table(version_id, rawfile_id, parfile_id, template_id,
               'nchan': nchan,
               'nsub': nsub,
               'toa_fitting_method': config.cfg.toa_fitting_method,
+              'fingerprint': fingerprint,
               'user_id': cache.get_userid()}
     result = db.execute(ins, values)
     process_id = result.inserted_primary_key[0]
@@ -113,112 +252,219 @@ def fill_process_table(version_id, rawfile_id, parfile_id, template_id,
     return process_id
     
 
-def pipeline_core(manip, rawfile_id, parfile_id, template_id,
-                  existdb=None):
-    """Run a prepared manipulator function on the raw file with 
-        ID 'rawfile_id'. Then generate TOAs and load them into the DB.
+def check_version_id(version_id, existdb=None):
+    """Check the pipeline/psrchive versions haven't changed since
+        processing started.
 
         Inputs:
-            manip: A manipulator instance.
-            rawfile_id: The ID number of the raw data file to generate TOAs from.
-            parfile_id: The ID number of the parfile to install into the
-                raw file. If this is None, then no new parfile will be installed.
-            template_id: The ID number of the template to use.
+            version_id: The version ID at the start of processing.
             existdb: An existing database connection object.
                 (Default: establish a new DB connection)
 
         Outputs:
             None
     """
-    # Initialise these so the 'finally' clause doesn't throw an exception of
-    # it's own if an error is caught before these filenames are determined
-    manipfn = ''
-    adjustfn = ''
+    new_version_id = version.get_version_id(existdb)
+    if version_id != new_version_id:
+        raise errors.ToasterError("Weird... Version ID at the start "
+                                  "of processing (%s) is different "
+                                  "from at the end (%d)!" %
+                                  (version_id, new_version_id))
 
-    #Start pipeline
-    print("###################################################")
-    print("Starting to toast data")
-    print("Start time: %s" % utils.give_utc_now())
-    print("###################################################")
-    
+
+def manipulate_rawfile(manip, rawfile_id, parfile_id, md5sums, version_id,
+                       existdb=None, timer=None, tmpdir=None):
+    """Re-install the ephemeris in a raw file (if requested) and run
+        the manipulator on it. The result of an identical manipulation
+        is re-used if it is in the cache of manipulated archives.
+
+        Inputs:
+            manip: A manipulator instance.
+            rawfile_id: The ID number of the raw data file.
+            parfile_id: The ID number of the parfile to install into the
+                raw file. If this is None, then no new parfile will be installed.
+            md5sums: The MD5 sums of the job's input files
+                (see 'get_input_md5sums').
+            version_id: The ID number of the pipeline/psrchive versions.
+            existdb: An existing database connection object.
+                (Default: establish a new DB connection)
+            timer: A StageTimer to add the time spent in each stage
+                to (see 'utils/timing.py'). (Default: don't time stages)
+            tmpdir: The directory to create temporary files in
+                (e.g. a job's scratch space, see 'utils/scratch.py').
+                (Default: 'base_tmp_dir')
+
+        Output:
+            manipfn: The name of the manipulated archive. This is a
+                temporary file, which should be removed by the caller.
+    """
+    if timer is None:
+        timer = timing.StageTimer()
+    if tmpdir is None:
+        tmpdir = config.cfg.base_tmp_dir
     db = existdb or database.Database()
     db.connect()
 
+    # Initialise this so the 'finally' clause doesn't throw an exception of
+    # it's own if an error is caught before the filename is determined
+    adjustfn = ''
+    # Create a temporary file for the manipulated results
+    tmpfile, manipfn = tempfile.mkstemp(prefix='toaster_tmp',
+                                        suffix='_manip.ar',
+                                        dir=tmpdir)
+    os.close(tmpfile)
     try:
-        trans = db.begin()  # Open a transaction
-
-        # Get version ID
-        version_id = version.get_version_id(db)
         # Get raw data from rawfile_id and verify MD5SUM
-        rawfile = rawfiles_general.get_rawfile_from_id(rawfile_id,
-                                                       db, verify_md5=True)
-        
-        # Manipulate the raw file
-        notify.print_info("Manipulating file", 1)
-        # Create a temporary file for the adjusted results
-        tmpfile, adjustfn = tempfile.mkstemp(prefix='toaster_tmp',
-                                             suffix='_newephem.ar',
-                                             dir=config.cfg.base_tmp_dir)
-        os.close(tmpfile)
-        shutil.copy(rawfile, adjustfn)
-        
-        if parfile_id is not None:
-            # Re-install ephemeris
-            # Get ephemeris from parfile_id and verify MD5SUM
-            parfile = parfiles_general.get_parfile_from_id(parfile_id,
+        with timer.stage('md5_verify'):
+            rawfile = rawfiles_general.get_rawfile_from_id(rawfile_id,
                                                            db, verify_md5=True)
-  
-            cmd = ["pam", "-m", "-E", parfile, "--update_dm", adjustfn]
-            utils.execute(cmd)
-        
-        # Create a temporary file for the manipulated results
-        tmpfile, manipfn = tempfile.mkstemp(prefix='toaster_tmp',
-                                            suffix='_manip.ar',
-                                            dir=config.cfg.base_tmp_dir)
-        os.close(tmpfile)
-        # Run the manipulator
-        manip.run([adjustfn], manipfn, tmpdir=config.cfg.base_tmp_dir)
- 
-        # Get template from template_id and verify MD5SUM
-        template = templates_general.get_template_from_id(template_id,
-                                                          db, verify_md5=True)
-        
-        # Create a temporary file for the toa diagnostic plots
-        tmpfile, toadiagfn = tempfile.mkstemp(prefix='toaster_tmp',
-                                              suffix='_TOAdiag.png',
-                                              dir=config.cfg.base_tmp_dir)
-        os.close(tmpfile)
-        # Generate TOAs with pat
-        notify.print_info("Computing TOAs", 0)
-        cmd = ["pat", "-f", "tempo2", "-A", config.cfg.toa_fitting_method,
-               "-s", template, "-C",  "gof length bw nbin nchan nsubint",
-               "-t", "-K", "%s/PNG" % toadiagfn, manipfn]
-        patout, paterr = utils.execute(cmd)
 
-        # Check version ID is still the same. Just in case.
-        new_version_id = version.get_version_id(db)
-        if version_id != new_version_id:
-            raise errors.ToasterError("Weird... Version ID at the start "
-                                      "of processing (%s) is different "
-                                      "from at the end (%d)!" %
-                                      (version_id, new_version_id))
-        
+        # Re-use the archive from a previous identical manipulation
+        manipcache = get_manip_cache()
+        manipkey = get_manip_cache_key(manip, md5sums, version_id)
+        if (manipcache is not None) and manipcache.fetch(manipkey, manipfn):
+            notify.print_info("Using cached manipulated file", 1)
+        else:
+            # Manipulate the raw file
+            notify.print_info("Manipulating file", 1)
+            # Create a temporary file for the adjusted results
+            tmpfile, adjustfn = tempfile.mkstemp(prefix='toaster_tmp',
+                                                 suffix='_newephem.ar',
+                                                 dir=tmpdir)
+            os.close(tmpfile)
+            staging.stage_file(rawfile, adjustfn)
+
+            parfile = None
+            if parfile_id is not None:
+                # Re-install ephemeris
+                # Get ephemeris from parfile_id and verify MD5SUM
+                with timer.stage('md5_verify'):
+                    parfile = parfiles_general.get_parfile_from_id(
+                                    parfile_id, db, verify_md5=True)
+
+            if (parfile is not None) and not manip.accepts_ephemeris:
+                with timer.stage('ephemeris_install'):
+                    # 'pam -m' modifies the file in place
+                    staging.make_private(adjustfn)
+                    backends.get_backend().install_ephemeris(adjustfn, parfile)
+
+            # Run the manipulator
+            with timer.stage('manipulation'):
+                if manip.accepts_ephemeris:
+                    # Install the ephemeris in the same pass
+                    manip.run([adjustfn], manipfn, tmpdir=tmpdir,
+                              parfile=parfile)
+                else:
+                    manip.run([adjustfn], manipfn, tmpdir=tmpdir)
+            if manipcache is not None:
+                manipcache.put(manipkey, manipfn)
+    except:
+        if os.path.isfile(manipfn):
+            os.remove(manipfn)
+        raise
+    finally:
+        if os.path.isfile(adjustfn):
+            os.remove(adjustfn)
+        if not existdb:
+            db.close()
+    return manipfn
+
+
+def run_pat(manipfns, template, toadiagfn):
+    """Generate TOAs with 'pat'.
+
+        Inputs:
+            manipfns: A list of (manipulated) archives to generate
+                TOAs for.
+            template: The template's file name.
+            toadiagfn: The file name for the TOA diagnostic plots.
+                The plot for the first TOA is written to this file,
+                and the n-th to '<toadiagfn>_<n>' (see
+                'get_toa_diagnostic_plot_name').
+
+        Output:
+            patout: The stdout output of 'pat'.
+    """
+    cmd = ["pat", "-f", "tempo2", "-A", config.cfg.toa_fitting_method,
+           "-s", template, "-C",  "gof length bw nbin nchan nsubint",
+           "-t", "-K", "%s/PNG" % toadiagfn] + list(manipfns)
+    patout, paterr = utils.execute(cmd)
+    return patout
+
+
+def get_toa_diagnostic_plot_name(toadiagfn, toanum):
+    """Return the name of the diagnostic plot 'pat' wrote for a TOA.
+
+        Inputs:
+            toadiagfn: The file name given to 'pat' for the plots.
+            toanum: The TOA's position in the output of 'pat'
+                (starting at 0).
+
+        Output:
+            plotfn: The name of the TOA's plot.
+    """
+    if toanum == 0:
+        return toadiagfn
+    else:
+        return "%s_%d" % (toadiagfn, toanum+1)
+
+
+def load_processing_results(manip, rawfile_id, parfile_id, template_id,
+                            version_id, fingerprint, manipfn, toas,
+                            toadiagfn, existdb=None, timer=None):
+    """Load the results of a processing job into the DB: the
+        processing run, its TOAs, processing diagnostics,
+        TOA diagnostic plots and the time spent in each stage.
+
+        NOTE: This should be called within a DB transaction.
+
+        Inputs:
+            manip: A manipulator instance.
+            rawfile_id: The ID number of the raw data file.
+            parfile_id: The ID number of the parfile (or None).
+            template_id: The ID number of the template.
+            version_id: The ID number of the pipeline/psrchive versions.
+            fingerprint: The processing job's fingerprint.
+            manipfn: The name of the manipulated archive.
+            toas: A list of (toanum, toainfo) tuples. 'toanum' is the
+                TOA's position in the output of 'pat' (starting at 0),
+                and 'toainfo' is a dictionary as returned by
+                'toas_general.parse_pat_output'.
+            toadiagfn: The file name given to 'pat' for the TOA
+                diagnostic plots.
+            existdb: An existing database connection object.
+                (Default: establish a new DB connection)
+            timer: A StageTimer with the time spent in the earlier
+                stages of the job (see 'utils/timing.py'). The time
+                spent loading the results is added to it.
+                (Default: only time the stages run here)
+
+        Output:
+            process_id: The ID number of the processing job.
+    """
+    if timer is None:
+        timer = timing.StageTimer()
+    db = existdb or database.Database()
+    db.connect()
+
+    with timer.stage('header_read'):
         # Read some header values from the manipulated archive
         hdr = datafile.get_header_vals(manipfn, ['nchan', 'nsub', 'name',
                                                  'intmjd', 'fracmjd'])
         hdr['secs'] = int(hdr['fracmjd']*24*3600+0.5)  # Add 0.5 so result is
                                                        # rounded to nearest int
- 
+        # The header is parsed once, and shared by the diagnostics
+        params = datafile.prep_file(manipfn)
+
+    with timer.stage('toa_insert'):
         # Fill pipeline table
-        cmdline = " ".join(sys.argv)
         process_id = fill_process_table(version_id, rawfile_id, parfile_id,
                                         template_id, manip, hdr['nchan'],
-                                        hdr['nsub'], db)
-        
-        # Parse pat output
-        toainfo = toas_general.parse_pat_output(patout)
+                                        hdr['nsub'], fingerprint, db)
 
-        rawfile_info = rawfiles_general.get_rawfile_info(rawfile_id)
+        toainfo = [ti for toanum, ti in toas]
+        rawfile_info = rawfiles_general.get_rawfile_info(rawfile_id,
+                                                         existdb=db)
         # Insert TOAs into DB
         for ti in toainfo:
             ti['process_id'] = process_id
@@ -227,44 +473,150 @@ def pipeline_core(manip, rawfile_id, parfile_id, template_id,
             ti['pulsar_id'] = rawfile_info['pulsar_id']
             ti['obssystem_id'] = rawfile_info['obssystem_id']
         toa_ids = load_toa.load_toas(toainfo, db)
-                 
-        # Create processing diagnostics
-        notify.print_info("Generating processing diagnostics", 1)
-        diagdir = make_proc_diagnostics_dir(manipfn, process_id)
+
+    # Create processing diagnostics
+    with timer.stage('diagnostics'):
+        diagdir = make_proc_diagnostics_dir(manipfn, process_id, params)
         suffix = "_procid%d.%s" % (process_id, manip.name)
-        diags = []
-        for diagname in config.cfg.default_rawfile_diagnostics:
-            diagcls = diagnostics.get_diagnostic_class(diagname)
-            try:
-                diags.append(diagcls(manipfn))
-            except (errors.DiagnosticNotApplicable, e):
-                notify.print_info("Diagnostic isn't applicable: %s. "
-                                  "Skipping..." % str(e), 1)
-        if diags:
-            # Load processing diagnostics
-            diagnose_processing.insert_processing_diagnostics(process_id,
-                                                              diags, diagdir,
-                                                              suffix, existdb=db)
-       
-        # Copy TOA diagnostic plots and register them into DB
+        diagnames = config.cfg.default_rawfile_diagnostics
+        if diagnose_processing.get_diagnostics_mode() == 'inline':
+            notify.print_info("Generating processing diagnostics", 1)
+            # Restore cached plots into the job's scratch space
+            workdir = os.path.dirname(manipfn)
+            diagnose_processing.compute_processing_diagnostics(process_id,
+                                                               manipfn,
+                                                               diagnames,
+                                                               diagdir, suffix,
+                                                               params,
+                                                               existdb=db,
+                                                               workdir=workdir)
+        else:
+            # Don't hold up committing the TOAs
+            diagnose_processing.queue_processing_diagnostics(process_id,
+                                                             manipfn,
+                                                             diagnames,
+                                                             diagdir, suffix,
+                                                             existdb=db)
+
+    # Copy TOA diagnostic plots and register them into DB
+    with timer.stage('plot_moves'):
         basefn = "%(name)s_%(intmjd)05d_%(secs)05d" % hdr
 
-        values = [] 
-        for ii, toa_id in enumerate(toa_ids):
+        values = []
+        for ii, (toa_id, (toanum, ti)) in enumerate(zip(toa_ids, toas)):
             outfn = basefn+"_procid%d.TOA%d.png" % (process_id, ii+1)
-            if ii == 0:
-                fn = toadiagfn
-            else:
-                fn = "%s_%d" % (toadiagfn, ii+1)
+            fn = get_toa_diagnostic_plot_name(toadiagfn, toanum)
             shutil.move(fn, os.path.join(diagdir, outfn))
-            ins = db.toa_diagnostic_plots.insert()
             values.append({'toa_id': toa_id,
                            'filename': outfn,
                            'filepath': diagdir,
                            'plot_type': 'Prof-Temp Resids'})
-        result = db.execute(ins, values)
-        result.close()
-        notify.print_info("Inserted %d TOA diagnostic plots." % len(toa_ids), 2)
+        if values:
+            ins = db.toa_diagnostic_plots.insert()
+            result = db.execute(ins, values)
+            result.close()
+    notify.print_info("Inserted %d TOA diagnostic plots." % len(toa_ids), 2)
+
+    timing.store_process_timings(process_id, timer, db)
+
+    if not existdb:
+        db.close()
+    return process_id
+
+
+def pipeline_core(manip, rawfile_id, parfile_id, template_id,
+                  existdb=None, force=False, before_load=None):
+    """Run a prepared manipulator function on the raw file with 
+        ID 'rawfile_id'. Then generate TOAs and load them into the DB.
+
+        Inputs:
+            manip: A manipulator instance.
+            rawfile_id: The ID number of the raw data file to generate TOAs from.
+            parfile_id: The ID number of the parfile to install into the
+                raw file. If this is None, then no new parfile will be installed.
+            template_id: The ID number of the template to use.
+            existdb: An existing database connection object.
+                (Default: establish a new DB connection)
+            force: Process the data even if an identical processing
+                job is already in the DB. (Default: re-use the
+                existing processing job)
+            before_load: A function called (with the DB connection)
+                in the job's transaction, just before its results are
+                loaded into the DB. It may raise an exception to roll
+                the job back. (Default: no function is called)
+
+        Outputs:
+            process_id: The ID number of the processing job.
+    """
+    # Initialise these so the 'finally' clause doesn't throw an exception of
+    # it's own if an error is caught before these filenames are determined
+    manipfn = ''
+    toadiagfn = ''
+    toas = []
+    timer = timing.StageTimer()
+
+    db = existdb or database.Database()
+    db.connect()
+
+    # Get version ID
+    version_id = version.get_version_id(db)
+    # Check if this exact processing job has been done already
+    md5sums = get_input_md5sums(rawfile_id, parfile_id, template_id, db)
+    fingerprint = get_processing_fingerprint(manip, md5sums, version_id)
+    if not force:
+        process_id = get_process_id_by_fingerprint(fingerprint, db)
+        if process_id is not None:
+            notify.print_info("Rawfile (ID: %d) has already been processed "
+                              "identically (process ID: %d). Skipping. "
+                              "(Use --force to process it again.)" %
+                              (rawfile_id, process_id), 0)
+            if not existdb:
+                db.close()
+            return process_id
+
+    # Reserve scratch space for the job's temporary files
+    rawfile_info = rawfiles_general.get_rawfile_info(rawfile_id, existdb=db)
+    scratchspace = scratch.ScratchSpace(
+                        scratch.estimate_scratch_size([rawfile_info['filesize']]),
+                        name="rawfile (ID: %d)" % rawfile_id)
+
+    #Start pipeline
+    print("###################################################")
+    print("Starting to toast data")
+    print("Start time: %s" % utils.give_utc_now())
+    print("###################################################")
+    
+    try:
+        trans = db.begin()  # Open a transaction
+
+        manipfn = manipulate_rawfile(manip, rawfile_id, parfile_id,
+                                     md5sums, version_id, db, timer,
+                                     scratchspace.path)
+
+        # Get template from template_id and verify MD5SUM
+        with timer.stage('md5_verify'):
+            template = templates_general.get_template_from_id(template_id,
+                                                    db, verify_md5=True)
+        
+        # Create a temporary file for the toa diagnostic plots
+        toadiagfn = scratchspace.mkstemp(suffix='_TOAdiag.png')
+        # Generate TOAs with pat
+        notify.print_info("Computing TOAs", 0)
+        with timer.stage('pat'):
+            patout = run_pat([manipfn], template, toadiagfn)
+
+        # Check version ID is still the same. Just in case.
+        check_version_id(version_id, db)
+        if before_load is not None:
+            before_load(db)
+
+        # Parse pat output
+        toas = list(enumerate(toas_general.parse_pat_output(patout)))
+
+        process_id = load_processing_results(manip, rawfile_id, parfile_id,
+                                             template_id, version_id,
+                                             fingerprint, manipfn, toas,
+                                             toadiagfn, db, timer)
     except:
         db.rollback()
         sys.stdout.write(colour.cstring("Error encountered. "
@@ -275,11 +627,15 @@ def pipeline_core(manip, rawfile_id, parfile_id, template_id,
         # No exceptions encountered
         # Commit database transaction
         db.commit()
+        if diagnose_processing.get_diagnostics_mode() == 'after-commit':
+            notify.print_info("Generating processing diagnostics", 1)
+            with timer.stage('diagnostics'):
+                diagnose_processing.run_queued_diagnostics([process_id],
+                                                           existdb=db)
+            timing.store_process_timings(process_id, timer, db)
     finally:
-        # Clean up
-        for fn in [adjustfn, manipfn]:
-            if os.path.isfile(fn):
-                os.remove(fn)
+        # Clean up (the scratch space holds all temporary files)
+        scratchspace.release()
         # End pipeline
         print("###################################################")
         print(random.choice(SUCCESSMSGS))
@@ -289,9 +645,237 @@ def pipeline_core(manip, rawfile_id, parfile_id, template_id,
         # Close DB connection
         if not existdb:
             db.close()
+    return process_id
 
 
-def reduce_rawfile(args, leftover_args=[], existdb=None):
+def compute_batch_toas(manipfns, template, workdir):
+    """Generate TOAs for many manipulated archives with a single
+        call to 'pat'. If 'pat' fails, each archive is tried
+        separately, so one bad archive doesn't spoil the batch.
+
+        Inputs:
+            manipfns: A list of manipulated archives. Their base
+                names must be unique.
+            template: The template's file name.
+            workdir: The directory to write TOA diagnostic plots to.
+
+        Output:
+            results: A dictionary, keyed by the names of the archives,
+                of (toadiagfn, toas) tuples. 'toadiagfn' is the file name
+                given to 'pat' for the TOA diagnostic plots, and 'toas'
+                is a list of (toanum, toainfo) tuples (see
+                'toas_general.parse_pat_output_by_file'). Archives 'pat'
+                failed on, or produced no TOAs for, are not included.
+    """
+    tmpfile, toadiagfn = tempfile.mkstemp(prefix='toaster_tmp',
+                                          suffix='_TOAdiag.png',
+                                          dir=workdir)
+    os.close(tmpfile)
+    try:
+        patout = run_pat(manipfns, template, toadiagfn)
+    except errors.SystemCallError:
+        if len(manipfns) == 1:
+            traceback.print_exc()
+            return {}
+        warnings.warn("Running 'pat' on a batch of %d archives failed. "
+                      "Trying each archive separately." % len(manipfns),
+                      errors.ToasterWarning)
+        results = {}
+        for manipfn in manipfns:
+            results.update(compute_batch_toas([manipfn], template, workdir))
+        return results
+    toas_by_file = toas_general.parse_pat_output_by_file(patout)
+    results = {}
+    for manipfn in manipfns:
+        toas = toas_by_file.get(os.path.basename(manipfn))
+        if not toas:
+            warnings.warn("No TOAs were found in the output of 'pat' for "
+                          "%s." % manipfn, errors.ToasterWarning)
+            continue
+        results[manipfn] = (toadiagfn, toas)
+    return results
+
+
+def pipeline_batch(jobs, existdb=None, batch_size=PAT_BATCH_SIZE):
+    """Run many processing jobs. Each raw file is manipulated
+        separately, but TOAs are generated with a single call to
+        'pat' for each batch of archives that use the same template.
+        This saves 'pat' starting up, and loading the template, for
+        every job.
+
+        Each job's results are loaded into the DB in a separate
+        transaction. Jobs that fail are reported, and skipped.
+
+        Inputs:
+            jobs: A list of processing jobs. Each is a dictionary
+                of arguments for 'pipeline_core' (see
+                'get_processing_job').
+            existdb: An existing database connection object.
+                (Default: establish a new DB connection)
+            batch_size: The maximum number of archives to pass to
+                a single call to 'pat'. (Default: PAT_BATCH_SIZE)
+
+        Output:
+            process_ids: A list of the ID numbers of the jobs'
+                processing runs, in the same order as 'jobs'.
+                The ID is None for jobs that failed.
+    """
+    db = existdb or database.Database()
+    db.connect()
+
+    #Start pipeline
+    print("###################################################")
+    print("Starting to toast data (%d processing jobs)" % len(jobs))
+    print("Start time: %s" % utils.give_utc_now())
+    print("###################################################")
+
+    # Get version ID
+    version_id = version.get_version_id(db)
+    process_ids = [None]*len(jobs)
+    # Jobs that need to be run (indices into 'jobs'), grouped by template
+    torun = {}
+    fingerprints = {}
+    md5sums = {}
+    filesizes = {}
+    for ii, job in enumerate(jobs):
+        try:
+            md5sums[ii] = get_input_md5sums(job['rawfile_id'],
+                                            job['parfile_id'],
+                                            job['template_id'], db)
+            filesizes[ii] = rawfiles_general.get_rawfile_info(
+                                    job['rawfile_id'], existdb=db)['filesize']
+        except errors.ToasterError:
+            traceback.print_exc()
+            continue
+        fingerprints[ii] = get_processing_fingerprint(job['manip'],
+                                                      md5sums[ii], version_id)
+        if not job.get('force', False):
+            process_id = get_process_id_by_fingerprint(fingerprints[ii], db)
+            if process_id is not None:
+                notify.print_info("Rawfile (ID: %d) has already been "
+                                  "processed identically (process ID: %d). "
+                                  "Skipping. (Use --force to process it "
+                                  "again.)" % (job['rawfile_id'], process_id), 0)
+                process_ids[ii] = process_id
+                continue
+        torun.setdefault(job['template_id'], []).append(ii)
+
+    # The time each job spends in each stage. The time spent on
+    # work shared by jobs (verifying the template, running 'pat')
+    # is split evenly between them.
+    timers = {}
+    try:
+        for template_id in sorted(torun):
+            group = torun[template_id]
+            temptimer = timing.StageTimer()
+            try:
+                # Get template from template_id and verify MD5SUM
+                with temptimer.stage('md5_verify'):
+                    template = templates_general.get_template_from_id(
+                                        template_id, db, verify_md5=True)
+            except errors.ToasterError:
+                traceback.print_exc()
+                continue
+            for ii in group:
+                timers[ii] = timing.StageTimer()
+                timers[ii].add('md5_verify',
+                               temptimer.seconds['md5_verify']/len(group))
+            for start in range(0, len(group), batch_size):
+                batch = group[start:start+batch_size]
+                # Reserve scratch space for the batch's temporary files
+                scratchspace = scratch.ScratchSpace(
+                            scratch.estimate_scratch_size([filesizes[ii]
+                                                           for ii in batch]),
+                            name="batch of %d raw files" % len(batch))
+                manipfns = {}
+                try:
+                    for ii in batch:
+                        job = jobs[ii]
+                        try:
+                            manipfns[ii] = manipulate_rawfile(job['manip'],
+                                                    job['rawfile_id'],
+                                                    job['parfile_id'],
+                                                    md5sums[ii], version_id,
+                                                    db, timers[ii],
+                                                    scratchspace.path)
+                        except errors.ToasterError:
+                            traceback.print_exc()
+                    if not manipfns:
+                        continue
+                    # Generate TOAs with pat
+                    notify.print_info("Computing TOAs for %d archives" %
+                                      len(manipfns), 0)
+                    battimer = timing.StageTimer()
+                    with battimer.stage('pat'):
+                        results = compute_batch_toas([manipfns[ii] for ii in
+                                                      sorted(manipfns)],
+                                                     template,
+                                                     scratchspace.path)
+                    for ii in manipfns:
+                        timers[ii].add('pat',
+                                       battimer.seconds['pat']/len(manipfns))
+                    for ii in sorted(manipfns):
+                        job = jobs[ii]
+                        if manipfns[ii] not in results:
+                            continue
+                        toadiagfn, toas = results[manipfns[ii]]
+                        db.begin()  # Open a transaction
+                        try:
+                            # Check version ID is still the same. Just in case.
+                            check_version_id(version_id, db)
+                            process_ids[ii] = load_processing_results(
+                                    job['manip'], job['rawfile_id'],
+                                    job['parfile_id'], job['template_id'],
+                                    version_id, fingerprints[ii],
+                                    manipfns[ii], toas, toadiagfn, db,
+                                    timers[ii])
+                        except errors.ToasterError:
+                            db.rollback()
+                            traceback.print_exc()
+                        except:
+                            db.rollback()
+                            raise
+                        else:
+                            db.commit()
+                            if diagnose_processing.get_diagnostics_mode() == \
+                                    'after-commit':
+                                notify.print_info("Generating processing "
+                                                  "diagnostics", 1)
+                                with timers[ii].stage('diagnostics'):
+                                    diagnose_processing.run_queued_diagnostics(
+                                                [process_ids[ii]], existdb=db)
+                                timing.store_process_timings(process_ids[ii],
+                                                             timers[ii], db)
+                finally:
+                    # Clean up (the scratch space holds all temporary files)
+                    scratchspace.release()
+    finally:
+        # End pipeline
+        print("###################################################")
+        print(random.choice(SUCCESSMSGS))
+        print("End time: %s" % utils.give_utc_now())
+        print("###################################################")
+
+        # Close DB connection
+        if not existdb:
+            db.close()
+    return process_ids
+
+
+def get_processing_job(args, leftover_args=[], existdb=None):
+    """Determine a processing job from command line arguments,
+        loading the raw file, parfile and template into the DB
+        if necessary.
+
+        Inputs:
+            args: The parsed command line arguments.
+            leftover_args: Arguments for the manipulator.
+            existdb: An existing database connection object.
+                (Default: establish a new DB connection)
+
+        Output:
+            job: A dictionary of arguments for 'pipeline_core'.
+    """
     if args.rawfile is not None:
         notify.print_info("Loading rawfile %s" % args.rawfile, 1)
         args.rawfile_id = load_rawfile.load_rawfile(args.rawfile, existdb)
@@ -341,9 +925,57 @@ def reduce_rawfile(args, leftover_args=[], existdb=None):
     # Load manipulator
     manip = manipulators.load_manipulator(args.manip_name)
     manip.parse_args(leftover_args) 
+    return {'manip': manip,
+            'rawfile_id': args.rawfile_id,
+            'parfile_id': args.parfile_id,
+            'template_id': args.template_id,
+            'force': args.force}
+
+
+def get_job_ids(job):
+    """Return the ID numbers of a processing job's input files.
+
+        Input:
+            job: A processing job (see 'get_processing_job').
+
+        Output:
+            ids: A dictionary of the job's 'rawfile_id', 'parfile_id'
+                and 'template_id'.
+    """
+    return {'rawfile_id': job['rawfile_id'],
+            'parfile_id': job['parfile_id'],
+            'template_id': job['template_id']}
+
+
+def use_journalled_ids(args, ids):
+    """When retrying a line of a resumed batch, use the files that
+        an earlier attempt loaded into the DB, rather than loading
+        them again.
+
+        Inputs:
+            args: The parsed command line arguments of the line.
+                They are modified in place.
+            ids: The ID numbers recorded in the batch's journal
+                for the line (see 'get_job_ids').
+
+        Outputs:
+            None
+    """
+    for name in ('rawfile', 'parfile', 'template'):
+        idname = name + '_id'
+        if (getattr(args, name) is not None) and \
+                (ids.get(idname) is not None):
+            notify.print_info("Using %s (%s) loaded by an earlier attempt "
+                              "(%s: %d)" % (name, getattr(args, name),
+                                            idname, ids[idname]), 2)
+            setattr(args, name, None)
+            setattr(args, idname, ids[idname])
+
+
+def reduce_rawfile(args, leftover_args=[], existdb=None):
+    job = get_processing_job(args, leftover_args, existdb)
     # Run pipeline core
-    pipeline_core(manip, args.rawfile_id, args.parfile_id,
-                  args.template_id, existdb)
+    return pipeline_core(existdb=existdb, **job)
 
 
 def main():
@@ -360,30 +992,113 @@ def main():
                     raise errors.FileError("The list of cmd line args (%s) "
                                            "does not exist." % args.from_file)
                 argfile = open(args.from_file, 'r')
-            numfails = 0
+            lines = []
             for line in argfile:
                 # Strip comments
                 line = line.partition('#')[0].strip()
                 if not line:
                     # Skip empty line
                     continue
-                try:
-                    customargs = copy.deepcopy(args)
-                    arglist = leftover_args+shlex.split(line.strip())
-                    customargs, custom_leftover_args = \
-                            parser.parse_known_args(arglist, namespace=customargs)
-                    reduce_rawfile(customargs, custom_leftover_args, db)
-                except errors.ToasterError:
-                    numfails += 1
-                    traceback.print_exc()
+                lines.append(line)
             if args.from_file != '-':
                 argfile.close()
+            keys = journal.get_line_keys(lines)
+            batchjournal = journal.BatchJournal(
+                        journal.get_journal_path(args.from_file, args.journal),
+                        args.resume)
+            numfails = 0
+            numskipped = 0
+            jobs = []
+            # Indices (into 'lines') of the lines of 'jobs'
+            joblines = []
+            try:
+                for ii, line in enumerate(lines):
+                    if args.resume and batchjournal.is_done(keys[ii]):
+                        numskipped += 1
+                        continue
+                    ids = dict(batchjournal.get_ids(keys[ii]))
+                    try:
+                        customargs = copy.deepcopy(args)
+                        arglist = leftover_args+shlex.split(line)
+                        customargs, custom_leftover_args = \
+                                parser.parse_known_args(arglist,
+                                                        namespace=customargs)
+                        use_journalled_ids(customargs, ids)
+                        job = get_processing_job(customargs,
+                                                 custom_leftover_args, db)
+                    except errors.ToasterError as exc:
+                        numfails += 1
+                        traceback.print_exc()
+                        # Keep the IDs of files loaded before the failure
+                        for idname in ('rawfile_id', 'parfile_id',
+                                       'template_id'):
+                            if getattr(customargs, idname, None) is not None:
+                                ids[idname] = getattr(customargs, idname)
+                        batchjournal.record(keys[ii], line, 'failed', ids,
+                                            str(exc))
+                        continue
+                    ids = get_job_ids(job)
+                    # Record the loaded files, in case the batch dies
+                    # before the job is done
+                    batchjournal.record(keys[ii], line, 'pending', ids)
+                    if args.enqueue:
+                        job['priority'] = customargs.priority
+                        jobs.append(job)
+                        joblines.append(ii)
+                    elif args.pat_batch_size > 1:
+                        jobs.append(job)
+                        joblines.append(ii)
+                    else:
+                        try:
+                            ids['process_id'] = pipeline_core(existdb=db,
+                                                              **job)
+                        except errors.ToasterError as exc:
+                            numfails += 1
+                            traceback.print_exc()
+                            batchjournal.record(keys[ii], line, 'failed', ids,
+                                                str(exc))
+                        else:
+                            batchjournal.record(keys[ii], line, 'done', ids)
+                if numskipped:
+                    notify.print_info("Skipped %d processing jobs already "
+                                      "done (journal: %s)" %
+                                      (numskipped, batchjournal.path), 1)
+                if jobs and args.enqueue:
+                    job_ids = processing_jobs.add_processing_jobs(jobs, db)
+                    print("Queued %d processing jobs. processing_job_ids: %s" %
+                          (len(job_ids), ", ".join(["%d" % job_id
+                                                    for job_id in job_ids])))
+                    for ii, job, job_id in zip(joblines, jobs, job_ids):
+                        ids = get_job_ids(job)
+                        ids['processing_job_id'] = job_id
+                        batchjournal.record(keys[ii], lines[ii], 'done', ids)
+                elif jobs:
+                    process_ids = pipeline_batch(jobs, db,
+                                                 batch_size=args.pat_batch_size)
+                    numfails += process_ids.count(None)
+                    for ii, job, process_id in zip(joblines, jobs,
+                                                   process_ids):
+                        ids = get_job_ids(job)
+                        if process_id is None:
+                            batchjournal.record(keys[ii], lines[ii], 'failed',
+                                                ids, "Processing failed")
+                        else:
+                            ids['process_id'] = process_id
+                            batchjournal.record(keys[ii], lines[ii], 'done',
+                                                ids)
+            finally:
+                batchjournal.close()
             if numfails:
                 raise errors.ToasterError(
                     "\n\n===================================\n"
                     "The reduction of %d rawfiles failed!\n"
                     "Please review error output.\n"
                     "===================================\n" % numfails)
+        elif args.enqueue:
+            job = get_processing_job(args, leftover_args, db)
+            job['priority'] = args.priority
+            job_id = processing_jobs.add_processing_jobs([job], db)[0]
+            print("Queued processing job. processing_job_id: %d" % job_id)
         else:
             reduce_rawfile(args, leftover_args, db)
     finally:
@@ -433,6 +1148,13 @@ if __name__ == "__main__":
                           default=None,
                           help="A template to archive/load to DB and use "
                                "when generating TOAs.")
+    parser.add_argument('--force', dest='force', action='store_true',
+                        default=False,
+                        help="Process the data even if an identical "
+                             "processing job (same input files, "
+                             "manipulator, arguments, fitting method "
+                             "and pipeline version) is already in the DB. "
+                             "(Default: skip such jobs)")
     parser.add_argument('--from-file', dest='from_file',
                         type=str, default=None,
                         help="A list of command line arguments. "
@@ -442,6 +1164,40 @@ if __name__ == "__main__":
                              "arguments provided explicitly on the cmd line. "
                              "(Default: perform a single processing job "
                              "defined by the arguments on the cmd line.)")
+    parser.add_argument('--journal', dest='journal',
+                        type=str, default=None,
+                        help="A file recording the outcome of each line "
+                             "of the --from-file list, so the batch can "
+                             "be resumed. (Default: the list's name with "
+                             "'%s' appended. No journal is kept when "
+                             "reading the list from stdin.)" %
+                             journal.JOURNAL_SUFFIX)
+    parser.add_argument('--resume', dest='resume',
+                        action='store_true', default=False,
+                        help="Skip the lines of the --from-file list "
+                             "that the journal records as done, and retry "
+                             "the others. Files loaded into the DB by an "
+                             "earlier attempt at a line are not loaded "
+                             "again. (Default: run every line, starting "
+                             "a new journal)")
+    parser.add_argument('--pat-batch-size', dest='pat_batch_size',
+                        type=int, default=1,
+                        help="When processing jobs listed with --from-file, "
+                             "the maximum number of archives that use the "
+                             "same template to generate TOAs for with a "
+                             "single call to 'pat' (e.g. %d). A value of 1 "
+                             "processes each job separately. (Default: 1)" %
+                             PAT_BATCH_SIZE)
+    parser.add_argument('--enqueue', dest='enqueue', action='store_true',
+                        default=False,
+                        help="Add the processing jobs to the DB queue, to "
+                             "be run by 'toaster_worker.py', rather than "
+                             "running them now. (Default: run them now)")
+    parser.add_argument('--priority', dest='priority', type=int,
+                        default=0,
+                        help="The priority of jobs added to the queue "
+                             "with --enqueue. Jobs with higher priority "
+                             "are run first. (Default: 0)")
     args, leftover_args = parser.parse_known_args()
     if ((args.rawfile is None) and (args.rawfile_id is None)) and \
                 (args.from_file is None):
@@ -5,6 +5,7 @@ import warnings
 from toaster import database
 from toaster import errors
 from toaster.utils import notify
+from toaster.utils import archivecache
 from utils import int_re, float_re
 from utils import datafile
 from utils import cache
@@ -50,7 +51,8 @@ def get_master_parfile(pulsar_id):
                 os.path.join(row['filepath'], row['filename'])
 
 
-def get_parfile_from_id(parfile_id, existdb=None, verify_md5=True):
+def get_parfile_from_id(parfile_id, existdb=None, verify_md5=True,
+                        use_cache=True):
     """Return the path to the raw file that has the given ID number.
         Optionally double check the file's MD5 sum, to make sure
         nothing strange has happened.
@@ -62,6 +64,9 @@ def get_parfile_from_id(parfile_id, existdb=None, verify_md5=True):
                 (Default: Establish a db connection)
             verify_md5: If True, double check the file's MD5 sum.
                 (Default: Perform MD5 check.)
+            use_cache: If True, return the file's copy in the
+                archive cache, if the cache is enabled (see
+                'utils/archivecache.py'). (Default: use the cache)
 
         Output:
             fn: The full file path.
@@ -93,6 +98,12 @@ def get_parfile_from_id(parfile_id, existdb=None, verify_md5=True):
                                                (len(rows), parfile_id))
 
     fullpath = os.path.join(filepath, filename)
+    if use_cache:
+        # Read a local copy, rather than the archive
+        cachedpath = archivecache.get_cached_file(fullpath, md5sum_from_db,
+                                                  verify_md5)
+        if cachedpath is not None:
+            return cachedpath
     # Make sure the file exists
     datafile.verify_file_path(fullpath)
     if verify_md5:
@@ -147,11 +158,13 @@ def set_as_master_parfile(parfile_id, existdb=None):
             return
         else:
             # Update the existing entry
+            replaced = row['mparid']
             query = db.master_parfiles.update(). \
                 where(db.master_parfiles.c.pulsar_id == row['pulsar_id'])
             values = {'parfile_id': parfile_id}
     else:
         # Insert a new entry
+        replaced = None
         query = db.master_parfiles.insert()
         select = db.select([db.parfiles.c.pulsar_id]). \
             where(db.parfiles.c.parfile_id == parfile_id)
@@ -169,6 +182,11 @@ def set_as_master_parfile(parfile_id, existdb=None):
     else:
         trans.commit()
         result.close()
+        if replaced is not None:
+            notify.print_info("The master parfile (ID: %d) has been replaced. "
+                              "Processing that used it can be queued "
+                              "again with 'processing.py replan'." %
+                              replaced, 1)
     finally:
         if not existdb:
             db.close()
@@ -16,6 +16,7 @@ from toaster import errors
 from toaster import colour
 from toaster.utils import cache
 from toaster.utils import notify
+from toaster.utils import timing
 
 SHORTNAME = 'show'
 DESCRIPTION = "Get a list of processing jobs from the DB that match the " \
@@ -56,7 +57,10 @@ def add_arguments(parser):
                              "Recognized modes: 'text' - List information. "
                              "Increase verbosity to get more info; "
                              "'summary' - Summarize the matching processing "
-                             "jobs. Other styles are python-style format "
+                             "jobs; 'timings' - Summarize the time spent in "
+                             "each stage of the pipeline (median and 95th "
+                             "percentile), overall, per manipulator and per "
+                             "observing system. Other styles are python-style format "
                              "strings interpolated using row-information for "
                              "each matching rawfile (e.g. 'Manipulator = "
                              "%%(manipulator)s'). "
@@ -124,6 +128,7 @@ def get_procjobs(args, existdb=None):
                         db.rawfiles.c.filename.
                         label("rawfn"),
                         db.rawfiles.c.pulsar_id,
+                        db.rawfiles.c.obssystem_id,
                         db.replacement_rawfiles.c.replacement_rawfile_id,
                         db.templates.c.filepath.
                         label("temppath"),
@@ -134,7 +139,11 @@ def get_procjobs(args, existdb=None):
                         db.parfiles.c.filename.
                         label("parfn"),
                         db.users.c.real_name,
-                        db.users.c.email_address],
+                        db.users.c.email_address,
+                        db.proc_diagnostics_queue.c.status.
+                        label("diagnostics_status"),
+                        db.proc_diagnostics_queue.c.message.
+                        label("diagnostics_message")],
                 from_obj=[db.process.\
                     outerjoin(db.users,
                         onclause=db.users.c.user_id ==
@@ -156,7 +165,10 @@ def get_procjobs(args, existdb=None):
                                 db.process.c.template_id).\
                     outerjoin(db.parfiles,
                         onclause=db.parfiles.c.parfile_id ==
-                                db.process.c.parfile_id)]).\
+                                db.process.c.parfile_id).\
+                    outerjoin(db.proc_diagnostics_queue,
+                        onclause=db.proc_diagnostics_queue.c.process_id ==
+                                db.process.c.process_id)]).\
                 where(whereclause)
     result = db.execute(select)
     rows = result.fetchall()
@@ -183,6 +195,12 @@ def show_procjobs(procjobs):
         print("Uploaded by: %s (%s)" % \
             (procjob.real_name, procjob.email_address))
         print("Date and time job completed: %s" % procjob.add_time.isoformat(' '))
+        if procjob.diagnostics_status is not None:
+            # Diagnostics were queued (see 'diagnose_processing.py')
+            print("Processing diagnostics: %s" % procjob.diagnostics_status)
+            if procjob.diagnostics_status == 'failed':
+                colour.cprint("    %s" % procjob.diagnostics_message,
+                              'warning')
         if config.cfg.verbosity >= 1:
             lines = ["Template (ID=%d): %s" %
                      (procjob.template_id, procjob.tempfn)]
@@ -207,6 +225,7 @@ def summarize_procjobs(procjobs):
     """
     manipulators = {}
     pulsars = {}
+    diagstatuses = {}
     for procjob in procjobs:
         # Manipulators
         nman = manipulators.get(procjob['manipulator'], 0) + 1
@@ -214,11 +233,86 @@ def summarize_procjobs(procjobs):
         # Pulsars
         npsr = pulsars.get(procjob['pulsar_id'], 0) + 1
         pulsars[procjob['pulsar_id']] = npsr
+        # Queued processing diagnostics
+        if procjob['diagnostics_status'] is not None:
+            nstat = diagstatuses.get(procjob['diagnostics_status'], 0) + 1
+            diagstatuses[procjob['diagnostics_status']] = nstat
     print("Number of processing jobs: %d" % len(procjobs))
     print("Number of manipulators: %d" % len(manipulators))
     for manip in sorted(manipulators.keys()):
         print("    Number of '%s' processing jobs: %d" % (manip, manipulators[manip]))
     print("Number of pulsars: %d" % len(pulsars))
+    if diagstatuses:
+        print("Number of processing jobs with queued diagnostics: %d" %
+              sum(diagstatuses.values()))
+        for status in sorted(diagstatuses.keys()):
+            print("    Number with '%s' diagnostics: %d" %
+                  (status, diagstatuses[status]))
+
+
+def show_stage_timings(label, runtimings):
+    """Print the median, and 95th percentile, of the time spent in
+        each stage of the pipeline.
+
+        Inputs:
+            label: A label for the group of processing runs.
+            runtimings: A list of dictionaries (one per run) of
+                seconds, keyed by stage.
+
+        Output:
+            None
+    """
+    print("%s (%d processing runs with timings)" % (label, len(runtimings)))
+    totals = [sum(seconds.values()) for seconds in runtimings]
+    for stage in timing.STAGES + ['total']:
+        if stage == 'total':
+            values = totals
+        else:
+            values = [seconds[stage] for seconds in runtimings
+                      if stage in seconds]
+        if not values:
+            continue
+        print("    %-18s p50: %9.3f s    p95: %9.3f s    (N=%d)" %
+              (stage, timing.get_percentile(values, 50),
+               timing.get_percentile(values, 95), len(values)))
+
+
+def summarize_timings(procjobs, existdb=None):
+    """Print a summary of the time spent in each stage of the
+        pipeline by the processing jobs. Overall, per manipulator
+        and per observing system.
+
+        Inputs:
+            procjobs: A list of row objects, each representing a 
+                processing job.
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+
+        Output:
+            None
+    """
+    timings = timing.get_process_timings([procjob['process_id']
+                                          for procjob in procjobs],
+                                         existdb=existdb)
+    if not timings:
+        raise errors.ToasterError("None of the matching processing jobs "
+                                  "have timings recorded! (See the "
+                                  "'record_process_timings' configuration.)")
+    bymanip = {}
+    byobssys = {}
+    for procjob in procjobs:
+        seconds = timings.get(procjob['process_id'])
+        if seconds is None:
+            continue
+        bymanip.setdefault(procjob['manipulator'], []).append(seconds)
+        byobssys.setdefault(procjob['obssystem_id'], []).append(seconds)
+    show_stage_timings("All processing jobs", list(timings.values()))
+    for manip in sorted(bymanip.keys()):
+        show_stage_timings("Manipulator '%s'" % manip, bymanip[manip])
+    for obssys_id in sorted(byobssys.keys()):
+        show_stage_timings("Observing system '%s'" %
+                           cache.get_obssysinfo(obssys_id)['name'],
+                           byobssys[obssys_id])
 
 
 def custom_show_procjobs(procjobs, fmt="%(process_id)d"):
@@ -253,6 +347,8 @@ def main(args):
         show_procjobs(procjobs)
     elif args.output_style == 'summary':
         summarize_procjobs(procjobs)
+    elif args.output_style == 'timings':
+        summarize_timings(procjobs)
     else:
         custom_show_procjobs(procjobs, fmt=args.output_style)
 
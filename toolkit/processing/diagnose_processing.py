@@ -5,13 +5,30 @@ Patrick Lazarus, Feb 8, 2013
 """
 import os.path
 import shutil
+import datetime
+import warnings
 
 from toaster.utils import notify
 from toaster.utils import datafile
+from toaster.utils import staging
+from toaster import config
 from toaster import errors
 from toaster import database
 from toaster import diagnostics
 
+# Statuses of entries of the processing diagnostics queue
+QUEUE_STATUSES = ['pending', 'running', 'done', 'failed']
+
+# When processing diagnostics are computed by the pipeline:
+#     'inline': Before the processing job is committed to the DB.
+#     'after-commit': Queued, and computed after the job is committed.
+#     'deferred': Queued, and left for 'processing.py diagnose'.
+DIAGNOSTICS_MODES = ['inline', 'after-commit', 'deferred']
+
+# Sub-directory of a processing job's diagnostics directory
+# where the archive is kept until its diagnostics are computed
+PENDING_SUBDIR = 'pending'
+
 
 def check_processing_diagnostic_existence(proc_id, diagname, existdb=None):
     """Check if processing run has a diagnostic (float-valued, or a plot) 
@@ -138,6 +155,316 @@ def insert_processing_diagnostics(proc_id, diags, archivedir=None,
             db.close()
         
 
+def get_diagnostics_mode():
+    """Return the configured processing diagnostics mode
+        (see DIAGNOSTICS_MODES).
+
+        Inputs:
+            None
+
+        Output:
+            mode: The processing diagnostics mode.
+    """
+    mode = config.cfg.processing_diagnostics_mode
+    if mode not in DIAGNOSTICS_MODES:
+        raise errors.UnrecognizedValueError("The processing diagnostics "
+                                            "mode '%s' is not recognized. "
+                                            "Valid modes are: '%s'" %
+                                            (mode,
+                                             "', '".join(DIAGNOSTICS_MODES)))
+    return mode
+
+
+def compute_processing_diagnostics(proc_id, fn, diagnames, archivedir=None,
+                                   suffix="", params=None, existdb=None,
+                                   workdir=None):
+    """Compute processing diagnostics for an archive, and insert
+        them into the DB. Diagnostics that aren't applicable
+        to the archive are skipped.
+
+        Inputs:
+            proc_id: The ID number of the processing job for which
+                the diagnostics describe.
+            fn: The (manipulated) archive to compute diagnostics for.
+            diagnames: A list of names of registered diagnostics.
+            archivedir: The location where diagnostic plots should be
+                archived. (Default: put diagnostic plots in same directory
+                as the input file.)
+            suffix: Add a suffix just before the extension of diagnostic
+                plots' filenames. (Default: Do not insert a suffix)
+            params: The archive's parsed header (as returned by
+                'datafile.prep_file'), if the caller already has it.
+                (Default: parse the header if it is needed)
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+            workdir: The directory to restore cached diagnostic
+                plots into (e.g. the job's scratch space).
+                (Default: see 'diagnostics.get_diagnostic_workdir')
+
+        Output:
+            diags: The list of computed diagnostics.
+    """
+    diags = diagnostics.run_diagnostics(fn, diagnames, params=params,
+                                        workdir=workdir)
+    if diags:
+        # Load processing diagnostics
+        insert_processing_diagnostics(proc_id, diags, archivedir,
+                                      suffix, existdb=existdb)
+    return diags
+
+
+def queue_processing_diagnostics(proc_id, fn, diagnames, archivedir,
+                                 suffix="", existdb=None):
+    """Queue processing diagnostics to be computed later (see
+        'run_queued_diagnostics'). The archive is staged into
+        a 'pending' sub-directory of 'archivedir' until then.
+
+        If 'existdb' has an open transaction, the staged archive is
+        removed if the transaction is rolled back.
+
+        Inputs:
+            proc_id: The ID number of the processing job for which
+                the diagnostics describe.
+            fn: The (manipulated) archive to compute diagnostics for.
+            diagnames: A list of names of registered diagnostics.
+            archivedir: The location where diagnostic plots should be
+                archived.
+            suffix: Add a suffix just before the extension of diagnostic
+                plots' filenames. (Default: Do not insert a suffix)
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+
+        Output:
+            queue_id: The ID number of the queue entry.
+    """
+    for diagname in diagnames:
+        # Check diagnostic names now, rather than when they are computed
+        diagnostics.get_diagnostic_class(diagname)
+
+    db = existdb or database.Database()
+    db.connect()
+
+    pendingdir = os.path.join(archivedir, PENDING_SUBDIR)
+    if not os.path.isdir(pendingdir):
+        os.makedirs(pendingdir, 0o770)
+    pendingfn = os.path.join(pendingdir, os.path.basename(fn))
+    staging.stage_file(fn, pendingfn)
+    try:
+        ins = db.proc_diagnostics_queue.insert()
+        values = {'process_id': proc_id,
+                  'diagnostics': ",".join(diagnames),
+                  'filename': os.path.basename(pendingfn),
+                  'filepath': pendingdir,
+                  'suffix': suffix,
+                  'status': 'pending'}
+        result = db.execute(ins, values)
+        queue_id = result.inserted_primary_key[0]
+        result.close()
+        # Don't leave the archive behind if the entry isn't committed
+        db.on_rollback(remove_pending_archive, pendingfn)
+    except:
+        remove_pending_archive(pendingfn)
+        raise
+    finally:
+        if not existdb:
+            db.close()
+    notify.print_info("Queued processing diagnostics (%s) for processing "
+                      "job (ID: %d)" % (", ".join(diagnames), proc_id), 2)
+    return queue_id
+
+
+def remove_pending_archive(pendingfn):
+    """Remove an archive staged for queued diagnostics, if it exists.
+
+        Input:
+            pendingfn: The staged archive.
+
+        Outputs:
+            None
+    """
+    if os.path.isfile(pendingfn):
+        os.remove(pendingfn)
+
+
+def get_queued_diagnostics(proc_ids=None, statuses=['pending'],
+                           existdb=None):
+    """Return entries of the processing diagnostics queue.
+
+        Inputs:
+            proc_ids: A list of processing job IDs to get the
+                entries of. (Default: all processing jobs)
+            statuses: A list of statuses of the entries to get.
+                (Default: only get pending entries)
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+
+        Output:
+            rows: A list of queue entries, oldest first.
+    """
+    db = existdb or database.Database()
+    db.connect()
+
+    whereclause = db.proc_diagnostics_queue.c.status.in_(statuses)
+    if proc_ids:
+        whereclause &= db.proc_diagnostics_queue.c.process_id.in_(proc_ids)
+    select = db.select([db.proc_diagnostics_queue]).\
+                where(whereclause).\
+                order_by(db.proc_diagnostics_queue.c.proc_diagnostics_queue_id)
+    result = db.execute(select)
+    rows = result.fetchall()
+    result.close()
+    if not existdb:
+        db.close()
+    return rows
+
+
+def set_queued_diagnostics_status(queue_id, status, oldstatus=None,
+                                  message=None, existdb=None):
+    """Set the status of an entry of the processing diagnostics queue.
+
+        Inputs:
+            queue_id: The ID number of the queue entry.
+            status: The new status.
+            oldstatus: Only change the status if it is currently
+                'oldstatus'. (Default: change the status regardless)
+            message: A message to record (e.g. why the diagnostics
+                failed). (Default: no message)
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+
+        Output:
+            changed: True if the entry's status was changed.
+    """
+    if status not in QUEUE_STATUSES:
+        raise errors.UnrecognizedValueError("The processing diagnostics "
+                                            "queue status '%s' is not "
+                                            "recognized. Valid statuses "
+                                            "are: '%s'" %
+                                            (status,
+                                             "', '".join(QUEUE_STATUSES)))
+    db = existdb or database.Database()
+    db.connect()
+
+    whereclause = (db.proc_diagnostics_queue.c.proc_diagnostics_queue_id ==
+                   queue_id)
+    if oldstatus is not None:
+        whereclause &= (db.proc_diagnostics_queue.c.status == oldstatus)
+    values = {'status': status,
+              'message': message}
+    # Use the DB's clock, so claims made on different hosts
+    # can be compared (see 'reclaim_expired_diagnostics')
+    if status == 'running':
+        values['start_time'] = database.sa.func.now()
+    elif status in ('done', 'failed'):
+        values['finish_time'] = database.sa.func.now()
+    update = db.proc_diagnostics_queue.update().where(whereclause)
+    result = db.execute(update, values)
+    changed = (result.rowcount == 1)
+    result.close()
+    if not existdb:
+        db.close()
+    return changed
+
+
+def reclaim_expired_diagnostics(existdb=None):
+    """Return entries of the processing diagnostics queue that were
+        claimed more than 'proc_diagnostics_lease' seconds ago, but
+        not finished (e.g. because their worker died), to the queue.
+
+        Input:
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+
+        Output:
+            nreclaimed: The number of entries returned to the queue.
+    """
+    db = existdb or database.Database()
+    db.connect()
+
+    lease = datetime.timedelta(seconds=config.cfg.proc_diagnostics_lease)
+    expired = db.get_current_time() - lease
+    update = db.proc_diagnostics_queue.update().\
+                where((db.proc_diagnostics_queue.c.status == 'running') &
+                      (db.proc_diagnostics_queue.c.start_time < expired))
+    result = db.execute(update, {'status': 'pending',
+                                 'start_time': None,
+                                 'message': "Claim expired. Worker may "
+                                            "have died."})
+    nreclaimed = result.rowcount
+    result.close()
+    if not existdb:
+        db.close()
+    if nreclaimed:
+        notify.print_info("Returned %d expired processing diagnostics "
+                          "queue entries to the queue" % nreclaimed, 2)
+    return nreclaimed
+
+
+def run_queued_diagnostics(proc_ids=None, max_jobs=None, existdb=None):
+    """Compute pending processing diagnostics from the queue.
+        Entries are claimed before they are run, so several
+        workers can share the queue. Entries whose claim has
+        expired are claimed again (see 'reclaim_expired_diagnostics').
+
+        Inputs:
+            proc_ids: A list of processing job IDs to compute
+                diagnostics for. (Default: all processing jobs)
+            max_jobs: The maximum number of processing jobs to compute
+                diagnostics for. (Default: no limit)
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+
+        Outputs:
+            ndone: The number of processing jobs whose diagnostics
+                were computed.
+            nfailed: The number of processing jobs whose diagnostics
+                failed.
+    """
+    db = existdb or database.Database()
+    db.connect()
+
+    ndone = 0
+    nfailed = 0
+    try:
+        reclaim_expired_diagnostics(existdb=db)
+        for row in get_queued_diagnostics(proc_ids, existdb=db):
+            if (max_jobs is not None) and (ndone+nfailed >= max_jobs):
+                break
+            queue_id = row['proc_diagnostics_queue_id']
+            # Claim the entry, unless another worker already has
+            if not set_queued_diagnostics_status(queue_id, 'running',
+                                                 oldstatus='pending',
+                                                 existdb=db):
+                continue
+            notify.print_info("Computing processing diagnostics for "
+                              "processing job (ID: %d)" %
+                              row['process_id'], 1)
+            pendingfn = os.path.join(row['filepath'], row['filename'])
+            try:
+                compute_processing_diagnostics(row['process_id'], pendingfn,
+                                               row['diagnostics'].split(','),
+                                               os.path.dirname(row['filepath']),
+                                               row['suffix'], existdb=db)
+            except Exception as e:
+                # Keep the archive so the diagnostics can be retried
+                set_queued_diagnostics_status(queue_id, 'failed',
+                                              message=str(e), existdb=db)
+                warnings.warn("Computing processing diagnostics for "
+                              "processing job (ID: %d) failed: %s" %
+                              (row['process_id'], str(e)),
+                              errors.ToasterWarning)
+                nfailed += 1
+            else:
+                set_queued_diagnostics_status(queue_id, 'done', existdb=db)
+                if os.path.isfile(pendingfn):
+                    os.remove(pendingfn)
+                ndone += 1
+    finally:
+        if not existdb:
+            db.close()
+    return ndone, nfailed
+
+
 def __insert_processing_float_diagnostic(proc_id, diag, existdb=None):
     """Insert processing float diagnostic.
 
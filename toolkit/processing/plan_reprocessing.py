@@ -0,0 +1,407 @@
+#!/usr/bin/env python
+"""
+Plan the reprocessing needed after master parfiles or templates
+change.
+
+A raw file's processing is stale if its latest run with a given
+manipulator (and manipulator arguments) used a parfile, or template,
+that is no longer the master for its pulsar (and observing system).
+Only those runs are redone, with the same manipulator and arguments,
+and the current masters. Runs made without a parfile (i.e. 'toastit.py --no-parfile')
+are only stale if their template has changed.
+
+The cost of the plan is estimated from the sizes of the raw files,
+and how long processing runs with the same manipulator have taken
+per byte of data (from their stage timings, see 'utils/timing.py',
+or the jobs run from the queue, see 'processing_jobs.py').
+"""
+from toaster import utils
+from toaster import database
+from toaster.utils import cache
+from toaster.utils import notify
+from toaster.toolkit.processing import processing_jobs
+
+SHORTNAME = 'replan'
+DESCRIPTION = "Find raw files whose latest processing run used a " \
+              "parfile or template that is no longer the master, and " \
+              "queue them for reprocessing."
+
+# Statuses of queued jobs that haven't finished
+PENDING_STATUSES = ['queued'] + processing_jobs.CLAIMED_STATUSES
+
+# The maximum number of finished jobs, per manipulator, used to
+# estimate how long processing takes
+NUM_RATE_SAMPLES = 1000
+
+
+def add_arguments(parser):
+    parser.add_argument('-p', '--psr', dest='pulsar_names',
+                        type=str, default=[], action='append',
+                        help="A pulsar to plan reprocessing for. Multiple "
+                             "instances of these criteria may be "
+                             "provided. (Default: all pulsars)")
+    parser.add_argument('-m', '--manipulator', dest='manipulators',
+                        type=str, default=[], action='append',
+                        help="Only consider processing runs that used "
+                             "this manipulator. Multiple instances of "
+                             "these criteria may be provided. (Default: "
+                             "all manipulators)")
+    parser.add_argument('--enqueue', dest='enqueue', action='store_true',
+                        default=False,
+                        help="Add the planned jobs to the DB queue, to be "
+                             "run by 'toaster_worker.py'. (Default: only "
+                             "show the plan)")
+    parser.add_argument('--priority', dest='priority', type=int,
+                        default=0,
+                        help="The priority of the queued jobs. "
+                             "(Default: 0)")
+
+
+def get_stale_processing(pulsar_ids=None, manipulators=None, existdb=None):
+    """Return the latest processing run of each raw file, with
+        each manipulator (and set of manipulator arguments), that
+        used a non-master parfile, or template.
+
+        Raw files that have been replaced (see 'replace_rawfile.py')
+        are ignored.
+
+        Inputs:
+            pulsar_ids: A list of IDs of pulsars to consider.
+                (Default: all pulsars)
+            manipulators: A list of names of manipulators. Only runs
+                using these are considered. (Default: all manipulators)
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+
+        Output:
+            rows: A list of stale processing runs. Each includes the
+                IDs of the master parfile ('master_parfile_id') and
+                template ('master_template_id'), and the raw file's
+                size.
+    """
+    db = existdb or database.Database()
+    db.connect()
+
+    # The latest processing run of each raw file, with each
+    # manipulator (and set of manipulator arguments) it was run with
+    latest = db.select([db.process.c.rawfile_id,
+                        database.sa.func.max(db.process.c.process_id).\
+                                label('process_id')]).\
+                group_by(db.process.c.rawfile_id,
+                         db.process.c.manipulator,
+                         db.process.c.manipulator_args)
+    if manipulators:
+        latest = latest.where(db.process.c.manipulator.in_(manipulators))
+    latest = latest.alias('latest')
+
+    stale_par = (db.process.c.parfile_id != None) & \
+                (db.master_parfiles.c.parfile_id != None) & \
+                (db.master_parfiles.c.parfile_id != db.process.c.parfile_id)
+    stale_temp = (db.master_templates.c.template_id != None) & \
+                 (db.master_templates.c.template_id !=
+                  db.process.c.template_id)
+    whereclause = (db.replacement_rawfiles.c.replacement_rawfile_id == None) & \
+                  (stale_par | stale_temp)
+    if pulsar_ids:
+        whereclause &= db.rawfiles.c.pulsar_id.in_(pulsar_ids)
+    select = db.select([db.process.c.process_id,
+                        db.process.c.rawfile_id,
+                        db.process.c.parfile_id,
+                        db.process.c.template_id,
+                        db.process.c.manipulator,
+                        db.process.c.manipulator_args,
+                        db.rawfiles.c.pulsar_id,
+                        db.rawfiles.c.obssystem_id,
+                        db.rawfiles.c.filesize,
+                        db.master_parfiles.c.parfile_id.\
+                                label('master_parfile_id'),
+                        db.master_templates.c.template_id.\
+                                label('master_template_id')],
+                from_obj=[db.process.\
+                    join(latest,
+                        onclause=latest.c.process_id ==
+                                db.process.c.process_id).\
+                    join(db.rawfiles,
+                        onclause=db.rawfiles.c.rawfile_id ==
+                                db.process.c.rawfile_id).\
+                    outerjoin(db.replacement_rawfiles,
+                        onclause=db.rawfiles.c.rawfile_id ==
+                                db.replacement_rawfiles.c.obsolete_rawfile_id).\
+                    outerjoin(db.master_parfiles,
+                        onclause=db.master_parfiles.c.pulsar_id ==
+                                db.rawfiles.c.pulsar_id).\
+                    outerjoin(db.master_templates,
+                        onclause=(db.master_templates.c.pulsar_id ==
+                                    db.rawfiles.c.pulsar_id) &
+                                 (db.master_templates.c.obssystem_id ==
+                                    db.rawfiles.c.obssystem_id))]).\
+                where(whereclause).\
+                order_by(db.process.c.rawfile_id)
+    result = db.execute(select)
+    rows = result.fetchall()
+    result.close()
+    if not existdb:
+        db.close()
+    return rows
+
+
+def get_planned_job(row):
+    """Return the processing job that brings a stale processing
+        run up to date.
+
+        Input:
+            row: The stale processing run (see 'get_stale_processing').
+
+        Output:
+            job: A dictionary of arguments for 'toastit.pipeline_core'.
+    """
+    parfile_id = row['parfile_id']
+    if (parfile_id is not None) and (row['master_parfile_id'] is not None):
+        parfile_id = row['master_parfile_id']
+    template_id = row['template_id']
+    if row['master_template_id'] is not None:
+        template_id = row['master_template_id']
+    return {'manip': processing_jobs.get_job_manipulator(row),
+            'rawfile_id': row['rawfile_id'],
+            'parfile_id': parfile_id,
+            'template_id': template_id,
+            'force': False}
+
+
+def get_pending_jobs(existdb=None):
+    """Return the jobs in the queue that haven't finished.
+
+        Input:
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+
+        Output:
+            pending: A set of (rawfile ID, parfile ID, template ID,
+                manipulator, manipulator arguments) tuples.
+    """
+    rows = processing_jobs.get_processing_jobs(statuses=PENDING_STATUSES,
+                                               existdb=existdb)
+    return set([(row['rawfile_id'], row['parfile_id'], row['template_id'],
+                 row['manipulator'], row['manipulator_args'])
+                for row in rows])
+
+
+def get_processing_rates(existdb=None):
+    """Return how long processing takes, per byte of raw data,
+        for each manipulator. Rates are estimated from the stage
+        timings of recent processing runs (see 'utils/timing.py'),
+        or, for manipulators with no timings, from jobs run from
+        the queue.
+
+        Input:
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+
+        Output:
+            rates: A dictionary of seconds per byte, keyed by
+                manipulator name. Manipulators with no past
+                timings are not included.
+    """
+    db = existdb or database.Database()
+    db.connect()
+
+    # The total time of each processing run with stage timings
+    select = db.select([db.process.c.manipulator,
+                        db.rawfiles.c.filesize,
+                        database.sa.func.sum(db.process_timings.c.seconds).\
+                                label('seconds')],
+                from_obj=[db.process_timings.\
+                    join(db.process,
+                        onclause=db.process.c.process_id ==
+                                db.process_timings.c.process_id).\
+                    join(db.rawfiles,
+                        onclause=db.rawfiles.c.rawfile_id ==
+                                db.process.c.rawfile_id)]).\
+                group_by(db.process.c.process_id,
+                         db.process.c.manipulator,
+                         db.rawfiles.c.filesize).\
+                order_by(db.process.c.process_id.desc())
+    result = db.execute(select)
+    runs = [(row['manipulator'], row['filesize'], row['seconds'])
+            for row in result.fetchall()]
+    result.close()
+
+    # Jobs run from the queue
+    select = db.select([db.processing_jobs.c.manipulator,
+                        db.processing_jobs.c.start_time,
+                        db.processing_jobs.c.finish_time,
+                        db.rawfiles.c.filesize],
+                from_obj=[db.processing_jobs.\
+                    join(db.rawfiles,
+                        onclause=db.rawfiles.c.rawfile_id ==
+                                db.processing_jobs.c.rawfile_id)]).\
+                where((db.processing_jobs.c.status == 'done') &
+                      (db.processing_jobs.c.start_time != None) &
+                      (db.processing_jobs.c.finish_time != None)).\
+                order_by(db.processing_jobs.c.finish_time.desc())
+    result = db.execute(select)
+    rows = result.fetchall()
+    result.close()
+    if not existdb:
+        db.close()
+    timed = set([manip for manip, filesize, seconds in runs])
+    for row in rows:
+        if row['manipulator'] in timed:
+            continue
+        duration = row['finish_time'] - row['start_time']
+        runs.append((row['manipulator'], row['filesize'],
+                     duration.days*86400 + duration.seconds +
+                     duration.microseconds*1e-6))
+
+    totals = {}
+    for manip, filesize, seconds in runs:
+        totseconds, nbytes, nsamples = totals.get(manip, (0, 0, 0))
+        if nsamples >= NUM_RATE_SAMPLES:
+            continue
+        totals[manip] = (totseconds+seconds, nbytes+filesize, nsamples+1)
+    rates = {}
+    for manip, (seconds, nbytes, nsamples) in totals.items():
+        if nbytes:
+            rates[manip] = seconds/float(nbytes)
+    return rates
+
+
+def plan_reprocessing(pulsar_ids=None, manipulators=None, existdb=None):
+    """Plan the processing jobs needed to bring all processing
+        up to date with the master parfiles and templates.
+
+        Stale processing runs that already have a matching job in
+        the queue are left out.
+
+        Inputs:
+            pulsar_ids: A list of IDs of pulsars to consider.
+                (Default: all pulsars)
+            manipulators: A list of names of manipulators to consider.
+                (Default: all manipulators)
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+
+        Output:
+            plan: A list of (stale processing run, job, estimated
+                cost in seconds) tuples. The estimated cost is None
+                if there are no past timings for the job's manipulator.
+    """
+    db = existdb or database.Database()
+    db.connect()
+
+    try:
+        rows = get_stale_processing(pulsar_ids, manipulators, existdb=db)
+        pending = get_pending_jobs(existdb=db)
+        rates = get_processing_rates(existdb=db)
+    finally:
+        if not existdb:
+            db.close()
+    plan = []
+    numpending = 0
+    for row in rows:
+        job = get_planned_job(row)
+        if (job['rawfile_id'], job['parfile_id'], job['template_id'],
+                job['manip'].name, job['manip'].argstr) in pending:
+            numpending += 1
+            continue
+        rate = rates.get(row['manipulator'])
+        if rate is None:
+            cost = None
+        else:
+            cost = rate*row['filesize']
+        plan.append((row, job, cost))
+    if numpending:
+        notify.print_info("%d stale processing runs are already queued for "
+                          "reprocessing" % numpending, 1)
+    return plan
+
+
+def show_plan(plan):
+    if not plan:
+        print("All processing is up to date with the master parfiles "
+              "and templates.")
+        return
+    pulsars = {}
+    manips = {}
+    nstale_par = 0
+    nstale_temp = 0
+    totsize = 0
+    rawfile_ids = set()
+    for row, job, cost in plan:
+        notify.print_info("Raw file (ID: %d): latest process ID: %d; "
+                          "parfile ID: %s -> %s; template ID: %d -> %d; "
+                          "manipulator: %s %s" %
+                          (row['rawfile_id'], row['process_id'],
+                           row['parfile_id'], job['parfile_id'],
+                           row['template_id'], job['template_id'],
+                           row['manipulator'], row['manipulator_args']), 2)
+        psrname = cache.get_pulsarname(row['pulsar_id'])
+        pulsars[psrname] = pulsars.get(psrname, 0) + 1
+        nfiles, nbytes, seconds, nunknown = manips.get(row['manipulator'],
+                                                       (0, 0, 0, 0))
+        if cost is None:
+            nunknown += 1
+        else:
+            seconds += cost
+        manips[row['manipulator']] = (nfiles+1, nbytes+row['filesize'],
+                                      seconds, nunknown)
+        if job['parfile_id'] != row['parfile_id']:
+            nstale_par += 1
+        if job['template_id'] != row['template_id']:
+            nstale_temp += 1
+        if row['rawfile_id'] not in rawfile_ids:
+            rawfile_ids.add(row['rawfile_id'])
+            totsize += row['filesize']
+    print("Number of processing jobs to run: %d" % len(plan))
+    print("Number of raw files to reprocess: %d" % len(rawfile_ids))
+    print("    With a non-master parfile: %d" % nstale_par)
+    print("    With a non-master template: %d" % nstale_temp)
+    print("Total size of raw files: %.1f GB" % (totsize/1e9))
+    print("Number of pulsars: %d" % len(pulsars))
+    for psrname in sorted(pulsars.keys()):
+        print("    %s: %d raw files" % (psrname, pulsars[psrname]))
+    totseconds = 0
+    totunknown = 0
+    for manip in sorted(manips.keys()):
+        nfiles, nbytes, seconds, nunknown = manips[manip]
+        totseconds += seconds
+        totunknown += nunknown
+        msg = "    '%s': %d raw files (%.1f GB), estimated %.1f " \
+              "wall-clock hours" % (manip, nfiles, nbytes/1e9,
+                                    seconds/3600.0)
+        if nunknown:
+            msg += " (%d raw files with no past timings)" % nunknown
+        print(msg)
+    msg = "Estimated processing time: %.1f wall-clock hours (summed " \
+          "over jobs)" % (totseconds/3600.0)
+    if totunknown:
+        msg += " (not including %d raw files)" % totunknown
+    print(msg)
+
+
+def main(args):
+    pulsar_ids = [cache.get_pulsarid(name) for name in args.pulsar_names]
+    db = database.Database()
+    db.connect()
+
+    try:
+        plan = plan_reprocessing(pulsar_ids, args.manipulators, existdb=db)
+        show_plan(plan)
+        if plan and args.enqueue:
+            jobs = []
+            for row, job, cost in plan:
+                job['priority'] = args.priority
+                jobs.append(job)
+            job_ids = processing_jobs.add_processing_jobs(jobs, db)
+            print("Queued %d processing jobs. processing_job_ids: %s" %
+                  (len(job_ids), ", ".join(["%d" % job_id
+                                            for job_id in job_ids])))
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    parser = utils.DefaultArguments(description=DESCRIPTION)
+    add_arguments(parser)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""
+Copy the files needed by the next jobs in the processing queue
+into the local archive cache (see 'utils/archivecache.py').
+
+Jobs are taken in the order workers on this host would claim them
+(see 'processing_jobs.py'), so the files they read are already on
+local storage when they run. Prefetching stops once the cache would
+be full, so files needed soon aren't evicted by ones needed later.
+"""
+import os.path
+
+from toaster import database
+from toaster.utils import notify
+from toaster.utils import locality
+from toaster.utils import archivecache
+from toaster.toolkit.processing import processing_jobs
+
+SHORTNAME = 'prefetch'
+DESCRIPTION = "Copy the raw files, parfiles and templates of the next " \
+              "queued processing jobs into the local archive cache."
+
+
+def add_arguments(parser):
+    parser.add_argument('-n', '--num-jobs', dest='num_jobs',
+                        type=int, default=100,
+                        help="The number of queued jobs to prefetch "
+                             "files for. (Default: 100)")
+    parser.add_argument('--max-size', dest='max_size',
+                        type=int, default=None,
+                        help="The maximum total size of the files to "
+                             "prefetch, in bytes. (Default: the archive "
+                             "cache's maximum size)")
+    parser.add_argument('--locality', dest='localities', type=str,
+                        default=[], action='append',
+                        help="A host whose data are local to the workers "
+                             "using the cache. Multiple --locality options "
+                             "may be provided. (Default: this host)")
+    parser.add_argument('--no-steal', dest='steal', action='store_false',
+                        default=True,
+                        help="Only prefetch files for jobs local to the "
+                             "workers. (Default: also prefetch files for "
+                             "jobs the workers may steal)")
+
+
+def get_file_info(table, idcol, ids, existdb=None):
+    """Return the path and MD5 sum of files in the archive.
+
+        Inputs:
+            table: The DB table of the files (e.g. 'rawfiles').
+            idcol: The name of the table's ID column.
+            ids: A list of ID numbers of the files.
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+
+        Output:
+            info: A dictionary of (full path, MD5 sum) tuples,
+                keyed by ID number.
+    """
+    info = {}
+    if not ids:
+        return info
+    db = existdb or database.Database()
+    db.connect()
+
+    tbl = db[table]
+    select = db.select([tbl.c[idcol],
+                        tbl.c.filepath,
+                        tbl.c.filename,
+                        tbl.c.md5sum]).\
+                where(tbl.c[idcol].in_(list(ids)))
+    result = db.execute(select)
+    for row in result.fetchall():
+        info[row[idcol]] = (os.path.join(row['filepath'], row['filename']),
+                            row['md5sum'])
+    result.close()
+    if not existdb:
+        db.close()
+    return info
+
+
+def get_prefetch_files(jobs, existdb=None):
+    """Return the files read by processing jobs.
+
+        Inputs:
+            jobs: A list of queued processing jobs.
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+
+        Output:
+            files: A list of (full path, MD5 sum) tuples, in the order
+                the jobs will read them.
+    """
+    db = existdb or database.Database()
+    db.connect()
+
+    rawfiles = get_file_info('rawfiles', 'rawfile_id',
+                             set([job['rawfile_id'] for job in jobs]),
+                             existdb=db)
+    parfiles = get_file_info('parfiles', 'parfile_id',
+                             set([job['parfile_id'] for job in jobs
+                                  if job['parfile_id'] is not None]),
+                             existdb=db)
+    templates = get_file_info('templates', 'template_id',
+                              set([job['template_id'] for job in jobs
+                                   if job['template_id'] is not None]),
+                              existdb=db)
+    if not existdb:
+        db.close()
+
+    files = []
+    for job in jobs:
+        for info, fileid in [(rawfiles, job['rawfile_id']),
+                             (parfiles, job['parfile_id']),
+                             (templates, job['template_id'])]:
+            if fileid in info:
+                files.append(info[fileid])
+    return files
+
+
+def main(args):
+    if args.localities:
+        localities = [locality.normalise_host(local_to)
+                      for local_to in args.localities]
+    else:
+        localities = [locality.get_host_locality()]
+    db = database.Database()
+    db.connect()
+    try:
+        jobs = processing_jobs.get_claimable_jobs(localities, args.steal,
+                                                  existdb=db,
+                                                  limit=args.num_jobs)
+        files = get_prefetch_files(jobs, existdb=db)
+    finally:
+        db.close()
+    notify.print_info("Prefetching %d files for %d queued processing jobs" %
+                      (len(files), len(jobs)), 1)
+    nfetched, ncached = archivecache.prefetch_files(files, args.max_size)
+    notify.print_success("Copied %d files into the archive cache (%d were "
+                         "already cached)" % (nfetched, ncached))
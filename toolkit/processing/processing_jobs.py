@@ -0,0 +1,722 @@
+#!/usr/bin/env python
+"""
+The queue of processing jobs run by 'toaster_worker.py'.
+
+Jobs are added with 'toastit.py --enqueue'. Workers claim a job
+by changing its status with a single conditional UPDATE, so a job
+is only ever claimed by one worker, whatever the DB backend. A claim
+is a lease that the worker renews while the job runs. Jobs whose
+lease expires (e.g. because their worker crashed) can be claimed
+again, until they have been attempted 'max_attempts' times. Lease
+times come from the DB server's clock, so workers on different hosts
+agree on when a lease expires.
+
+Each job records the host its raw file is local to (see
+'utils/locality.py'). Workers claim jobs local to them first. A
+worker with no local jobs steals jobs that have been waiting for
+longer than 'processing_job_steal_after' seconds.
+
+Among the candidate jobs, those with the highest priority are
+claimed first. Jobs with equal priority are shared between users
+(or pulsars, see 'processing_job_fair_share'): the next job is taken
+from whoever has the fewest jobs running, so one large campaign
+doesn't hold up everyone else's jobs. Manipulators can also be
+limited to a number of concurrently running jobs (see
+'processing_job_manipulator_caps').
+"""
+import os
+import shlex
+import socket
+import datetime
+import threading
+
+from toaster import config
+from toaster import utils
+from toaster import errors
+from toaster import database
+from toaster import manipulators
+from toaster import colour
+from toaster.utils import notify
+from toaster.utils import cache
+from toaster.utils import locality
+import toaster.toolkit.rawfiles.general as rawfiles_general
+
+SHORTNAME = 'jobs'
+DESCRIPTION = "Show, and manage, the queue of processing jobs run " \
+              "by 'toaster_worker.py'."
+
+JOB_STATUSES = ['queued', 'claimed', 'running', 'done', 'failed']
+
+# Statuses of jobs that have been claimed by a worker
+CLAIMED_STATUSES = ['claimed', 'running']
+
+# The number of jobs to consider each time a worker claims one
+NUM_CLAIM_CANDIDATES = 20
+
+# The column that jobs are shared fairly by, for each allowed
+# value of 'processing_job_fair_share'
+FAIR_SHARE_COLUMNS = {'user': 'user_id',
+                      'pulsar': 'pulsar_id'}
+
+
+def add_arguments(parser):
+    parser.add_argument('-J', '--job-id', dest='job_ids',
+                        type=int, default=[], action='append',
+                        help="A processing job ID to show. Multiple "
+                             "instances of these criteria may be "
+                             "provided. (Default: all jobs)")
+    parser.add_argument('-s', '--status', dest='statuses',
+                        type=str, default=[], action='append',
+                        choices=JOB_STATUSES,
+                        help="Only show jobs with this status. Multiple "
+                             "instances of these criteria may be "
+                             "provided. (Default: all statuses)")
+    parser.add_argument('--retry-failed', dest='retry_failed',
+                        action='store_true', default=False,
+                        help="Queue jobs that failed again before "
+                             "showing the queue.")
+    parser.add_argument('--set-priority', dest='priority',
+                        type=int, default=None,
+                        help="Change the priority of the queued jobs "
+                             "given with -J/--job-id before showing the "
+                             "queue. Jobs with higher priority are run "
+                             "first.")
+
+
+def get_worker_name():
+    """Return the name identifying this worker process.
+
+        Inputs:
+            None
+
+        Output:
+            worker: The worker's name ('host:pid').
+    """
+    return "%s:%d" % (socket.gethostname(), os.getpid())
+
+
+def add_processing_jobs(jobs, existdb=None):
+    """Add processing jobs to the queue.
+
+        Inputs:
+            jobs: A list of processing jobs. Each is a dictionary
+                of arguments for 'toastit.pipeline_core' (see
+                'toastit.get_processing_job'), and optionally the
+                job's 'priority' (Default: 0).
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+
+        Output:
+            job_ids: A list of the ID numbers of the queued jobs.
+    """
+    db = existdb or database.Database()
+    db.connect()
+
+    user_id = cache.get_userid()
+    job_ids = []
+    db.begin()
+    try:
+        for job in jobs:
+            rawfile_info = rawfiles_general.get_rawfile_info(job['rawfile_id'],
+                                                             existdb=db)
+            local_to = locality.get_path_locality(rawfile_info['filepath'])
+            ins = db.processing_jobs.insert()
+            values = {'rawfile_id': job['rawfile_id'],
+                      'parfile_id': job['parfile_id'],
+                      'template_id': job['template_id'],
+                      'manipulator': job['manip'].name,
+                      'manipulator_args': job['manip'].argstr,
+                      'force': bool(job.get('force', False)),
+                      'priority': job.get('priority', 0),
+                      'pulsar_id': rawfile_info['pulsar_id'],
+                      'locality': local_to,
+                      'status': 'queued',
+                      'attempts': 0,
+                      'max_attempts': config.cfg.processing_job_max_attempts,
+                      'user_id': user_id}
+            result = db.execute(ins, values)
+            job_ids.append(result.inserted_primary_key[0])
+            result.close()
+    except:
+        db.rollback()
+        raise
+    else:
+        db.commit()
+    finally:
+        if not existdb:
+            db.close()
+    notify.print_info("Queued %d processing jobs" % len(job_ids), 1)
+    return job_ids
+
+
+def get_processing_jobs(job_ids=None, statuses=None, existdb=None):
+    """Return entries of the processing job queue.
+
+        Inputs:
+            job_ids: A list of IDs of jobs to get.
+                (Default: all jobs)
+            statuses: A list of statuses of the jobs to get.
+                (Default: all statuses)
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+
+        Output:
+            rows: A list of jobs, oldest first.
+    """
+    db = existdb or database.Database()
+    db.connect()
+
+    select = db.select([db.processing_jobs]).\
+                order_by(db.processing_jobs.c.processing_job_id)
+    if job_ids:
+        select = select.where(db.processing_jobs.c.processing_job_id.\
+                                    in_(job_ids))
+    if statuses:
+        select = select.where(db.processing_jobs.c.status.in_(statuses))
+    result = db.execute(select)
+    rows = result.fetchall()
+    result.close()
+    if not existdb:
+        db.close()
+    return rows
+
+
+def get_running_job_counts(colname, existdb=None):
+    """Count the jobs currently claimed by workers, grouped by
+        a column of the queue.
+
+        Inputs:
+            colname: The name of the column to group jobs by
+                (e.g. 'user_id', or 'manipulator').
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+
+        Output:
+            counts: A dictionary of the number of claimed jobs,
+                keyed by the column's value.
+    """
+    db = existdb or database.Database()
+    db.connect()
+
+    col = db.processing_jobs.c[colname]
+    select = db.select([col,
+                        database.sa.func.count(db.processing_jobs.c.\
+                                    processing_job_id).label('numjobs')]).\
+                where(db.processing_jobs.c.status.in_(CLAIMED_STATUSES) &
+                      (db.processing_jobs.c.lease_expires >=
+                       database.sa.func.now())).\
+                group_by(col)
+    result = db.execute(select)
+    counts = dict([(row[colname], row['numjobs'])
+                   for row in result.fetchall()])
+    result.close()
+    if not existdb:
+        db.close()
+    return counts
+
+
+def get_capped_manipulators(existdb=None):
+    """Return the manipulators that have as many jobs running as
+        they are allowed (see 'processing_job_manipulator_caps').
+
+        NOTE: Workers claiming jobs at the same moment may each
+            see a manipulator below its cap, so caps can be
+            exceeded by (at most) the number of such workers.
+
+        Input:
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+
+        Output:
+            capped: A list of names of manipulators whose jobs
+                shouldn't be claimed.
+    """
+    caps = config.cfg.processing_job_manipulator_caps or {}
+    if not caps:
+        return []
+    counts = get_running_job_counts('manipulator', existdb=existdb)
+    capped = [manip for manip, cap in caps.items()
+              if counts.get(manip, 0) >= cap]
+    if capped:
+        notify.print_debug("Manipulators at their concurrency cap: %s" %
+                           ", ".join(["%s (%d)" % (manip, caps[manip])
+                                      for manip in sorted(capped)]),
+                           'scheduling')
+    return capped
+
+
+def get_fair_share_jobs(whereclause, limit, existdb=None):
+    """Return jobs, highest priority first. Jobs with equal
+        priority are shared fairly (see 'processing_job_fair_share'):
+        jobs belonging to whoever has the fewest running jobs
+        come first.
+
+        Inputs:
+            whereclause: The condition the jobs must satisfy.
+            limit: The maximum number of jobs to return.
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+
+        Output:
+            rows: A list of jobs.
+    """
+    share = config.cfg.processing_job_fair_share
+    if share and (share not in FAIR_SHARE_COLUMNS):
+        raise errors.UnrecognizedValueError("The processing job fair-share "
+                                            "policy '%s' is not recognized. "
+                                            "Valid policies are: '%s' (or "
+                                            "None)" %
+                                            (share, "', '".join(
+                                                sorted(FAIR_SHARE_COLUMNS))))
+    db = existdb or database.Database()
+    db.connect()
+
+    order = [db.processing_jobs.c.priority.desc()]
+    if share:
+        colname = FAIR_SHARE_COLUMNS[share]
+        col = db.processing_jobs.c[colname]
+        running = get_running_job_counts(colname, existdb=db)
+        notify.print_debug("Running jobs per %s: %s" %
+                           (colname, ", ".join(["%s (%d)" % (key, count)
+                                    for key, count in
+                                    running.items()]) or "none"),
+                           'scheduling')
+        if running:
+            # Within each priority level, jobs of whoever has
+            # the fewest running jobs come first
+            order.append(database.sa.case([(col == key, count)
+                                           for key, count in
+                                           running.items()], else_=0))
+    order.append(db.processing_jobs.c.processing_job_id)
+    select = db.select([db.processing_jobs]).\
+                where(whereclause).\
+                order_by(*order).\
+                limit(limit)
+    result = db.execute(select)
+    rows = result.fetchall()
+    result.close()
+    if not existdb:
+        db.close()
+    return rows
+
+
+def get_claimable_jobs(localities=None, steal=True, existdb=None,
+                       limit=NUM_CLAIM_CANDIDATES):
+    """Return jobs that can be claimed: queued jobs, and claimed
+        jobs whose lease has expired. Jobs of manipulators at their
+        concurrency cap are excluded.
+
+        Inputs:
+            localities: A list of the hosts whose data are local to
+                the worker. Jobs local to these hosts (or whose
+                locality is unknown) are returned first.
+                (Default: ignore locality)
+            steal: Also return jobs that are local to other hosts,
+                once they have been queued for longer than
+                'processing_job_steal_after' seconds. (Default: True)
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+            limit: The maximum number of jobs to return.
+                (Default: NUM_CLAIM_CANDIDATES)
+
+        Output:
+            rows: A list of jobs, local jobs first, then in the order
+                they should be claimed (see 'get_fair_share_jobs').
+    """
+    db = existdb or database.Database()
+    db.connect()
+
+    now = db.get_current_time()
+    claimable = (db.processing_jobs.c.status == 'queued') | \
+                (db.processing_jobs.c.status.in_(CLAIMED_STATUSES) &
+                 (db.processing_jobs.c.lease_expires < now))
+    capped = get_capped_manipulators(existdb=db)
+    if capped:
+        claimable &= ~db.processing_jobs.c.manipulator.in_(capped)
+    if localities:
+        local = db.processing_jobs.c.locality.in_(localities) | \
+                (db.processing_jobs.c.locality == None)
+        steal_before = now - datetime.timedelta(
+                    seconds=config.cfg.processing_job_steal_after)
+        # Jobs local to the worker, then (if stealing) other jobs
+        clauses = [claimable & local]
+        if steal:
+            clauses.append(claimable & ~local &
+                           (db.processing_jobs.c.add_time <= steal_before))
+    else:
+        clauses = [claimable]
+    rows = []
+    for whereclause in clauses:
+        if len(rows) >= limit:
+            break
+        rows.extend(get_fair_share_jobs(whereclause, limit-len(rows),
+                                        existdb=db))
+    if not existdb:
+        db.close()
+    return rows
+
+
+def claim_processing_job(worker=None, localities=None, steal=True,
+                         existdb=None):
+    """Claim a job from the queue.
+
+        Jobs whose lease expired after their final attempt are
+        marked as failed, rather than claimed.
+
+        Inputs:
+            worker: The name of the worker claiming the job.
+                (Default: this process, see 'get_worker_name')
+            localities: A list of the hosts whose data are local to
+                the worker. Local jobs are claimed first.
+                (Default: ignore locality)
+            steal: Claim jobs local to other hosts if there are no
+                local jobs (see 'get_claimable_jobs'). (Default: True)
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+
+        Output:
+            row: The claimed job. None if no job could be claimed.
+    """
+    if worker is None:
+        worker = get_worker_name()
+    db = existdb or database.Database()
+    db.connect()
+
+    claimed = None
+    try:
+        for row in get_claimable_jobs(localities, steal, existdb=db):
+            job_id = row['processing_job_id']
+            # Only change the job if no other worker has since
+            # (each claim changes the number of attempts, and
+            # the worker holding the job may have renewed its lease)
+            whereclause = (db.processing_jobs.c.processing_job_id == job_id) & \
+                          (db.processing_jobs.c.status == row['status']) & \
+                          (db.processing_jobs.c.attempts == row['attempts']) & \
+                          (db.processing_jobs.c.lease_expires ==
+                           row['lease_expires'])
+            now = db.get_current_time()
+            if row['attempts'] >= row['max_attempts']:
+                # The lease of the job's final attempt expired
+                values = {'status': 'failed',
+                          'lease_expires': None,
+                          'finish_time': now,
+                          'message': "The lease of worker %s expired "
+                                     "(attempt %d of %d)" %
+                                     (row['worker'], row['attempts'],
+                                      row['max_attempts'])}
+            else:
+                lease = datetime.timedelta(
+                            seconds=config.cfg.processing_job_lease)
+                values = {'status': 'claimed',
+                          'worker': worker,
+                          'lease_expires': now + lease,
+                          'attempts': row['attempts'] + 1}
+            update = db.processing_jobs.update().where(whereclause)
+            result = db.execute(update, values)
+            changed = (result.rowcount == 1)
+            result.close()
+            if changed and (values['status'] == 'claimed'):
+                claimed = get_processing_jobs([job_id], existdb=db)[0]
+                notify.print_info("Worker %s claimed processing job (ID: "
+                                  "%d; priority %d; attempt %d of %d)" %
+                                  (worker, job_id, claimed['priority'],
+                                   claimed['attempts'],
+                                   claimed['max_attempts']), 2)
+                if localities and (claimed['locality'] is not None) and \
+                        (claimed['locality'] not in localities):
+                    notify.print_debug("Worker %s stole processing job "
+                                       "(ID: %d) local to %s" %
+                                       (worker, job_id, claimed['locality']),
+                                       'locality')
+                break
+            elif changed:
+                notify.print_info("Processing job (ID: %d) failed. %s" %
+                                  (job_id, values['message']), 1)
+    finally:
+        if not existdb:
+            db.close()
+    return claimed
+
+
+def set_processing_job_status(job_id, status, worker=None,
+                              process_id=None, message=None,
+                              existdb=None):
+    """Set the status of a job in the queue.
+
+        Inputs:
+            job_id: The ID number of the job.
+            status: The new status.
+            worker: Only change the status if the job is claimed by
+                this worker. (Default: change the status regardless)
+            process_id: The ID number of the job's processing run.
+                (Default: none)
+            message: A message to record (e.g. why the job failed).
+                (Default: no message)
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+
+        Output:
+            changed: True if the job's status was changed.
+    """
+    if status not in JOB_STATUSES:
+        raise errors.UnrecognizedValueError("The processing job status "
+                                            "'%s' is not recognized. "
+                                            "Valid statuses are: '%s'" %
+                                            (status,
+                                             "', '".join(JOB_STATUSES)))
+    db = existdb or database.Database()
+    db.connect()
+
+    whereclause = (db.processing_jobs.c.processing_job_id == job_id)
+    if worker is not None:
+        whereclause &= (db.processing_jobs.c.worker == worker) & \
+                       db.processing_jobs.c.status.in_(CLAIMED_STATUSES)
+    values = {'status': status,
+              'message': message}
+    if process_id is not None:
+        values['process_id'] = process_id
+    if status == 'running':
+        values['start_time'] = database.sa.func.now()
+    elif status in ('done', 'failed'):
+        values['finish_time'] = database.sa.func.now()
+    if status not in CLAIMED_STATUSES:
+        values['lease_expires'] = None
+    update = db.processing_jobs.update().where(whereclause)
+    result = db.execute(update, values)
+    changed = (result.rowcount == 1)
+    result.close()
+    if not existdb:
+        db.close()
+    return changed
+
+
+def renew_processing_job_lease(job_id, worker, existdb=None):
+    """Extend a worker's lease on a job.
+
+        Inputs:
+            job_id: The ID number of the job.
+            worker: The name of the worker holding the lease.
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+
+        Output:
+            renewed: True if the lease was renewed. False if the
+                worker no longer holds the job.
+    """
+    db = existdb or database.Database()
+    db.connect()
+
+    lease = datetime.timedelta(seconds=config.cfg.processing_job_lease)
+    whereclause = (db.processing_jobs.c.processing_job_id == job_id) & \
+                  (db.processing_jobs.c.worker == worker) & \
+                  db.processing_jobs.c.status.in_(CLAIMED_STATUSES)
+    update = db.processing_jobs.update().where(whereclause)
+    result = db.execute(update,
+                        {'lease_expires': db.get_current_time() + lease})
+    renewed = (result.rowcount == 1)
+    result.close()
+    if not existdb:
+        db.close()
+    return renewed
+
+
+def release_failed_processing_job(row, worker, message, existdb=None):
+    """Record that a worker's attempt at a job failed. The job is
+        queued again, unless this was its final attempt.
+
+        Inputs:
+            row: The job (as returned by 'claim_processing_job').
+            worker: The name of the worker that ran the job.
+            message: Why the job failed.
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+
+        Output:
+            status: The job's new status. None if the worker no
+                longer held the job.
+    """
+    if row['attempts'] < row['max_attempts']:
+        status = 'queued'
+    else:
+        status = 'failed'
+    if set_processing_job_status(row['processing_job_id'], status,
+                                 worker=worker, message=message,
+                                 existdb=existdb):
+        return status
+    return None
+
+
+def requeue_failed_processing_jobs(job_ids=None, existdb=None):
+    """Queue jobs that failed again, resetting their attempts.
+
+        Inputs:
+            job_ids: A list of job IDs. (Default: all failed jobs)
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+
+        Output:
+            nrequeued: The number of jobs queued again.
+    """
+    db = existdb or database.Database()
+    db.connect()
+
+    whereclause = (db.processing_jobs.c.status == 'failed')
+    if job_ids:
+        whereclause &= db.processing_jobs.c.processing_job_id.in_(job_ids)
+    update = db.processing_jobs.update().where(whereclause)
+    result = db.execute(update, {'status': 'queued',
+                                 'attempts': 0,
+                                 'worker': None,
+                                 'lease_expires': None,
+                                 'finish_time': None})
+    nrequeued = result.rowcount
+    result.close()
+    if not existdb:
+        db.close()
+    return nrequeued
+
+
+def set_processing_job_priority(job_ids, priority, existdb=None):
+    """Change the priority of queued jobs.
+
+        Inputs:
+            job_ids: A list of job IDs.
+            priority: The new priority. Jobs with higher priority
+                are claimed first.
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+
+        Output:
+            nchanged: The number of jobs changed.
+    """
+    db = existdb or database.Database()
+    db.connect()
+
+    whereclause = (db.processing_jobs.c.status == 'queued') & \
+                  db.processing_jobs.c.processing_job_id.in_(job_ids)
+    update = db.processing_jobs.update().where(whereclause)
+    result = db.execute(update, {'priority': priority})
+    nchanged = result.rowcount
+    result.close()
+    if not existdb:
+        db.close()
+    return nchanged
+
+
+def get_job_manipulator(row):
+    """Return the manipulator of a queued job, with the job's
+        arguments parsed.
+
+        Input:
+            row: The job.
+
+        Output:
+            manip: The manipulator.
+    """
+    manip = manipulators.load_manipulator(row['manipulator'])
+    manip.parse_args(shlex.split(row['manipulator_args']))
+    return manip
+
+
+class LeaseRenewer(threading.Thread):
+    """A thread that periodically renews a worker's lease on a job,
+        while the job runs.
+
+        NOTE: The thread uses its own DB connection.
+    """
+    def __init__(self, job_id, worker):
+        super(LeaseRenewer, self).__init__()
+        self.daemon = True
+        self.job_id = job_id
+        self.worker = worker
+        self.stopped = threading.Event()
+        self.lost = False
+
+    def run(self):
+        # Renew the lease well before it expires
+        interval = config.cfg.processing_job_lease/3.0
+        db = database.Database()
+        try:
+            while not self.stopped.wait(interval):
+                db.connect()
+                if not renew_processing_job_lease(self.job_id, self.worker,
+                                                  existdb=db):
+                    self.lost = True
+                    notify.print_info("Worker %s lost its lease on "
+                                      "processing job (ID: %d)" %
+                                      (self.worker, self.job_id), 1)
+                    break
+        finally:
+            db.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def show_processing_jobs(rows):
+    print("--"*25)
+    for row in rows:
+        print(colour.cstring("Processing job ID:", underline=True,
+                             bold=True) +
+              colour.cstring(" %d" % row['processing_job_id'], bold=True))
+        print("Status: %s (attempt %d of %d)" %
+              (row['status'], row['attempts'], row['max_attempts']))
+        print("Priority: %d" % row['priority'])
+        print("Raw file ID: %d" % row['rawfile_id'])
+        if row['pulsar_id'] is not None:
+            print("Pulsar: %s" % cache.get_pulsarname(row['pulsar_id']))
+        print("Parfile ID: %s" % row['parfile_id'])
+        print("Template ID: %d" % row['template_id'])
+        print("Manipulator: %s %s" % (row['manipulator'],
+                                      row['manipulator_args']))
+        print("Local to: %s" % row['locality'])
+        if row['worker'] is not None:
+            print("Worker: %s" % row['worker'])
+        if row['lease_expires'] is not None:
+            print("Lease expires: %s" % row['lease_expires'])
+        if row['process_id'] is not None:
+            print("Process ID: %d" % row['process_id'])
+        if row['message']:
+            print("Message: %s" % row['message'])
+        user_info = cache.get_userinfo(row['user_id'])
+        print("Added: %s (by %s)" % (row['add_time'], user_info['real_name']))
+        print("--"*25)
+    counts = {}
+    for row in rows:
+        counts[row['status']] = counts.get(row['status'], 0) + 1
+    print("Number of jobs: %d (%s)" %
+          (len(rows), ", ".join(["%s: %d" % (status, counts[status])
+                                 for status in JOB_STATUSES
+                                 if status in counts])))
+
+
+def main(args):
+    db = database.Database()
+    db.connect()
+
+    try:
+        if args.retry_failed:
+            nrequeued = requeue_failed_processing_jobs(args.job_ids, db)
+            notify.print_info("Re-queued %d failed processing jobs." %
+                              nrequeued, 1)
+        if args.priority is not None:
+            if not args.job_ids:
+                raise errors.BadInputError("The jobs whose priority is to "
+                                           "be changed must be given "
+                                           "(-J/--job-id).")
+            nchanged = set_processing_job_priority(args.job_ids,
+                                                   args.priority, db)
+            notify.print_info("Changed the priority of %d queued processing "
+                              "jobs to %d." % (nchanged, args.priority), 1)
+        rows = get_processing_jobs(args.job_ids, args.statuses, db)
+    finally:
+        db.close()
+    show_processing_jobs(rows)
+
+
+if __name__ == '__main__':
+    parser = utils.DefaultArguments(description=DESCRIPTION)
+    add_arguments(parser)
+    args = parser.parse_args()
+    main(args)
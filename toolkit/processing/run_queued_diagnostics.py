@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""
+Compute processing diagnostics that were queued by the pipeline.
+"""
+
+from toaster import utils
+from toaster import database
+from toaster.utils import notify
+from toaster.toolkit.processing import diagnose_processing
+
+SHORTNAME = 'diagnose'
+DESCRIPTION = "Compute the processing diagnostics queued by the " \
+              "pipeline (see the 'processing_diagnostics_mode' " \
+              "configuration)."
+
+
+def add_arguments(parser):
+    parser.add_argument('-P', '--process-id', dest='process_ids',
+                        type=int, default=[], action='append',
+                        help="A process ID to compute diagnostics for. "
+                             "Multiple instances of these criteria may "
+                             "be provided. (Default: all processing jobs "
+                             "with queued diagnostics)")
+    parser.add_argument('-n', '--max-jobs', dest='max_jobs',
+                        type=int, default=None,
+                        help="The maximum number of processing jobs to "
+                             "compute diagnostics for. (Default: no limit)")
+    parser.add_argument('--retry-failed', dest='retry_failed',
+                        action='store_true', default=False,
+                        help="Queue diagnostics that failed to be "
+                             "computed again before starting.")
+    parser.add_argument('--poll-interval', dest='poll_interval',
+                        type=float, default=None,
+                        help="Keep running, checking the queue for new "
+                             "entries every POLL_INTERVAL seconds. "
+                             "(Default: exit once the queue is empty)")
+
+
+def requeue_failed_diagnostics(proc_ids=None, existdb=None):
+    """Queue processing diagnostics that failed to be computed again.
+
+        Inputs:
+            proc_ids: A list of processing job IDs. (Default: all
+                processing jobs with failed diagnostics)
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+
+        Output:
+            nrequeued: The number of queue entries changed.
+    """
+    db = existdb or database.Database()
+    db.connect()
+
+    nrequeued = 0
+    for row in diagnose_processing.get_queued_diagnostics(proc_ids,
+                                                          statuses=['failed'],
+                                                          existdb=db):
+        if diagnose_processing.set_queued_diagnostics_status(
+                    row['proc_diagnostics_queue_id'], 'pending',
+                    oldstatus='failed', existdb=db):
+            nrequeued += 1
+    if not existdb:
+        db.close()
+    return nrequeued
+
+
+def main(args):
+    db = database.Database()
+    db.connect()
+
+    try:
+        if args.retry_failed:
+            nrequeued = requeue_failed_diagnostics(args.process_ids, db)
+            notify.print_info("Re-queued diagnostics of %d processing jobs." %
+                              nrequeued, 1)
+        ndone = 0
+        nfailed = 0
+        while True:
+            if args.max_jobs is None:
+                max_jobs = None
+            else:
+                max_jobs = args.max_jobs - ndone - nfailed
+                if max_jobs <= 0:
+                    break
+            newdone, newfailed = \
+                diagnose_processing.run_queued_diagnostics(args.process_ids,
+                                                           max_jobs, db)
+            ndone += newdone
+            nfailed += newfailed
+            if args.poll_interval is None:
+                break
+            if not (newdone or newfailed):
+                utils.sleep(args.poll_interval)
+    finally:
+        db.close()
+    notify.print_info("Computed diagnostics of %d processing jobs "
+                      "(%d failed)." % (ndone+nfailed, nfailed), 1)
+
+
+if __name__ == '__main__':
+    parser = utils.DefaultArguments(description=DESCRIPTION)
+    add_arguments(parser)
+    args = parser.parse_args()
+    main(args)
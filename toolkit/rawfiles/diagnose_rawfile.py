@@ -11,6 +11,9 @@ import sys
 import shlex
 import warnings
 import copy
+import traceback
+import types
+import shutil
 
 from toaster import utils
 from toaster import errors
@@ -70,7 +73,8 @@ class ListDiagnosticsAction(argparse.Action):
         sys.exit(1)
 
 
-def diagnose_rawfile(rawfile_id, diagnostic, value=None, existdb=None):
+def diagnose_rawfile(rawfile_id, diagnostic, value=None, existdb=None,
+                     lazy=False):
     """Diagnose a rawfile (specified by its ID number).
 
         Inputs:
@@ -85,6 +89,9 @@ def diagnose_rawfile(rawfile_id, diagnostic, value=None, existdb=None):
                         number, assume it is a numeric-diagnostic.
             existdb: An (optional) existing database connection object.
                 (Default: Establish a db connection)
+            lazy: Don't compute a pre-defined diagnostic yet (see
+                'diagnostics.compute_diagnostics'). (Default: compute
+                the diagnostic now)
         
         Outputs:
             diag: The Diagnostic object.
@@ -100,7 +107,7 @@ def diagnose_rawfile(rawfile_id, diagnostic, value=None, existdb=None):
         # the rawfile provided
         check_rawfile_diagnostic_existence(rawfile_id, diagcls.name, \
                                             existdb=db)
-        diag = diagcls(fn)
+        diag = diagcls(fn, lazy=lazy)
     elif type(value) == types.FloatType:
         # Numeric diagnostic
         notify.print_info("Custom floating-point rawfile diagnostic provided", 2)
@@ -221,7 +228,7 @@ def insert_rawfile_diagnostics(rawfile_id, diags, existdb=None):
                     trans.rollback()
                     raise ValueError("Diagnostic is not a valid type (%s)!" % \
                                         type(diag))
-            except (errors.DiagnosticAlreadyExists, e):
+            except errors.DiagnosticAlreadyExists as e:
                 notify.print_info("Diagnostic already exists: %s. Skipping..." % \
                                 str(e), 2)
                 trans.rollback()
@@ -347,6 +354,7 @@ def main(args):
                 rawlist = open(args.from_file, 'r')
             numfails = 0
             numdiagnosed = 0
+            todo = []
             for line in rawlist:
                 # Strip comments
                 line = line.partition('#')[0].strip()
@@ -359,22 +367,36 @@ def main(args):
                     parser.parse_args(arglist, namespace=customargs)
                     diag = diagnose_rawfile(customargs.rawfile_id, \
                                 customargs.diagnostic, customargs.value, \
-                                existdb=db)
-                        
+                                existdb=db, lazy=True)
+                    todo.append((customargs, diag))
+                except errors.ToasterError:
+                    numfails += 1
+                    traceback.print_exc()
+            if args.from_file != '-':
+                rawlist.close()
+            # Compute the diagnostics concurrently
+            errs = diagnostics.compute_diagnostics([d for _, d in todo])
+            for (customargs, diag), err in zip(todo, errs):
+                if err is not None:
+                    # Diagnostics may fail with any exception. Count
+                    # it, rather than abandoning the rest of the list.
+                    numfails += 1
+                    diagnostics.print_diagnostic_error(err)
+                    continue
+                try:
                     if customargs.insert:
                         insert_rawfile_diagnostics(customargs.rawfile_id, \
                                                 [diag], existdb=db)
                     else:
                         print(str(diag))
+                    numdiagnosed += 1
                 except errors.ToasterError:
                     numfails += 1
                     traceback.print_exc()
-            if args.from_file != '-':
-                rawlist.close()
             if numdiagnosed:
                 notify.print_success("\n\n===================================\n" \
                                     "%d rawfiles successfully diagnosed\n" \
-                                    "===================================\n" % numadded)
+                                    "===================================\n" % numdiagnosed)
             if numfails:
                 raise errors.ToasterError(\
                     "\n\n===================================\n" \
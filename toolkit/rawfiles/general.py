@@ -4,6 +4,7 @@ import warnings
 from toaster import database
 from toaster import errors
 from toaster.utils import datafile
+from toaster.utils import archivecache
 from toaster.utils import notify
 
 
@@ -44,7 +45,8 @@ def get_rawfile_diagnostics(rawfile_id, existdb=None):
     return diags, diag_plots
 
 
-def get_rawfile_from_id(rawfile_id, existdb=None, verify_md5=True):
+def get_rawfile_from_id(rawfile_id, existdb=None, verify_md5=True,
+                        use_cache=True):
     """Return the path to the raw file that has the given ID number.
         Optionally double check the file's MD5 sum, to make sure
         nothing strange has happened.
@@ -56,6 +58,9 @@ def get_rawfile_from_id(rawfile_id, existdb=None, verify_md5=True):
                 (Default: Establish a db connection)
             verify_md5: If True, double check the file's MD5 sum.
                 (Default: Perform MD5 check.)
+            use_cache: If True, return the file's copy in the
+                archive cache, if the cache is enabled (see
+                'utils/archivecache.py'). (Default: use the cache)
 
         Output:
             fn: The full file path.
@@ -97,6 +102,12 @@ def get_rawfile_from_id(rawfile_id, existdb=None, verify_md5=True):
                                                (len(rows), rawfile_id))
         
     fullpath = os.path.join(filepath, filename)
+    if use_cache:
+        # Read a local copy, rather than the archive
+        cachedpath = archivecache.get_cached_file(fullpath, md5sum_db,
+                                                  verify_md5)
+        if cachedpath is not None:
+            return cachedpath
     # Make sure the file exists
     datafile.verify_file_path(fullpath)
     if verify_md5:
@@ -130,6 +141,7 @@ def get_rawfile_info(rawfile_id, existdb=None):
     select = db.select([db.rawfiles.c.filename,
                         db.rawfiles.c.filepath,
                         db.rawfiles.c.md5sum,
+                        db.rawfiles.c.filesize,
                         db.rawfiles.c.pulsar_id,
                         db.rawfiles.c.obssystem_id]).\
                 where(db.rawfiles.c.rawfile_id == rawfile_id)
@@ -15,6 +15,7 @@ from toaster import errors
 from toaster import diagnostics
 from toaster.utils import notify
 from toaster.utils import datafile
+from toaster.utils import journal
 from toaster.toolkit.rawfiles import diagnose_rawfile
 
 SHORTNAME = 'load'
@@ -28,6 +29,20 @@ def add_arguments(parser):
                         help="A list of rawfiles (one per line) to "
                              "load. (Default: load a raw file provided "
                              "on the cmd line.)")
+    parser.add_argument('--journal', dest='journal',
+                        type=str, default=None,
+                        help="A file recording the outcome of each line "
+                             "of the --from-file list, so the batch can "
+                             "be resumed. (Default: the list's name with "
+                             "'%s' appended. No journal is kept when "
+                             "reading the list from stdin.)" %
+                             journal.JOURNAL_SUFFIX)
+    parser.add_argument('--resume', dest='resume',
+                        action='store_true', default=False,
+                        help="Skip the lines of the --from-file list "
+                             "that the journal records as loaded, and "
+                             "retry the others. (Default: load every "
+                             "line, starting a new journal)")
     parser.add_argument("rawfile", nargs='?', type=str,
                         help="File name of the raw file to upload.")
 
@@ -89,14 +104,9 @@ def populate_rawfiles_table(db, archivefn, params):
         result.close()
 
         # Create rawfile diagnostics
-        diags = []
-        for diagname in config.cfg.default_rawfile_diagnostics:
-            diagcls = diagnostics.get_diagnostic_class(diagname)
-            try:
-                diags.append(diagcls(archivefn))
-            except (errors.DiagnosticNotApplicable, e):
-                notify.print_info("Diagnostic isn't applicable: %s. "
-                                  "Skipping..." % str(e), 1)
+        diags = diagnostics.run_diagnostics(archivefn,
+                                    config.cfg.default_rawfile_diagnostics,
+                                    params=params)
         if diags:
             # Load processing diagnostics
             diagnose_rawfile.insert_rawfile_diagnostics(rawfile_id, diags,
@@ -168,32 +178,58 @@ def main(args):
                                            "not appear to exist." %
                                            args.from_file)
                 rawlist = open(args.from_file, 'r')
-            numfails = 0
-            numloaded = 0
+            lines = []
+            fns = []
             for line in rawlist:
                 # Strip comments
                 line = line.partition('#')[0].strip()
                 if not line:
                     # Skip empty line
                     continue
-                try:
-                    # parsing arguments is overkill at the moment 
-                    # since 'load_rawfile.py' doesn't take any 
-                    # arguments, but this makes the code more future-proof
-                    customargs = copy.deepcopy(args)
-                    arglist = shlex.split(line.strip())
-                    file_parser.parse_args(arglist, namespace=customargs)
-                 
-                    fn = customargs.rawfile
-                    rawfile_id = load_rawfile(fn, db)
-                    print("%s has been loaded to the DB. rawfile_id: %d" % \
-                          (fn, rawfile_id))
-                    numloaded += 1
-                except errors.ToasterError:
-                    numfails += 1
-                    traceback.print_exc()
+                # parsing arguments is overkill at the moment 
+                # since 'load_rawfile.py' doesn't take any 
+                # arguments, but this makes the code more future-proof
+                customargs = copy.deepcopy(args)
+                arglist = shlex.split(line.strip())
+                file_parser.parse_args(arglist, namespace=customargs)
+                lines.append(line)
+                fns.append(customargs.rawfile)
             if args.from_file != '-':
                 rawlist.close()
+            keys = journal.get_line_keys(lines)
+            batchjournal = journal.BatchJournal(
+                        journal.get_journal_path(args.from_file, args.journal),
+                        args.resume)
+            torun = range(len(fns))
+            if args.resume:
+                torun = [ii for ii in torun
+                         if not batchjournal.is_done(keys[ii])]
+                notify.print_info("Skipping %d rawfiles already loaded "
+                                  "(journal: %s)" %
+                                  (len(fns)-len(torun), batchjournal.path), 1)
+            # Read the headers of many files with each 'vap' call
+            datafile.prefetch_header_vals([fns[ii] for ii in torun],
+                                          existdb=db)
+            numfails = 0
+            numloaded = 0
+            try:
+                for ii in torun:
+                    fn = fns[ii]
+                    try:
+                        rawfile_id = load_rawfile(fn, db)
+                    except errors.ToasterError as exc:
+                        numfails += 1
+                        traceback.print_exc()
+                        batchjournal.record(keys[ii], lines[ii], 'failed',
+                                            message=str(exc))
+                    else:
+                        print("%s has been loaded to the DB. rawfile_id: %d" % \
+                              (fn, rawfile_id))
+                        numloaded += 1
+                        batchjournal.record(keys[ii], lines[ii], 'done',
+                                            {'rawfile_id': rawfile_id})
+            finally:
+                batchjournal.close()
             if numloaded:
                 notify.print_success(
                     "\n\n===================================\n"
@@ -4,6 +4,7 @@ import warnings
 from toaster import database
 from toaster import errors
 from toaster.utils import datafile
+from toaster.utils import archivecache
 from toaster.utils import notify
 
 
@@ -54,6 +55,7 @@ def set_as_master_template(template_id, existdb=None):
             return
         else:
             # Update the existing entry
+            replaced = row['mtempid']
             query = db.master_templates.update().\
                         where((db.master_templates.c.pulsar_id ==
                                     row['pulsar_id']) &
@@ -62,6 +64,7 @@ def set_as_master_template(template_id, existdb=None):
             values = {'template_id': template_id}
     else:
         # Insert a new entry
+        replaced = None
         query = db.master_templates.insert()
         select = db.select([db.templates.c.pulsar_id,
                             db.templates.c.obssystem_id]).\
@@ -81,6 +84,11 @@ def set_as_master_template(template_id, existdb=None):
     else:
         trans.commit()
         result.close()
+        if replaced is not None:
+            notify.print_info("The master template (ID: %d) has been replaced. "
+                              "Processing that used it can be queued "
+                              "again with 'processing.py replan'." %
+                              replaced, 1)
     finally:
         if not existdb:
             db.close()
@@ -149,7 +157,8 @@ def get_template_id(template, existdb=None):
                                                "or md5sum!" % len(rows))
 
 
-def get_template_from_id(template_id, existdb=None, verify_md5=True):
+def get_template_from_id(template_id, existdb=None, verify_md5=True,
+                         use_cache=True):
     """Return the path to the raw file that has the given ID number.
         Optionally double check the file's MD5 sum, to make sure
         nothing strange has happened.
@@ -161,6 +170,9 @@ def get_template_from_id(template_id, existdb=None, verify_md5=True):
                 (Default: Establish a db connection)
             verify_md5: If True, double check the file's MD5 sum.
                 (Default: Perform MD5 check.)
+            use_cache: If True, return the file's copy in the
+                archive cache, if the cache is enabled (see
+                'utils/archivecache.py'). (Default: use the cache)
 
         Output:
             fn: The full file path.
@@ -192,6 +204,12 @@ def get_template_from_id(template_id, existdb=None, verify_md5=True):
                                                (len(rows), template_id))
         
     fullpath = os.path.join(filepath, filename)
+    if use_cache:
+        # Read a local copy, rather than the archive
+        cachedpath = archivecache.get_cached_file(fullpath, md5sum_db,
+                                                  verify_md5)
+        if cachedpath is not None:
+            return cachedpath
     # Make sure the file exists
     datafile.verify_file_path(fullpath)
     if verify_md5:
@@ -67,7 +67,8 @@ def move_template(template_id, dest, existdb=None):
 
     trans = db.begin()
     try:
-        template = general.get_template_from_id(template_id, existdb=db)
+        template = general.get_template_from_id(template_id, existdb=db,
+                                                use_cache=False)
 
         dest = os.path.abspath(dest)
         if os.path.isdir(dest):
@@ -102,7 +102,8 @@ def main(args):
 
     trans = db.begin()
     try:
-        template = general.get_template_from_id(args.template_id, existdb=db)
+        template = general.get_template_from_id(args.template_id,
+                                                existdb=db, use_cache=False)
         # First remove the template entry from the DB
         remove_template_entry(args.template_id)
         # Now deal with the template itself
@@ -1,3 +1,5 @@
+import os.path
+
 from toaster import config
 from toaster.toolkit.timfiles import readers
 
@@ -52,4 +54,35 @@ def parse_pat_output(patout):
                             'bw': bw_per_toa,
                             'length': length_per_toa,
                             'nbin': nbin})
-    return toainfo
\ No newline at end of file
+    return toainfo
+
+def parse_pat_output_by_file(patout):
+    """Parse the output from running 'pat' on many archives at
+        once, and split the TOAs by archive.
+
+        Input:
+            patout: The stdout output of running 'pat' (with
+                '-f tempo2', so each line includes the archive's
+                file name).
+
+        Output:
+            toas_by_file: A dictionary, keyed by the archives' base
+                names, of lists of (toanum, toainfo) tuples. 'toanum'
+                is the TOA's position in the output (starting at 0),
+                and 'toainfo' is a dictionary of information, as
+                returned by 'parse_pat_output'.
+    """
+    lines_by_file = {}
+    toanum = 0
+    for toastr in patout.split("\n"):
+        toastr = toastr.strip()
+        if readers.tempo2_reader(toastr, get_telescope_id=False):
+            fn = os.path.basename(toastr.split()[0])
+            lines_by_file.setdefault(fn, []).append((toanum, toastr))
+            toanum += 1
+    toas_by_file = {}
+    for fn, lines in lines_by_file.items():
+        toanums, toastrs = zip(*lines)
+        toainfo = parse_pat_output("\n".join(toastrs))
+        toas_by_file[fn] = list(zip(toanums, toainfo))
+    return toas_by_file
@@ -7,6 +7,7 @@ import hashlib
 import subprocess
 import types
 import warnings
+import time
 import re
 
 import numpy as np
@@ -15,6 +16,8 @@ from toaster import config
 from toaster import errors
 from toaster import debug
 from toaster.utils import notify
+from toaster.utils import sysusage
+from toaster.utils import profiling
 
 ##############################################################################
 # GLOBAL DEFINITIONS
@@ -33,6 +36,25 @@ def give_utc_now():
     return utcnow.strftime("%b %d, %Y - %H:%M:%S (UTC)")
 
 
+def sleep(seconds):
+    """Sleep for the given number of seconds, even if the sleep
+        is interrupted by signals (e.g. the samples of the
+        'sampling' profiler, see 'utils/profiling.py'). In
+        Python 2, 'time.sleep' returns early when interrupted.
+
+        Input:
+            seconds: The number of seconds to sleep.
+
+        Outputs:
+            None
+    """
+    deadline = time.time() + seconds
+    remaining = seconds
+    while remaining > 0:
+        time.sleep(remaining)
+        remaining = deadline - time.time()
+
+
 def hash_password(pw):
     return hashlib.md5(pw).hexdigest()
 
@@ -52,6 +74,9 @@ def execute(cmd, stdout=subprocess.PIPE, stderr=sys.stderr,
         If stdinstr is not None, send the string to the command as
         data in the stdin stream.
 
+        The resources used by the command are recorded (see
+        'utils/sysusage.py').
+
         Returns (stdoutdata, stderrdata). These will both be None, 
         unless subprocess.PIPE is provided.
     """
@@ -75,15 +100,20 @@ def execute(cmd, stdout=subprocess.PIPE, stderr=sys.stderr,
         notify.print_debug("Sending the following to cmd's stdin: %s" % stdinstr, \
                            "syscalls")
         # Run (and time) the command. Check for errors.
-        pipe = subprocess.Popen(cmd, shell=False, cwd=execdir,
-                                stdin=subprocess.PIPE,
-                                stdout=stdout, stderr=stderr)
+        start = time.time()
+        pipe = sysusage.ResourcePopen(cmd, shell=False, cwd=execdir,
+                                      stdin=subprocess.PIPE,
+                                      stdout=stdout, stderr=stderr,
+                                      close_fds=True)
         (stdoutdata, stderrdata) = pipe.communicate(stdinstr)
     else:
         # Run (and time) the command. Check for errors.
-        pipe = subprocess.Popen(cmd, shell=False, cwd=execdir,
-                                stdout=stdout)#, stderr=stderr)
+        start = time.time()
+        pipe = sysusage.ResourcePopen(cmd, shell=False, cwd=execdir,
+                                      close_fds=True,
+                                      stdout=stdout)#, stderr=stderr)
         (stdoutdata, stderrdata) = pipe.communicate()
+    sysusage.record(cmd, pipe, time.time()-start, sysusage.get_caller())
     retcode = pipe.returncode
     if retcode < 0:
         raise errors.SystemCallError("Execution of command (%s) terminated by signal (%s)!" % \
@@ -137,6 +167,7 @@ class DefaultArguments(argparse.ArgumentParser):
         args = argparse.ArgumentParser.parse_args(self, *args, **kwargs)
         if not self._subparsers:
             set_warning_mode(args.warnmode)
+            self.start_profiling(args)
         return args
 
     def parse_known_args(self, *args, **kwargs):
@@ -148,8 +179,13 @@ class DefaultArguments(argparse.ArgumentParser):
         args, leftovers = argparse.ArgumentParser.parse_known_args(self, *args, **kwargs)
         if not self._subparsers:
             set_warning_mode(args.warnmode)
+            self.start_profiling(args)
         return args, leftovers
 
+    def start_profiling(self, args):
+        if getattr(args, 'profile', None) is not None:
+            profiling.start(args.profile, args.profile_top, args.profile_mode)
+
     def add_standard_group(self):
         if self.added_std_group:
             # Already added standard group
@@ -207,6 +243,23 @@ class DefaultArguments(argparse.ArgumentParser):
                            action=self.ListDebugModes,
                            help="List available debugging modes and "
                                 "descriptions, then exit")
+        group.add_argument('--profile', dest='profile', nargs='?',
+                           metavar='OUTFILE', const='', default=None,
+                           help="Profile the program. Statistics are "
+                                "written to OUTFILE, and collapsed stacks "
+                                "(for flamegraphs) to OUTFILE.collapsed. "
+                                "(Default: don't profile. If no OUTFILE is "
+                                "given use '<program>.<pid>.prof')")
+        group.add_argument('--profile-top', dest='profile_top', type=int,
+                           default=20,
+                           help="Number of functions to print when "
+                                "profiling. (Default: 20)")
+        group.add_argument('--profile-mode', dest='profile_mode',
+                           choices=profiling.PROFILE_MODES, default='auto',
+                           help="The profiler to use. 'sampling' samples "
+                                "the stack at regular wall-clock intervals. "
+                                "'cprofile' traces every function call. "
+                                "(Default: 'sampling', if available)")
         self.added_debug_group = True
 
     class LoadConfigFile(argparse.Action):
@@ -0,0 +1,181 @@
+"""A local read-through cache of files in the data archive.
+
+    When 'archive_cache_dir' is set, raw files, parfiles and templates
+    looked up by ID (e.g. 'get_rawfile_from_id') are read from a copy
+    in the cache, rather than from the archive. This is useful when
+    the archive is on slow, or remote, storage and the same files are
+    processed repeatedly (e.g. when reprocessing).
+
+    Entries are keyed by the MD5 sum stored in the DB, so a file that
+    changes in the archive is never confused with its cached copy.
+    A file is copied into the cache the first time it is read, and
+    the copy's MD5 sum is checked against the DB before it is used.
+    Files are always copied (never reflinked or hardlinked), since the
+    point of the cache is to keep the data on local storage.
+    The cache is bounded by 'archive_cache_max_size', and the least
+    recently used files are removed when it grows larger.
+
+    The cache can be filled ahead of time for the jobs at the front
+    of the processing queue with 'processing.py prefetch'.
+"""
+import os.path
+import warnings
+
+from toaster import config
+from toaster import errors
+from toaster.utils import notify
+from toaster.utils import datafile
+from toaster.utils import diskcache
+
+
+def get_archive_cache():
+    """Return the cache of archived files.
+
+        Inputs:
+            None
+
+        Output:
+            archivecache: A DiskCache object. None if the cache
+                is disabled.
+    """
+    if not config.cfg.archive_cache_dir:
+        return None
+    return diskcache.DiskCache(config.cfg.archive_cache_dir,
+                               config.cfg.archive_cache_max_size,
+                               name='archive')
+
+
+def get_archive_cache_key(md5sum):
+    """Return the key identifying an archived file in the cache.
+
+        Input:
+            md5sum: The file's MD5 sum, as stored in the DB.
+
+        Output:
+            key: The cache key.
+    """
+    return "archive:%s" % md5sum
+
+
+def add_to_archive_cache(cache, fullpath, md5sum):
+    """Copy an archived file into the cache, and check the copy's
+        MD5 sum.
+
+        Inputs:
+            cache: The archive cache (a DiskCache object).
+            fullpath: The archived file.
+            md5sum: The file's MD5 sum, as stored in the DB.
+
+        Output:
+            path: The cached copy. None if the file is too large
+                to be cached.
+    """
+    key = get_archive_cache_key(md5sum)
+    notify.print_info("Copying %s into archive cache" % fullpath, 2)
+    cache.put(key, fullpath, method='copy')
+    path = cache.lookup(key)
+    if path is None:
+        return None
+    md5sum_file = datafile.get_md5sum(path)
+    if md5sum_file != md5sum:
+        cache.remove(key)
+        raise errors.FileError("md5sum check of %s failed! MD5 from "
+                               "DB (%s) != MD5 from file (%s)" %
+                               (fullpath, md5sum, md5sum_file))
+    return path
+
+
+def get_cached_file(fullpath, md5sum, verify_md5=True):
+    """Return the cached copy of an archived file, copying it into
+        the cache if it isn't there yet.
+
+        NOTE: The copy may be evicted by another process. It should
+            be used (or staged) straight away, and must not be
+            modified.
+
+        Inputs:
+            fullpath: The archived file.
+            md5sum: The file's MD5 sum, as stored in the DB.
+            verify_md5: If True, double check the MD5 sum of a copy
+                that was already cached. Copies are always checked
+                when they are added to the cache.
+                (Default: Perform MD5 check.)
+
+        Output:
+            path: The cached copy. None if the cache is disabled,
+                or the file is too large to be cached.
+    """
+    cache = get_archive_cache()
+    if cache is None:
+        return None
+    key = get_archive_cache_key(md5sum)
+    path = cache.lookup(key)
+    if (path is not None) and verify_md5:
+        notify.print_info("Confirming MD5 sum of cached copy (%s) of %s "
+                          "matches what is stored in DB (%s)" %
+                          (path, fullpath, md5sum), 2)
+        if datafile.get_md5sum(path) != md5sum:
+            warnings.warn("The cached copy (%s) of %s is corrupt. It will "
+                          "be replaced." % (path, fullpath),
+                          errors.ToasterWarning)
+            cache.remove(key)
+            path = None
+    if path is None:
+        datafile.verify_file_path(fullpath)
+        path = add_to_archive_cache(cache, fullpath, md5sum)
+    return path
+
+
+def prefetch_files(files, maxsize=None):
+    """Copy archived files into the cache, unless they are
+        already cached. Files are added in order, until the
+        cache would be full.
+
+        Inputs:
+            files: A list of (full path, MD5 sum) tuples.
+            maxsize: The maximum total size of the files to
+                prefetch, in bytes. (Default: the cache's maximum
+                size)
+
+        Outputs:
+            nfetched: The number of files copied into the cache.
+            ncached: The number of files that were already cached.
+    """
+    cache = get_archive_cache()
+    if cache is None:
+        raise errors.BadInputError("The archive cache is disabled. Set "
+                                   "'archive_cache_dir' in the "
+                                   "configuration to enable it.")
+    if maxsize is None:
+        maxsize = cache.maxsize
+    nfetched = 0
+    ncached = 0
+    total = 0
+    seen = set()
+    for fullpath, md5sum in files:
+        if md5sum in seen:
+            continue
+        seen.add(md5sum)
+        path = cache.lookup(get_archive_cache_key(md5sum))
+        if path is not None:
+            size = os.path.getsize(path)
+        else:
+            datafile.verify_file_path(fullpath)
+            size = os.path.getsize(fullpath)
+        if total + size > maxsize:
+            # Prefetching more would evict the files
+            # needed first
+            notify.print_info("Stopping prefetch. The files needed next "
+                              "would fill the archive cache.", 1)
+            break
+        total += size
+        if path is not None:
+            ncached += 1
+            continue
+        try:
+            if add_to_archive_cache(cache, fullpath, md5sum) is not None:
+                nfetched += 1
+        except errors.FileError as exc:
+            # Don't stop prefetching for one bad file
+            warnings.warn(str(exc), errors.ToasterWarning)
+    return nfetched, ncached
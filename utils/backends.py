@@ -0,0 +1,403 @@
+"""Access to the contents of archives.
+
+    TOASTER reads and modifies archives through an archive backend.
+    Each backend provides the same operations:
+        - Reading header params (as 'vap' reports them).
+        - Scrunching an archive in place (as 'pam -m' does).
+        - Installing an ephemeris in place (as 'pam -m -E' does).
+        - Computing statistics (as 'psrstat' reports them).
+
+    The following backends are available:
+        'subprocess': Run the PSRCHIVE command line tools.
+        'psrchive': Use the PSRCHIVE python bindings in-process,
+            avoiding a fork/exec (and re-reading the file) for each
+            operation. Operations the bindings don't provide an
+            equivalent of are passed to the 'subprocess' backend.
+        'fake': A pure-python implementation that works on the fake
+            archives written by 'benchmarks/fake_psrchive.py'. It is
+            meant for tests and benchmarks.
+    The backend to use is set by the 'archive_backend' configuration.
+    With 'auto' the 'psrchive' backend is used if the python bindings
+    can be imported, otherwise the 'subprocess' backend is used.
+"""
+import os.path
+
+from toaster import config
+from toaster import errors
+from toaster import utils
+from toaster.utils import notify
+
+BACKEND_NAMES = ['auto', 'subprocess', 'psrchive', 'fake']
+
+# Backend instances, keyed by name
+backends = {}
+
+
+class BaseArchiveBackend(object):
+    """The base class of archive backends.
+
+        Values are returned as strings, formatted the way the
+        PSRCHIVE command line tools print them, so callers are
+        independent of the backend used.
+    """
+    name = NotImplemented
+
+    def read_headers(self, fns, hdritems):
+        """Read a set of header params from each of the given files.
+
+            Inputs:
+                fns: The names of the files to read.
+                hdritems: List of parameters (recognized by vap) to read.
+
+            Output:
+                outvals: A dictionary, keyed by file name, of lists of
+                    values (strings, in the same order as 'hdritems').
+                    Undefined values are '*'. Files that cannot be
+                    read are not included.
+        """
+        raise NotImplementedError("The 'read_headers' method of archive "
+                                  "backends must be defined.")
+
+    def read_header(self, fn, hdritems):
+        """Read a set of header params from a file. An exception
+            is raised if the file cannot be read.
+
+            Inputs:
+                fn: The name of the file to read.
+                hdritems: List of parameters (recognized by vap) to read.
+
+            Output:
+                outvals: A list of values (strings, in the same order
+                    as 'hdritems').
+        """
+        outvals = self.read_headers([fn], hdritems)
+        if fn not in outvals:
+            raise errors.SystemCallError("Cannot read the header of %s "
+                                         "(archive backend: %s)" %
+                                         (fn, self.name))
+        return outvals[fn]
+
+    def scrunch(self, fn, nsub=1, nchan=1, nbin=None, tsub=None,
+                parfile=None):
+        """Scrunch an archive in place.
+
+            Inputs:
+                fn: The name of the archive to modify.
+                nsub: Number of output subints. (Default: 1)
+                nchan: Number of output channels. (Default: 1)
+                nbin: Number of output bins. (Default: Don't bin
+                    scrunch.)
+                tsub: Number of seconds to include in each subint.
+                    This overrides 'nsub'. (Default: use 'nsub')
+                parfile: An ephemeris to install, and update the DM
+                    from, before scrunching. (Default: Don't
+                    install an ephemeris.)
+
+            Outputs:
+                None
+        """
+        raise NotImplementedError("The 'scrunch' method of archive "
+                                  "backends must be defined.")
+
+    def install_ephemeris(self, fn, parfile):
+        """Install an ephemeris in an archive, in place, and update
+            the archive's DM from it.
+
+            Inputs:
+                fn: The name of the archive to modify.
+                parfile: The ephemeris to install.
+
+            Outputs:
+                None
+        """
+        raise NotImplementedError("The 'install_ephemeris' method of "
+                                  "archive backends must be defined.")
+
+    def get_stats(self, fn, exprs, jobs=None):
+        """Compute statistics of an archive.
+
+            Inputs:
+                fn: The name of the archive.
+                exprs: List of expressions (recognized by psrstat)
+                    to compute.
+                jobs: Processing to apply (a comma-separated string
+                    of psrstat job codes, e.g. 'DTFp') before computing
+                    the statistics. (Default: no processing)
+
+            Output:
+                outvals: A list of values (strings, in the same order
+                    as 'exprs').
+        """
+        raise NotImplementedError("The 'get_stats' method of archive "
+                                  "backends must be defined.")
+
+
+class SubprocessBackend(BaseArchiveBackend):
+    """Run the PSRCHIVE command line tools.
+    """
+    name = 'subprocess'
+
+    def read_headers(self, fns, hdritems):
+        if not fns:
+            return {}
+        cmd = ["vap", "-n", "-c", ",".join(hdritems)] + list(fns)
+        try:
+            outstr, errstr = utils.execute(cmd)
+        except errors.SystemCallError as exc:
+            # Probably one of the files is bad
+            notify.print_debug("Cannot read headers of %d files with a "
+                               "single command (%s). Skipping them." %
+                               (len(fns), str(exc)), 'headers')
+            return {}
+        return parse_vap_output_by_file(outstr, fns, len(hdritems))
+
+    def read_header(self, fn, hdritems):
+        cmd = ["vap", "-n", "-c", ",".join(hdritems), fn]
+        outstr, errstr = utils.execute(cmd)
+        outvals = outstr.split()[(0 - len(hdritems)):]  # First value is filename (we don't need it)
+        if errstr:
+            raise errors.SystemCallError("The command: %s\nprinted to stderr:\n%s" %
+                                         (cmd, errstr))
+        elif len(outvals) != len(hdritems):
+            raise errors.SystemCallError("The command: %s\nreturned the wrong "
+                                         "number of values. (Was expecting %d, got %d.)" %
+                                         (cmd, len(hdritems), len(outvals)))
+        return outvals
+
+    def scrunch(self, fn, nsub=1, nchan=1, nbin=None, tsub=None,
+                parfile=None):
+        cmd = ["pam", "-m", "--setnchn", str(nchan), fn]
+        if tsub is not None:
+            cmd += ["--settsub", "%f" % tsub]
+        else:
+            cmd += ["--setnsub", "%d" % nsub]
+
+        if nbin is not None:
+            cmd += ["--setnbin", "%d" % nbin]
+
+        if parfile is not None:
+            # pam installs the ephemeris (and re-dedisperses) before
+            # scrunching, so this is equivalent to running 'pam -E'
+            # separately, but only reads/writes the data once
+            cmd += ["-E", parfile, "--update_dm"]
+        utils.execute(cmd)
+
+    def install_ephemeris(self, fn, parfile):
+        cmd = ["pam", "-m", "-E", parfile, "--update_dm", fn]
+        utils.execute(cmd)
+
+    def get_stats(self, fn, exprs, jobs=None):
+        cmd = ["psrstat", "-Qq"]
+        if jobs:
+            cmd += ["-j", jobs]
+        cmd += ["-c", ",".join(exprs), fn]
+        outstr, errstr = utils.execute(cmd)
+        outvals = outstr.split()
+        if len(outvals) != len(exprs):
+            raise errors.SystemCallError("The command: %s\nreturned the wrong "
+                                         "number of values. (Was expecting %d, got %d.)" %
+                                         (cmd, len(exprs), len(outvals)))
+        return outvals
+
+
+class PsrchiveBackend(BaseArchiveBackend):
+    """Use the PSRCHIVE python bindings in-process.
+    """
+    name = 'psrchive'
+
+    # Header params the bindings provide, and how to get them
+    # from an Archive object
+    header_getters = {'nbin': lambda ar: "%d" % ar.get_nbin(),
+                      'nchan': lambda ar: "%d" % ar.get_nchan(),
+                      'npol': lambda ar: "%d" % ar.get_npol(),
+                      'nsub': lambda ar: "%d" % ar.get_nsubint(),
+                      'name': lambda ar: ar.get_source(),
+                      'telescop': lambda ar: ar.get_telescope(),
+                      'rcvr': lambda ar: ar.get_receiver_name(),
+                      'backend': lambda ar: ar.get_backend_name(),
+                      'freq': lambda ar: "%.10g" % ar.get_centre_frequency(),
+                      'bw': lambda ar: "%.10g" % ar.get_bandwidth(),
+                      'dm': lambda ar: "%.10g" % ar.get_dispersion_measure(),
+                      'rm': lambda ar: "%.10g" % ar.get_rotation_measure(),
+                      'length': lambda ar: "%.10g" % ar.integration_length()}
+
+    def __init__(self):
+        import psrchive  # Import here in case psrchive
+                         # bindings aren't installed
+        self.psrchive = psrchive
+        self.fallback = get_backend('subprocess')
+
+    def read_headers(self, fns, hdritems):
+        if [key for key in hdritems if key not in self.header_getters]:
+            # Not all params can be read in-process. Read the
+            # files once, with the command line tools instead.
+            return self.fallback.read_headers(fns, hdritems)
+        outvals = {}
+        for fn in fns:
+            try:
+                arch = self.psrchive.Archive_load(fn)
+            except Exception as exc:
+                notify.print_debug("Cannot load %s (%s). Skipping it." %
+                                   (fn, str(exc)), 'headers')
+                continue
+            vals = []
+            for key in hdritems:
+                val = self.header_getters[key](arch)
+                vals.append(val.strip() or '*')
+            outvals[fn] = vals
+        return outvals
+
+    def read_header(self, fn, hdritems):
+        if [key for key in hdritems if key not in self.header_getters]:
+            return self.fallback.read_header(fn, hdritems)
+        return super(PsrchiveBackend, self).read_header(fn, hdritems)
+
+    def scrunch(self, fn, nsub=1, nchan=1, nbin=None, tsub=None,
+                parfile=None):
+        if parfile is not None:
+            # Installing ephemerides is left to 'pam'
+            self.fallback.install_ephemeris(fn, parfile)
+        arch = self.psrchive.Archive_load(fn)
+        if tsub is not None:
+            nsub = max(1, int(arch.integration_length()/tsub + 0.5))
+        if arch.get_nchan() > nchan:
+            arch.fscrunch_to_nchan(nchan)
+        if arch.get_nsubint() > nsub:
+            arch.tscrunch_to_nsub(nsub)
+        if (nbin is not None) and (arch.get_nbin() > nbin):
+            arch.bscrunch_to_nbin(nbin)
+        arch.unload(fn)
+
+    def install_ephemeris(self, fn, parfile):
+        self.fallback.install_ephemeris(fn, parfile)
+
+    def get_stats(self, fn, exprs, jobs=None):
+        if [expr for expr in exprs if expr != 'int:wt'] or jobs:
+            return self.fallback.get_stats(fn, exprs, jobs)
+        arch = self.psrchive.Archive_load(fn)
+        weights = arch.get_weights()
+        wtstr = ",".join(["%g" % wt for wt in weights.flatten()])
+        return [wtstr]*len(exprs)
+
+
+class FakeBackend(BaseArchiveBackend):
+    """A pure-python backend for the fake archives written by
+        'benchmarks/fake_psrchive.py'.
+    """
+    name = 'fake'
+
+    def __init__(self):
+        from toaster.benchmarks import fake_psrchive
+        self.fake = fake_psrchive
+
+    def read_headers(self, fns, hdritems):
+        outvals = {}
+        for fn in fns:
+            try:
+                hdr, padding = self.fake.read_header(fn)
+            except (IOError, OSError, ValueError) as exc:
+                notify.print_debug("Cannot read %s (%s). Skipping it." %
+                                   (fn, str(exc)), 'headers')
+                continue
+            outvals[fn] = [self.fake.get_header_value(hdr, key)
+                           for key in hdritems]
+        return outvals
+
+    def scrunch(self, fn, nsub=1, nchan=1, nbin=None, tsub=None,
+                parfile=None):
+        opts = [('-m', None), ('--setnchn', str(nchan))]
+        if tsub is not None:
+            opts.append(('--settsub', "%f" % tsub))
+        else:
+            opts.append(('--setnsub', "%d" % nsub))
+        if nbin is not None:
+            opts.append(('--setnbin', "%d" % nbin))
+        if parfile is not None:
+            opts += [('-E', parfile), ('--update_dm', None)]
+        self.fake.pam(opts, [fn])
+
+    def install_ephemeris(self, fn, parfile):
+        self.fake.pam([('-m', None), ('-E', parfile),
+                       ('--update_dm', None)], [fn])
+
+    def get_stats(self, fn, exprs, jobs=None):
+        hdr, padding = self.fake.read_header(fn)
+        outvals = []
+        for expr in exprs:
+            if expr == 'snr':
+                outvals.append("%.3f" %
+                               (10 + 990*self.fake.pseudo_random(fn, expr)))
+            elif expr == 'int:wt':
+                nprof = hdr['nsub']*hdr['nchan']
+                outvals.append(",".join(["%d" % (self.fake.pseudo_random(fn, ii) > 0.05)
+                                         for ii in range(nprof)]))
+            else:
+                outvals.append(self.fake.get_header_value(hdr, expr))
+        return outvals
+
+
+def parse_vap_output_by_file(outstr, fns, nitems):
+    """Split the output of a 'vap -n -c' command run on
+        several files into the values reported for each file.
+
+        Inputs:
+            outstr: The output of 'vap'.
+            fns: The names of the files, as given to 'vap'.
+            nitems: The number of values reported for each file.
+
+        Output:
+            outvals: A dictionary, keyed by file name, of lists of
+                values (strings). Files that 'vap' didn't report
+                are not included.
+    """
+    basenames = {}
+    for fn in fns:
+        basenames.setdefault(os.path.basename(fn), []).append(fn)
+    outvals = {}
+    for line in outstr.splitlines():
+        tokens = line.split()
+        if len(tokens) <= nitems:
+            # Not a line of values
+            continue
+        name = " ".join(tokens[:-nitems])
+        if name in basenames.get(os.path.basename(name), []):
+            outvals[name] = tokens[-nitems:]
+        elif len(basenames.get(name, [])) == 1:
+            # Reported by its base name
+            outvals[basenames[name][0]] = tokens[-nitems:]
+    return outvals
+
+
+def get_backend(name=None):
+    """Return an archive backend.
+
+        Input:
+            name: The name of the backend. (Default: use the
+                'archive_backend' configuration)
+
+        Output:
+            backend: The archive backend object.
+    """
+    if name is None:
+        name = config.cfg.archive_backend
+    if name not in BACKEND_NAMES:
+        raise errors.UnrecognizedValueError("The archive backend '%s' is "
+                                            "not recognized. Valid backends "
+                                            "are: '%s'" %
+                                            (name, "', '".join(BACKEND_NAMES)))
+    if name not in backends:
+        if name == 'auto':
+            try:
+                backend = get_backend('psrchive')
+            except ImportError:
+                backend = get_backend('subprocess')
+        elif name == 'subprocess':
+            backend = SubprocessBackend()
+        elif name == 'psrchive':
+            backend = PsrchiveBackend()
+        else:
+            backend = FakeBackend()
+        notify.print_debug("Using the '%s' archive backend" % backend.name,
+                           'backends')
+        backends[name] = backend
+    return backends[name]
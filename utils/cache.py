@@ -65,6 +65,9 @@ def get_userid(user_name=None):
     if user_name is None:
         user_name = pwd.getpwuid(os.getuid())[0]
     cache = get_userid_cache()
+    if user_name not in cache:
+        # It may have been added since the cache was loaded
+        cache = get_userid_cache(update=True)
     if user_name not in cache:
         raise errors.UnrecognizedValueError("The user name (%s) does not " \
                                 "appear in the userid_cache!" % user_name)
@@ -115,6 +118,9 @@ def get_userinfo(user_id=None):
     cache = get_userinfo_cache()
     if user_id is None:
         user_id = get_userid()
+    if user_id not in cache:
+        # It may have been added since the cache was loaded
+        cache = get_userinfo_cache(update=True)
     if user_id not in cache:
         raise errors.UnrecognizedValueError("The user ID (%d) does not " \
                                 "appear in the userinfo_cache!" % user_id)
@@ -186,6 +192,9 @@ def get_pulsaraliases(pulsar_id):
             pulsar_aliases: The aliases of the pulsar.
     """
     cache = get_pulsaralias_cache()
+    if pulsar_id not in cache:
+        # It may have been added since the cache was loaded
+        cache = get_pulsaralias_cache(update=True)
     if pulsar_id not in cache:
         raise errors.UnrecognizedValueError("The pulsar ID (%d) does not " \
                                 "appear in the pulsaralias_cache!" % pulsar_id)
@@ -234,6 +243,9 @@ def get_pulsarname(pulsar_id):
             pulsar_name: The preferred name of the pulsar.
     """
     cache = get_pulsarname_cache()
+    if pulsar_id not in cache:
+        # It may have been added since the cache was loaded
+        cache = get_pulsarname_cache(update=True)
     if pulsar_id not in cache:
         raise errors.UnrecognizedValueError("The pulsar ID (%d) does not " \
                                 "appear in the pulsarname_cache!" % pulsar_id)
@@ -263,6 +275,9 @@ def get_pulsarid(alias):
             pulsar_id: The corresponding pulsar_id value.
     """
     cache = get_pulsarid_cache()
+    if alias not in cache:
+        # It may have been added since the cache was loaded
+        cache = get_pulsarid_cache(update=True)
     if alias in cache:
         pulsar_id = cache[alias]
     else:
@@ -338,6 +353,9 @@ def get_obssysid(obssys_key):
         # Cast all strings to lowercase
         obssys_key = tuple([xx.lower() for xx in obssys_key])
     cache = get_obssystemid_cache()
+    if obssys_key not in cache:
+        # It may have been added since the cache was loaded
+        cache = get_obssystemid_cache(update=True)
     if obssys_key not in cache:
         raise errors.UnrecognizedValueError("The observing system (%s) " \
                                 "does not appear in the obssysid_cache!" % \
@@ -389,6 +407,9 @@ def get_obssysinfo(obssys_id):
                 system's info.
     """
     cache = get_obssysinfo_cache()
+    if obssys_id not in cache:
+        # It may have been added since the cache was loaded
+        cache = get_obssysinfo_cache(update=True)
     if obssys_id not in cache:
         raise errors.UnrecognizedValueError("The observing system ID (%d) " \
                             "does not appear in the obssysinfo_cache!" % \
@@ -455,6 +476,9 @@ def get_telescope_info(alias):
     if hasattr(alias, 'lower'):
         alias = alias.lower() # cast strings to lower case
     cache = get_telescopeinfo_cache()
+    if alias not in cache:
+        # It may have been added since the cache was loaded
+        cache = get_telescopeinfo_cache(update=True)
     if alias not in cache:
         raise errors.UnrecognizedValueError("The telescope alias (%s) " \
                             "does not appear in the telescopeinfo_cache!" % \
@@ -2,13 +2,17 @@ import hashlib
 import warnings
 import os.path
 import shutil
+import tempfile
+import json
 import re
 
 from toaster import config
 from toaster import errors
 from toaster import utils
+from toaster import database
 from toaster.utils import notify
 from toaster.utils import cache
+from toaster.utils import backends
 from toaster.toolkit.pulsars import add_pulsar
 
 header_param_types = {'freq': float,
@@ -28,6 +32,29 @@ header_param_types = {'freq': float,
                       'tbin': float}
 
 
+# The header params 'prep_file' reads from each file
+PREP_HEADER_ITEMS = ["nbin", "nchan", "npol", "nsub", "type", "telescop",
+                     "name", "dec", "ra", "freq", "bw", "dm", "rm",
+                     # The names of these header params
+                     # vary with psrchive version
+                     # "dmc", "rm_c", "pol_c",
+                     "scale", "state", "length",
+                     "rcvr", "basis", "backend", "mjd"]
+
+# The maximum number of files to read the headers of with a single 'vap'
+HEADER_BATCH_SIZE = 100
+
+# Header params already read, keyed by absolute file name.
+# Values are (stamp, params) tuples, where 'stamp' is the file's
+# (inode, size, modification time) when it was read. Entries read
+# in batches (see 'get_header_vals_batch') are also stored in the
+# 'header_cache' DB table (see 'persistent_header_cache' in the
+# config file).
+header_cache = {}
+
+layout_key_re = re.compile(r"%\(([^)]+)\)")
+
+
 def verify_file_path(fn):
     #Verify that file exists
     notify.print_info("Verifying file: %s" % fn, 2)
@@ -40,35 +67,271 @@ def verify_file_path(fn):
     return file_path, file_name
 
 
-def get_header_vals(fn, hdritems):
-    """Get a set of header params from the given file.
-        Returns a dictionary.
+def get_file_stamp(fn):
+    """Return a stamp identifying the current version of a file.
+
+        Input:
+            fn: The name of the file.
+
+        Output:
+            stamp: A (inode, size, modification time) tuple.
+    """
+    st = os.stat(fn)
+    return (st.st_ino, st.st_size, st.st_mtime)
+
+
+def get_path_hash(fn):
+    """Return the hash identifying a file in the 'header_cache'
+        DB table.
+
+        Input:
+            fn: The name of the file.
+
+        Output:
+            pathhash: The SHA-1 of the file's absolute path.
+    """
+    return hashlib.sha1(os.path.abspath(fn).encode('utf-8')).hexdigest()
+
+
+def use_persistent_header_cache(fn):
+    """Return True if the header params of a file should be
+        kept in the 'header_cache' DB table. Temporary files
+        (e.g. the pipeline's manipulated archives) are not.
+
+        Input:
+            fn: The name of the file.
+
+        Output:
+            persist: True if the DB table should be used.
+    """
+    if not config.cfg.persistent_header_cache:
+        return False
+    path = os.path.abspath(fn)
+    for tmpdir in (config.cfg.base_tmp_dir, config.cfg.scratch_fast_dir,
+                   tempfile.gettempdir()):
+        if tmpdir and path.startswith(os.path.join(os.path.abspath(tmpdir),
+                                                   '')):
+            return False
+    return True
+
+
+def load_persistent_header_vals(fns, existdb=None):
+    """Load header params of files from the 'header_cache' DB
+        table into memory. Entries stored before a file was last
+        modified are ignored.
 
         Inputs:
-            fn: The name of the file to get params for.
-            hdritems: List of parameters (recognized by vap) to fetch.
+            fns: The names of the files.
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
 
         Output:
-            params: A dictionary. The keys are values requested from 'vap'
-                the values are the values reported by 'vap'.
+            nloaded: The number of files whose header params were loaded.
+    """
+    stamps = {}
+    for fn in fns:
+        if use_persistent_header_cache(fn):
+            stamps[get_path_hash(fn)] = (fn, get_file_stamp(fn))
+    if not stamps:
+        return 0
+
+    db = existdb or database.Database()
+    db.connect()
+    rows = []
+    pathhashes = list(stamps.keys())
+    for ii in range(0, len(pathhashes), HEADER_BATCH_SIZE):
+        select = db.select([db.header_cache.c.path_hash,
+                            db.header_cache.c.inode,
+                            db.header_cache.c.filesize,
+                            db.header_cache.c.mtime,
+                            db.header_cache.c.header]).\
+                    where(db.header_cache.c.path_hash.in_(
+                                pathhashes[ii:ii+HEADER_BATCH_SIZE]))
+        result = db.execute(select)
+        rows.extend(result.fetchall())
+        result.close()
+    if not existdb:
+        db.close()
+
+    nloaded = 0
+    for row in rows:
+        fn, stamp = stamps[row['path_hash']]
+        if (row['inode'], row['filesize'], row['mtime']) != stamp:
+            # File has changed since
+            continue
+        params = {}
+        for key, val in json.loads(row['header']).items():
+            key = str(key)
+            if val is not None:
+                # Get param's type to cast value
+                val = header_param_types.get(key, str)(val)
+            params[key] = val
+        key = os.path.abspath(fn)
+        if key in header_cache and header_cache[key][0] == stamp:
+            params.update(header_cache[key][1])
+        header_cache[key] = (stamp, params)
+        nloaded += 1
+    notify.print_debug("Loaded cached header params of %d of %d files "
+                       "from the DB" % (nloaded, len(stamps)), 'headers')
+    return nloaded
+
+
+def store_persistent_header_vals(fns, existdb=None):
+    """Store the header params of files that are in memory in the
+        'header_cache' DB table, replacing any existing entries.
+
+        Inputs:
+            fns: The names of the files.
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+
+        Outputs:
+            None
+    """
+    values = []
+    for fn in fns:
+        key = os.path.abspath(fn)
+        if key not in header_cache or not use_persistent_header_cache(fn):
+            continue
+        (inode, size, mtime), params = header_cache[key]
+        path, name = os.path.split(key)
+        values.append({'path_hash': get_path_hash(fn),
+                       'filename': name,
+                       'filepath': path,
+                       'inode': inode,
+                       'filesize': size,
+                       'mtime': mtime,
+                       'header': json.dumps(params, sort_keys=True)})
+    if not values:
+        return
+
+    db = existdb or database.Database()
+    db.connect()
+    # Use the caller's transaction, if there is one
+    intrans = bool(db.open_transactions)
+    if not intrans:
+        db.begin()
+    try:
+        delete = db.header_cache.delete().\
+                    where(db.header_cache.c.path_hash.in_(
+                                [vals['path_hash'] for vals in values]))
+        result = db.execute(delete)
+        result.close()
+        result = db.execute(db.header_cache.insert(), values)
+        result.close()
+    except:
+        if not intrans:
+            db.rollback()
+        raise
+    else:
+        if not intrans:
+            db.commit()
+    finally:
+        if not existdb:
+            db.close()
+
+
+def get_cached_header_vals(fn):
+    """Return the header params of a file that have already
+        been read (or loaded from the 'header_cache' DB table).
+        Params read before the file was last modified are
+        discarded.
+
+        Input:
+            fn: The name of the file.
+
+        Output:
+            params: A dictionary of header params (possibly empty).
+    """
+    key = os.path.abspath(fn)
+    if key not in header_cache:
+        return {}
+    stamp, params = header_cache[key]
+    if stamp != get_file_stamp(fn):
+        notify.print_debug("File %s has changed since its header was "
+                           "read. Discarding cached header params." % fn,
+                           'headers')
+        del header_cache[key]
+        return {}
+    return params
+
+
+def cache_header_vals(fn, params, stamp=None):
+    """Remember header params read from a file.
+
+        Inputs:
+            fn: The name of the file.
+            params: A dictionary of header params.
+            stamp: The file's stamp (see 'get_file_stamp') when the
+                params were read. (Default: the file's current stamp)
+
+        Outputs:
+            None
+    """
+    if stamp is None:
+        stamp = get_file_stamp(fn)
+    key = os.path.abspath(fn)
+    if key in header_cache and header_cache[key][0] == stamp:
+        header_cache[key][1].update(params)
+    else:
+        header_cache[key] = (stamp, dict(params))
+
+
+def clear_header_cache(fn=None, existdb=None):
+    """Forget header params that have been read. This must be
+        called when a file's header is modified in place.
+
+        Inputs:
+            fn: The file to forget the header params of.
+                (Default: forget all files' header params)
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+
+        Outputs:
+            None
+    """
+    if fn is None:
+        header_cache.clear()
+    else:
+        header_cache.pop(os.path.abspath(fn), None)
+    if not config.cfg.persistent_header_cache:
+        return
+    db = existdb or database.Database()
+    db.connect()
+    delete = db.header_cache.delete()
+    if fn is not None:
+        delete = delete.where(db.header_cache.c.path_hash ==
+                              get_path_hash(fn))
+    result = db.execute(delete)
+    result.close()
+    if not existdb:
+        db.close()
+
+
+def check_header_items(hdritems, funcname='get_header_vals'):
+    """Check a list of header params to get from files.
+        A ValueError is raised if it is unacceptable.
     """
     if not len(hdritems):
         raise ValueError("No 'hdritems' requested to get from file header!")
-    hdrstr = ",".join(hdritems)
-    if '=' in hdrstr:
-        raise ValueError("'hdritems' passed to 'get_header_vals' "
-                         "should not perform and assignments!")
-    cmd = ["vap", "-n", "-c", hdrstr, fn]
-    outstr, errstr = utils.execute(cmd)
-    outvals = outstr.split()[(0 - len(hdritems)):]  # First value is filename (we don't need it)
-    if errstr:
-        raise errors.SystemCallError("The command: %s\nprinted to stderr:\n%s" %
-                                     (cmd, errstr))
-    elif len(outvals) != len(hdritems):
-        raise errors.SystemCallError("The command: %s\nreturned the wrong "
-                                     "number of values. (Was expecting %d, got %d.)" %
-                                     (cmd, len(hdritems), len(outvals)))
-    params = HeaderParams(fn)
+    if '=' in ",".join(hdritems):
+        raise ValueError("'hdritems' passed to '%s' "
+                         "should not perform and assignments!" % funcname)
+
+
+def cast_header_vals(fn, hdritems, outvals):
+    """Convert the values reported by 'vap' for a file.
+
+        Inputs:
+            fn: The name of the file the values are from.
+            hdritems: List of parameters requested from 'vap'.
+            outvals: The values 'vap' reported (strings), in the
+                same order as 'hdritems'.
+
+        Output:
+            params: A dictionary of header params.
+    """
+    params = {}
     for key, val in zip(hdritems, outvals):
         if val == "INVALID":
             raise errors.SystemCallError("The vap header key '%s' "
@@ -85,6 +348,173 @@ def get_header_vals(fn, hdritems):
     return params
 
 
+def get_header_vals(fn, hdritems):
+    """Get a set of header params from the given file.
+        Returns a dictionary.
+
+        Params that have already been read (e.g. by
+        'prefetch_header_vals') are not read again. The
+        'header_cache' DB table isn't used, so reading a
+        single file's header never touches the DB.
+
+        Inputs:
+            fn: The name of the file to get params for.
+            hdritems: List of parameters (recognized by vap) to fetch.
+
+        Output:
+            params: A dictionary. The keys are values requested from 'vap'
+                the values are the values reported by 'vap'.
+    """
+    check_header_items(hdritems)
+    cached = get_cached_header_vals(fn)
+    missing = [key for key in hdritems if key not in cached]
+    if missing:
+        stamp = get_file_stamp(fn)
+        outvals = backends.get_backend().read_header(fn, missing)
+        newvals = cast_header_vals(fn, missing, outvals)
+        cache_header_vals(fn, newvals, stamp)
+        cached = dict(cached)
+        cached.update(newvals)
+    else:
+        notify.print_debug("Using cached header params of %s" % fn,
+                           'headers')
+    params = HeaderParams(fn)
+    for key in hdritems:
+        params[key] = cached[key]
+    return params
+
+
+def get_header_vals_batch(fns, hdritems, batchsize=HEADER_BATCH_SIZE,
+                          existdb=None):
+    """Get a set of header params from each of the given files,
+        reading the headers of many files with each 'vap' command.
+
+        Params that have already been read, or that are stored in
+        the 'header_cache' DB table, are not read again. Params that
+        are read are stored in the DB table.
+        Files that cannot be read are skipped (use 'get_header_vals'
+        to get the reason).
+
+        Inputs:
+            fns: The names of the files to get params for.
+            hdritems: List of parameters (recognized by vap) to fetch.
+            batchsize: The maximum number of files to read with a
+                single 'vap' command. (Default: HEADER_BATCH_SIZE)
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+
+        Output:
+            allparams: A dictionary, keyed by file name, of dictionaries
+                of header params.
+    """
+    check_header_items(hdritems, 'get_header_vals_batch')
+    fns = [fn for fn in fns if os.path.isfile(fn)]
+    load_persistent_header_vals([fn for fn in fns
+                                 if os.path.abspath(fn) not in header_cache],
+                                existdb=existdb)
+    toread = []
+    for fn in fns:
+        cached = get_cached_header_vals(fn)
+        if [key for key in hdritems if key not in cached]:
+            toread.append(fn)
+
+    for ii in range(0, len(toread), batchsize):
+        batch = toread[ii:ii+batchsize]
+        stamps = dict([(fn, get_file_stamp(fn)) for fn in batch])
+        # Files that cannot be read are skipped. They will be
+        # read (and their errors reported) on their own later.
+        outvals = backends.get_backend().read_headers(batch, hdritems)
+        for fn in batch:
+            if fn in outvals:
+                cache_header_vals(fn, cast_header_vals(fn, hdritems,
+                                                       outvals[fn]),
+                                  stamps[fn])
+        store_persistent_header_vals(list(outvals.keys()), existdb=existdb)
+        notify.print_debug("Read headers of %d of %d files in a single "
+                           "batch" % (len(outvals), len(batch)), 'headers')
+
+    allparams = {}
+    for fn in fns:
+        cached = get_cached_header_vals(fn)
+        if not [key for key in hdritems if key not in cached]:
+            params = HeaderParams(fn)
+            for key in hdritems:
+                params[key] = cached[key]
+            allparams[fn] = params
+    return allparams
+
+
+def get_layout_header_items(layout=None):
+    """Return the header params used by the data archive layout.
+
+        Input:
+            layout: The layout. (Default: use the 'data_archive_layout'
+                listed in the config file)
+
+        Output:
+            hdritems: List of header params (recognized by vap). Only
+                params that are known header params are included.
+    """
+    if layout is None:
+        layout = config.cfg.data_archive_layout
+    known = PREP_HEADER_ITEMS + [key for key in sorted(header_param_types)
+                                 if key not in PREP_HEADER_ITEMS]
+    hdritems = []
+    for key in layout_key_re.findall(layout):
+        # Strip the filters 'FancyParams' understand
+        if key.startswith("date:"):
+            key = 'mjd'
+        elif key.endswith("_L") or key.endswith("_U"):
+            key = key[:-2]
+        elif toround_re.search(key):
+            key = key.rpartition('_R')[0]
+        if key not in known:
+            # Possibly an abbreviation
+            matches = [k for k in known if k.startswith(key)]
+            if len(matches) != 1:
+                continue
+            key = matches[0]
+        if key not in hdritems:
+            hdritems.append(key)
+    return hdritems
+
+
+def get_prep_header_items():
+    """Return the header params 'prep_file' reads, including those
+        needed to find the file's place in the data archive.
+
+        Inputs:
+            None
+
+        Output:
+            hdritems: List of header params (recognized by vap).
+    """
+    return PREP_HEADER_ITEMS + [key for key in get_layout_header_items()
+                                if key not in PREP_HEADER_ITEMS]
+
+
+def prefetch_header_vals(fns, hdritems=None, existdb=None):
+    """Read the headers of many files at once, so they needn't be
+        read one file at a time later (e.g. by 'prep_file').
+
+        Inputs:
+            fns: The names of the files.
+            hdritems: List of parameters (recognized by vap) to fetch.
+                (Default: the params 'prep_file' reads)
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+
+        Output:
+            nread: The number of files whose headers are available.
+    """
+    if hdritems is None:
+        hdritems = get_prep_header_items()
+    allparams = get_header_vals_batch(fns, hdritems, existdb=existdb)
+    notify.print_info("Read headers of %d of %d files" %
+                      (len(allparams), len(fns)), 2)
+    return len(allparams)
+
+
 def parse_psrfits_header(fn, hdritems):
     """Get a set of header params from the given file.
         Returns a dictionary.
@@ -140,16 +570,8 @@ def prep_file(fn):
     if not os.access(fn, os.R_OK):
         raise errors.FileError("File (%s) is not readable!" % fn)
 
-    # Grab header info
-    hdritems = ["nbin", "nchan", "npol", "nsub", "type", "telescop",
-                "name", "dec", "ra", "freq", "bw", "dm", "rm",
-                # The names of these header params
-                # vary with psrchive version
-                # "dmc", "rm_c", "pol_c",
-                "scale", "state", "length",
-                "rcvr", "basis", "backend", "mjd"]
-
-    params = get_header_vals(fn, hdritems)
+    # Grab header info (including what's needed to archive the file)
+    params = get_header_vals(fn, get_prep_header_items())
     params['user_id'] = cache.get_userid()
 
     # Normalise telescope name
@@ -299,7 +721,11 @@ def get_archive_dir(fn, data_archive_location=None, params=None):
     if data_archive_location is None:
         data_archive_location = config.cfg.data_archive_location
     if params is None:
-        params = get_header_vals(fn, [])
+        hdritems = get_layout_header_items()
+        if hdritems:
+            params = get_header_vals(fn, hdritems)
+        else:
+            params = HeaderParams(fn)
 
     subdir = config.cfg.data_archive_layout % params
     archivedir = os.path.join(data_archive_location, subdir)
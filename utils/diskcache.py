@@ -0,0 +1,326 @@
+"""A size-bounded, content-addressed cache of files on disk.
+
+    Entries are identified by a key (any string, usually built from
+    the MD5 sums of the inputs and the parameters used to make the
+    file). Each entry is stored as a file named after the SHA-1 of
+    its key. Entries are added atomically (by renaming into
+    place), so several processes can share a cache directory.
+
+    When the cache grows larger than its maximum size the least
+    recently used entries are removed. Using an entry updates its
+    modification time, which is what is used to order entries.
+
+    Files are reflinked (see 'staging.reflink') in and out of the
+    cache where the filesystem supports it, and copied otherwise.
+    They are never hardlinked: an entry that shared its inode with
+    another file would share its modification time too, so using the
+    entry would touch the other file, and adding a hardlink to an old
+    file would make the new entry look stale.
+"""
+import os
+import os.path
+import errno
+import hashlib
+import tempfile
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from toaster import errors
+from toaster.utils import notify
+from toaster.utils import staging
+
+# Suffix of files being added to the cache
+PARTIAL_SUFFIX = '.partial'
+
+
+class DiskCache(object):
+    """A directory of files, identified by key, with
+        least-recently-used eviction.
+    """
+    def __init__(self, cachedir, maxsize, name='disk'):
+        """Constructor for DiskCache objects.
+
+            Inputs:
+                cachedir: The directory containing the cache.
+                    It is created if it doesn't exist.
+                maxsize: The maximum total size of the cached
+                    files, in bytes.
+                name: A name for the cache (used in messages).
+                    (Default: 'disk')
+
+            Output:
+                cache: The DiskCache object.
+        """
+        self.cachedir = os.path.abspath(os.path.expanduser(cachedir))
+        self.maxsize = maxsize
+        self.name = name
+        if not os.path.isdir(self.cachedir):
+            try:
+                os.makedirs(self.cachedir)
+            except OSError as exc:
+                # Another process may have created it
+                if exc.errno != errno.EEXIST:
+                    raise errors.FileError("Cannot create %s cache "
+                                           "directory (%s): %s" %
+                                           (self.name, self.cachedir,
+                                            exc.strerror))
+
+    def get_path(self, key):
+        """Return the path of the entry for a key (whether or
+            not it exists).
+
+            Input:
+                key: The entry's key.
+
+            Output:
+                path: The entry's file name.
+        """
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cachedir, digest[:2], digest[2:])
+
+    def fetch(self, key, dest):
+        """Stage the entry for a key as 'dest'.
+
+            Inputs:
+                key: The entry's key.
+                dest: The name of the staged file.
+
+            Output:
+                hit: True if the entry was found and staged.
+        """
+        path = self.get_path(key)
+        try:
+            # Mark it as recently used
+            os.utime(path, None)
+            staging.stage_file(path, dest, method='reflink')
+        except (OSError, IOError) as exc:
+            # The entry doesn't exist, or was just evicted
+            if exc.errno != errno.ENOENT:
+                raise
+            notify.print_debug("%s cache miss: %s" % (self.name, key),
+                               'diskcache')
+            return False
+        notify.print_debug("%s cache hit: %s (%s)" % (self.name, key, path),
+                           'diskcache')
+        return True
+
+    def lookup(self, key):
+        """Return the path of the entry for a key, if it exists,
+            and mark it as recently used.
+
+            NOTE: The entry may be evicted by another process. It
+                should be used (or staged) straight away, and must
+                not be modified.
+
+            Input:
+                key: The entry's key.
+
+            Output:
+                path: The entry's file name. None if there is no
+                    entry for the key.
+        """
+        path = self.get_path(key)
+        try:
+            os.utime(path, None)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+            notify.print_debug("%s cache miss: %s" % (self.name, key),
+                               'diskcache')
+            return None
+        notify.print_debug("%s cache hit: %s (%s)" % (self.name, key, path),
+                           'diskcache')
+        return path
+
+    def remove(self, key):
+        """Remove the entry for a key, if it exists.
+
+            Input:
+                key: The entry's key.
+
+            Outputs:
+                None
+        """
+        try:
+            os.remove(self.get_path(key))
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    def put(self, key, src, method='reflink'):
+        """Add a file to the cache (replacing any existing entry
+            for the key), then evict entries if the cache is too big.
+
+            Inputs:
+                key: The entry's key.
+                src: The file to add.
+                method: How to stage the file into the cache:
+                    'reflink' (falling back to copying), or 'copy'.
+                    Entries are never hardlinked. (Default: 'reflink')
+
+            Outputs:
+                None
+        """
+        if method not in ('reflink', 'copy'):
+            raise errors.UnrecognizedValueError("Cannot add files to the "
+                                                "%s cache with the staging "
+                                                "method '%s'. Valid methods "
+                                                "are: 'reflink', 'copy'" %
+                                                (self.name, method))
+        if os.path.getsize(src) > self.maxsize:
+            notify.print_debug("Not adding %s to %s cache. It is larger "
+                               "than the cache." % (src, self.name),
+                               'diskcache')
+            return
+        path = self.get_path(key)
+        subdir = os.path.dirname(path)
+        if not os.path.isdir(subdir):
+            try:
+                os.mkdir(subdir)
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+        tmpfd, tmpfn = tempfile.mkstemp(dir=subdir, suffix=PARTIAL_SUFFIX)
+        os.close(tmpfd)
+        try:
+            staging.stage_file(src, tmpfn, method=method)
+            os.rename(tmpfn, path)
+            # Mark it as recently used
+            os.utime(path, None)
+        except:
+            if os.path.exists(tmpfn):
+                os.remove(tmpfn)
+            raise
+        notify.print_debug("Added %s to %s cache: %s (%s)" %
+                           (src, self.name, key, path), 'diskcache')
+        self.evict()
+
+    def fetch_data(self, key):
+        """Return the contents of the entry for a key.
+
+            Input:
+                key: The entry's key.
+
+            Output:
+                data: The entry's contents (a string). None if there
+                    is no entry for the key.
+        """
+        path = self.get_path(key)
+        try:
+            os.utime(path, None)
+            with open(path, 'r') as ff:
+                data = ff.read()
+        except (OSError, IOError) as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+            notify.print_debug("%s cache miss: %s" % (self.name, key),
+                               'diskcache')
+            return None
+        notify.print_debug("%s cache hit: %s (%s)" % (self.name, key, path),
+                           'diskcache')
+        return data
+
+    def put_data(self, key, data):
+        """Add an entry with the given contents to the cache
+            (replacing any existing entry for the key).
+
+            Inputs:
+                key: The entry's key.
+                data: The entry's contents (a string).
+
+            Outputs:
+                None
+        """
+        tmpfd, tmpfn = tempfile.mkstemp(dir=self.cachedir,
+                                        suffix=PARTIAL_SUFFIX)
+        try:
+            with os.fdopen(tmpfd, 'w') as ff:
+                ff.write(data)
+            self.put(key, tmpfn)
+        finally:
+            if os.path.exists(tmpfn):
+                os.remove(tmpfn)
+
+    def get_entries(self):
+        """Return the cache's entries.
+
+            Inputs:
+                None
+
+            Output:
+                entries: A list of (last use time, size, path) tuples,
+                    oldest first.
+        """
+        entries = []
+        for subdir in os.listdir(self.cachedir):
+            subpath = os.path.join(self.cachedir, subdir)
+            if not os.path.isdir(subpath):
+                continue
+            for fn in os.listdir(subpath):
+                if fn.endswith(PARTIAL_SUFFIX):
+                    continue
+                path = os.path.join(subpath, fn)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    # Evicted by another process
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+        return entries
+
+    def get_size(self):
+        """Return the total size of the cache's entries, in bytes.
+        """
+        return sum([size for mtime, size, path in self.get_entries()])
+
+    def evict(self, maxsize=None):
+        """Remove the least recently used entries until the cache
+            is no larger than its maximum size.
+
+            Input:
+                maxsize: The size to shrink the cache to, in bytes.
+                    (Default: the cache's maximum size)
+
+            Output:
+                nremoved: The number of entries removed.
+        """
+        if maxsize is None:
+            maxsize = self.maxsize
+        lockff = open(os.path.join(self.cachedir, '.lock'), 'a')
+        try:
+            # Only one process evicts at a time
+            if fcntl is not None:
+                fcntl.flock(lockff.fileno(), fcntl.LOCK_EX)
+            entries = self.get_entries()
+            total = sum([size for mtime, size, path in entries])
+            nremoved = 0
+            for mtime, size, path in entries:
+                if total <= maxsize:
+                    break
+                try:
+                    os.remove(path)
+                except OSError as exc:
+                    if exc.errno != errno.ENOENT:
+                        raise
+                total -= size
+                nremoved += 1
+        finally:
+            lockff.close()
+        if nremoved:
+            notify.print_debug("Evicted %d entries from %s cache" %
+                               (nremoved, self.name), 'diskcache')
+        return nremoved
+
+    def clear(self):
+        """Remove all entries from the cache.
+
+            Inputs:
+                None
+
+            Output:
+                nremoved: The number of entries removed.
+        """
+        return self.evict(maxsize=0)
@@ -0,0 +1,220 @@
+"""A journal of the outcome of each line of a '--from-file' batch,
+    so an interrupted batch can be resumed.
+
+    Each line of the batch is identified by its text (without
+    comments), and how many identical lines precede it, so the list
+    can be re-ordered, or extended, between runs. When a line is
+    done, or fails, an entry is appended to the journal file and
+    flushed to disk. Entries record the ID numbers of what the line
+    loaded, or produced (e.g. 'rawfile_id', 'process_id').
+
+    When resuming, lines whose latest entry is 'done' are skipped,
+    and only the others (failed, pending when the batch died, or
+    never reached) are run again.
+"""
+import os
+import os.path
+import json
+import hashlib
+import datetime
+
+from toaster import errors
+from toaster.utils import notify
+
+JOURNAL_SUFFIX = '.journal'
+
+JOURNAL_STATUSES = ['pending', 'done', 'failed']
+
+
+def get_journal_path(from_file, journal=None):
+    """Return the journal file to use for a batch.
+
+        Inputs:
+            from_file: The batch's list of lines ('-' for stdin).
+            journal: The journal file given on the command line.
+                (Default: the list's name, with '.journal' appended)
+
+        Output:
+            path: The journal file's name. None if the batch
+                can't be journalled (i.e. it is read from stdin,
+                and no journal file is given).
+    """
+    if journal is not None:
+        return journal
+    if from_file == '-':
+        return None
+    return from_file + JOURNAL_SUFFIX
+
+
+def get_line_keys(lines):
+    """Return the key identifying each line of a batch.
+
+        Input:
+            lines: A list of lines (comments and whitespace
+                stripped).
+
+        Output:
+            keys: A list of keys, one for each line.
+    """
+    seen = {}
+    keys = []
+    for line in lines:
+        nseen = seen.get(line, 0)
+        seen[line] = nseen + 1
+        digest = hashlib.sha1(line.encode('utf-8')).hexdigest()
+        keys.append("%s:%d" % (digest, nseen))
+    return keys
+
+
+class BatchJournal(object):
+    """The journal of a '--from-file' batch.
+    """
+    def __init__(self, path, resume=False):
+        """Constructor for BatchJournal objects.
+
+            Inputs:
+                path: The journal file. None to keep no journal
+                    (entries are not written to disk).
+                resume: If True, read the entries of an existing
+                    journal, and add to it. Otherwise, start a new
+                    journal (replacing any existing one).
+                    (Default: start a new journal)
+
+            Output:
+                journal: The BatchJournal object.
+        """
+        self.entries = {}
+        self.ff = None
+        if path is None:
+            if resume:
+                raise errors.BadInputError("A journal (--journal) must be "
+                                           "given to resume a batch read "
+                                           "from stdin.")
+            self.path = None
+            return
+        self.path = os.path.abspath(path)
+        if resume:
+            if not os.path.isfile(self.path):
+                raise errors.FileError("Cannot resume batch. The journal "
+                                       "(%s) does not exist." % self.path)
+            self.read()
+            mode = 'a'
+        else:
+            if os.path.exists(self.path):
+                notify.print_info("Replacing existing journal (%s). Use "
+                                  "--resume to skip the lines it records "
+                                  "as done." % self.path, 1)
+            mode = 'w'
+        try:
+            self.ff = open(self.path, mode)
+        except IOError as exc:
+            raise errors.FileError("Cannot open journal (%s): %s" %
+                                   (self.path, exc.strerror))
+        if resume and self.truncated:
+            # Don't append to the cut-short entry
+            self.ff.write("\n")
+
+    def read(self):
+        """Read the entries of the journal file. The latest entry
+            for each line is kept.
+
+            Inputs:
+                None
+
+            Outputs:
+                None
+        """
+        self.truncated = False
+        with open(self.path, 'r') as ff:
+            for lineno, text in enumerate(ff):
+                self.truncated = not text.endswith("\n")
+                try:
+                    entry = json.loads(text)
+                except ValueError:
+                    # The last entry may have been cut short
+                    # if the batch died while it was written
+                    notify.print_debug("Ignoring bad entry on line %d of "
+                                       "journal (%s)" %
+                                       (lineno+1, self.path), 'journal')
+                    continue
+                self.entries[entry['key']] = entry
+        notify.print_debug("Read %d entries from journal (%s)" %
+                           (len(self.entries), self.path), 'journal')
+
+    def get_entry(self, key):
+        """Return the latest entry for a line.
+
+            Input:
+                key: The line's key (see 'get_line_keys').
+
+            Output:
+                entry: The entry (a dictionary). None if the
+                    line has no entry.
+        """
+        return self.entries.get(key)
+
+    def is_done(self, key):
+        """Return True if a line is recorded as done.
+
+            Input:
+                key: The line's key (see 'get_line_keys').
+
+            Output:
+                done: True if the line's latest entry is 'done'.
+        """
+        entry = self.entries.get(key)
+        return (entry is not None) and (entry['status'] == 'done')
+
+    def get_ids(self, key):
+        """Return the ID numbers recorded for a line.
+
+            Input:
+                key: The line's key (see 'get_line_keys').
+
+            Output:
+                ids: A dictionary of ID numbers (e.g. 'rawfile_id').
+                    Empty if the line has no entry.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return {}
+        return entry['ids']
+
+    def record(self, key, line, status, ids=None, message=None):
+        """Append an entry for a line to the journal, and flush
+            it to disk.
+
+            Inputs:
+                key: The line's key (see 'get_line_keys').
+                line: The line's text.
+                status: The line's outcome ('done', or 'failed'), or
+                    'pending' if it has started, but isn't done.
+                ids: A dictionary of ID numbers the line loaded, or
+                    produced. (Default: none)
+                message: A message to record (e.g. why the line
+                    failed). (Default: no message)
+
+            Outputs:
+                None
+        """
+        if status not in JOURNAL_STATUSES:
+            raise errors.UnrecognizedValueError("The journal status '%s' "
+                                                "is not recognized. Valid "
+                                                "statuses are: '%s'" %
+                                                (status, "', '".join(
+                                                            JOURNAL_STATUSES)))
+        entry = {'key': key,
+                 'line': line,
+                 'status': status,
+                 'ids': ids or {},
+                 'message': message,
+                 'time': datetime.datetime.now().isoformat()}
+        if self.ff is not None:
+            self.ff.write(json.dumps(entry, sort_keys=True) + "\n")
+            self.ff.flush()
+            os.fsync(self.ff.fileno())
+        self.entries[key] = entry
+
+    def close(self):
+        if self.ff is not None:
+            self.ff.close()
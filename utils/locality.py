@@ -0,0 +1,147 @@
+"""Where files are stored, so work can be done close to the data.
+
+    The locality of a file is the name of the host whose disks hold
+    it. It is determined from the filesystem the file is on (see
+    '/proc/mounts'):
+        - Files on network filesystems (e.g. NFS) are local to the
+            server exporting the filesystem.
+        - Files on other filesystems are local to this host.
+    The 'data_locality_map' configuration can be used to override
+    this, for paths where the mount table doesn't tell the whole
+    story (e.g. cluster filesystems, or symlinked archive trees).
+
+    Host names are shortened to their first component, and made
+    lowercase, so 'node1', 'node1.example.org' and 'NODE1' all
+    refer to the same host.
+"""
+import os
+import os.path
+import socket
+
+from toaster import config
+from toaster.utils import notify
+
+MOUNTS_FILE = "/proc/mounts"
+
+# Filesystem types whose device is 'host:/export' (or '//host/share')
+NETWORK_FSTYPES = set(['nfs', 'nfs4', 'cifs', 'smbfs', 'smb3',
+                       'afs', 'fuse.sshfs', 'glusterfs', 'ceph'])
+
+# Mount table, as (mountpoint, device, fstype) tuples, longest
+# mountpoint first
+mounts_cache = []
+
+
+def normalise_host(host):
+    """Return a host name in the form used for localities.
+
+        Input:
+            host: The host name.
+
+        Output:
+            locality: The normalised name.
+    """
+    return host.split('.')[0].lower()
+
+
+def get_host_locality():
+    """Return the locality of this host.
+
+        Inputs:
+            None
+
+        Output:
+            locality: The normalised name of this host.
+    """
+    return normalise_host(socket.gethostname())
+
+
+def get_mounts(update=False):
+    """Return the mount table.
+
+        Input:
+            update: If True, read the mount table again, even if
+                it has already been read. (Default: Don't update)
+
+        Output:
+            mounts: A list of (mountpoint, device, fstype) tuples,
+                longest mountpoint first.
+    """
+    global mounts_cache
+    if update or not mounts_cache:
+        mounts = []
+        if os.path.isfile(MOUNTS_FILE):
+            with open(MOUNTS_FILE, 'r') as ff:
+                for line in ff:
+                    fields = line.split()
+                    if len(fields) < 3:
+                        continue
+                    # Spaces (etc.) in paths are octal-escaped
+                    device, mountpoint, fstype = \
+                            [field.replace('\\040', ' ').replace('\\011', '\t')
+                             for field in fields[:3]]
+                    mounts.append((mountpoint, device, fstype))
+        mounts.sort(key=lambda mount: len(mount[0]), reverse=True)
+        mounts_cache = mounts
+    return mounts_cache
+
+
+def get_mount(path):
+    """Return the mount that a path is on.
+
+        Input:
+            path: The path.
+
+        Output:
+            mount: A (mountpoint, device, fstype) tuple. None if
+                the mount can't be determined.
+    """
+    path = os.path.realpath(path)
+    for mountpoint, device, fstype in get_mounts():
+        if (path == mountpoint) or \
+                path.startswith(os.path.join(mountpoint, '')):
+            return (mountpoint, device, fstype)
+    return None
+
+
+def get_path_locality(path):
+    """Return the locality of a path (i.e. the host whose
+        disks hold it).
+
+        Input:
+            path: The path.
+
+        Output:
+            locality: The normalised host name. None if it can't
+                be determined.
+    """
+    abspath = os.path.abspath(path)
+    localmap = config.cfg.data_locality_map or {}
+    for prefix in sorted(localmap, key=len, reverse=True):
+        if (abspath == prefix) or \
+                abspath.startswith(os.path.join(prefix, '')):
+            return normalise_host(localmap[prefix])
+
+    mount = get_mount(abspath)
+    if mount is None:
+        return None
+    mountpoint, device, fstype = mount
+    if fstype in NETWORK_FSTYPES:
+        if device.startswith('//'):
+            # e.g. '//host/share'
+            host = device[2:].split('/')[0]
+        elif ':' in device:
+            # e.g. 'host:/export'
+            host = device.split(':')[0]
+        else:
+            notify.print_debug("Cannot determine the server of %s "
+                               "(device: %s, type: %s)" %
+                               (path, device, fstype), 'locality')
+            return None
+        locality = normalise_host(host)
+    else:
+        locality = get_host_locality()
+    notify.print_debug("%s is local to %s (mounted on %s from %s, type: %s)" %
+                       (path, locality, mountpoint, device, fstype),
+                       'locality')
+    return locality
@@ -0,0 +1,250 @@
+"""Profiling of TOASTER programs.
+
+    Profiling is turned on with the '--profile[=OUT]' option that
+    'utils.DefaultArguments' adds to every program. It starts as
+    soon as the command line is parsed, so it covers the program's
+    'main', and the results are written when the program exits:
+        OUT: Statistics (a 'pstats' file for the 'cprofile' mode,
+            a text table for the 'sampling' mode).
+        OUT.collapsed: Collapsed stacks ('frame1;frame2;... count'),
+            suitable for making flamegraphs (e.g. with
+            'flamegraph.pl').
+    The top functions are also printed to stderr.
+
+    The 'sampling' profiler records the stack of the main thread at
+    regular wall-clock intervals. Its overhead is low, and time spent
+    waiting for external commands (e.g. 'pam', 'pat') is attributed
+    to the functions that ran them. It requires 'signal.setitimer'
+    (i.e. Unix). Otherwise, the deterministic 'cProfile' is used.
+"""
+import sys
+import os
+import os.path
+import atexit
+import signal
+import time
+import collections
+try:
+    import cProfile as profile
+except ImportError:
+    import profile
+import pstats
+
+# Wall-clock seconds between samples of the 'sampling' profiler
+SAMPLING_INTERVAL = 0.005
+
+PROFILE_MODES = ['auto', 'sampling', 'cprofile']
+
+# The active profiler (if any)
+active = {}
+
+
+def get_frame_label(frame):
+    """Return a label describing a stack frame's function.
+    """
+    code = frame.f_code
+    return "%s (%s:%d)" % (code.co_name,
+                           os.path.basename(code.co_filename),
+                           code.co_firstlineno)
+
+
+class SamplingProfiler(object):
+    """A statistical profiler that periodically records the stack.
+    """
+    def __init__(self, interval=SAMPLING_INTERVAL):
+        self.interval = interval
+        self.stacks = collections.defaultdict(int)
+        self.nsamples = 0
+        self.start_time = None
+        self.wall = 0.0
+
+    def _sample(self, signum, frame):
+        # Signals are only handled between bytecodes, so samples
+        # that are due while blocked (e.g. waiting for an external
+        # command) are coalesced. Weight by the elapsed time instead.
+        now = time.time()
+        weight = max(1, int((now - self.last_sample)/self.interval + 0.5))
+        self.last_sample = now
+        stack = []
+        while frame is not None:
+            stack.append(get_frame_label(frame))
+            frame = frame.f_back
+        self.stacks[tuple(reversed(stack))] += weight
+        self.nsamples += weight
+
+    def enable(self):
+        self.start_time = time.time()
+        self.last_sample = self.start_time
+        signal.signal(signal.SIGALRM, self._sample)
+        # Restart system calls interrupted by samples. Some
+        # (e.g. 'select', and so 'time.sleep' in Python 2) are
+        # never restarted. Use 'utils.sleep' to wait.
+        signal.siginterrupt(signal.SIGALRM, False)
+        signal.setitimer(signal.ITIMER_REAL, self.interval, self.interval)
+
+    def disable(self):
+        signal.setitimer(signal.ITIMER_REAL, 0, 0)
+        signal.signal(signal.SIGALRM, signal.SIG_DFL)
+        self.wall = time.time() - self.start_time
+
+    def get_function_stats(self):
+        """Return the number of samples in which each function
+            was executing (self), or on the stack (total).
+
+            Inputs:
+                None
+
+            Output:
+                stats: A dictionary, keyed by function label, of
+                    (self samples, total samples) tuples.
+        """
+        selfcounts = collections.defaultdict(int)
+        totcounts = collections.defaultdict(int)
+        for stack, count in self.stacks.items():
+            selfcounts[stack[-1]] += count
+            for label in set(stack):
+                totcounts[label] += count
+        return dict((label, (selfcounts[label], totcounts[label]))
+                    for label in totcounts)
+
+    def write_stats(self, outfn):
+        stats = self.get_function_stats()
+        with open(outfn, 'w') as ff:
+            ff.write("# %d samples, every %g s, over %.3f s\n" %
+                     (self.nsamples, self.interval, self.wall))
+            ff.write("# %10s %10s  %s\n" % ("self", "total", "function"))
+            for label in sorted(stats, key=lambda label: stats[label][1],
+                                reverse=True):
+                ff.write("%12d %10d  %s\n" % (stats[label] + (label,)))
+
+    def write_collapsed(self, outfn):
+        with open(outfn, 'w') as ff:
+            for stack, count in sorted(self.stacks.items()):
+                ff.write("%s %d\n" % (";".join(stack), count))
+
+    def format_top(self, ntop):
+        stats = self.get_function_stats()
+        lines = ["Sampling profile: %d samples over %.3f s" %
+                 (self.nsamples, self.wall),
+                 "%8s %8s  %s" % ("self %", "total %", "function")]
+        nsamples = float(max(self.nsamples, 1))
+        for label in sorted(stats, key=lambda label: stats[label][0],
+                            reverse=True)[:ntop]:
+            lines.append("%8.1f %8.1f  %s" %
+                         (100*stats[label][0]/nsamples,
+                          100*stats[label][1]/nsamples, label))
+        return "\n".join(lines)
+
+
+class DeterministicProfiler(object):
+    """A wrapper around 'cProfile' with the same interface
+        as 'SamplingProfiler'.
+    """
+    def __init__(self):
+        self.profiler = profile.Profile()
+
+    def enable(self):
+        self.profiler.enable()
+
+    def disable(self):
+        self.profiler.disable()
+
+    def write_stats(self, outfn):
+        self.profiler.dump_stats(outfn)
+
+    def write_collapsed(self, outfn):
+        # cProfile only knows about caller/callee pairs, so
+        # each line is a stack of (at most) two frames
+        self.profiler.create_stats()
+        with open(outfn, 'w') as ff:
+            for func, (cc, nc, tt, ct, callers) in \
+                    sorted(self.profiler.stats.items()):
+                label = "%s (%s:%d)" % (func[2], os.path.basename(func[0]),
+                                        func[1])
+                if not callers:
+                    weight = int(tt*1e6)
+                    if weight:
+                        ff.write("%s %d\n" % (label, weight))
+                for caller, callerstats in sorted(callers.items()):
+                    weight = int(callerstats[2]*1e6)
+                    if weight:
+                        callerlabel = "%s (%s:%d)" % \
+                                (caller[2], os.path.basename(caller[0]),
+                                 caller[1])
+                        ff.write("%s;%s %d\n" % (callerlabel, label, weight))
+
+    def format_top(self, ntop):
+        try:
+            from StringIO import StringIO
+        except ImportError:
+            from io import StringIO
+        stream = StringIO()
+        stats = pstats.Stats(self.profiler, stream=stream)
+        stats.sort_stats('cumulative').print_stats(ntop)
+        return stream.getvalue()
+
+
+def start(outfn=None, ntop=20, mode='auto'):
+    """Start profiling. Results are written when the program exits
+        (or when 'finish' is called).
+
+        Inputs:
+            outfn: The name of the statistics file. The collapsed
+                stacks are written to the same name, with the suffix
+                '.collapsed'. (Default: '<program>.<pid>.prof')
+            ntop: The number of functions to print. (Default: 20)
+            mode: 'sampling', 'cprofile', or 'auto' (i.e. 'sampling'
+                if available). (Default: 'auto')
+
+        Outputs:
+            None
+    """
+    if active:
+        # Already profiling
+        return
+    if mode not in PROFILE_MODES:
+        raise ValueError("Unrecognized profiling mode '%s'. Valid "
+                         "modes are: '%s'" % (mode, "', '".join(PROFILE_MODES)))
+    if mode == 'auto':
+        if hasattr(signal, 'setitimer') and hasattr(signal, 'SIGALRM'):
+            mode = 'sampling'
+        else:
+            mode = 'cprofile'
+    if not outfn:
+        prog = os.path.basename(sys.argv[0]) if sys.argv else 'toaster'
+        outfn = "%s.%d.prof" % (os.path.splitext(prog)[0], os.getpid())
+    if mode == 'sampling':
+        profiler = SamplingProfiler()
+    else:
+        profiler = DeterministicProfiler()
+    active.update({'profiler': profiler,
+                   'outfn': os.path.abspath(outfn),
+                   'ntop': ntop})
+    profiler.enable()
+
+
+def finish():
+    """Stop profiling, and write and print the results.
+
+        Inputs:
+            None
+
+        Outputs:
+            None
+    """
+    if not active:
+        return
+    profiler = active['profiler']
+    outfn = active['outfn']
+    ntop = active['ntop']
+    active.clear()
+    profiler.disable()
+    profiler.write_stats(outfn)
+    profiler.write_collapsed(outfn + ".collapsed")
+    sys.stderr.write(profiler.format_top(ntop) + "\n")
+    sys.stderr.write("Profile written to %s (collapsed stacks: %s)\n" %
+                     (outfn, outfn + ".collapsed"))
+    sys.stderr.flush()
+
+
+atexit.register(finish)
@@ -0,0 +1,382 @@
+"""Scratch space for the temporary files of processing jobs.
+
+    Each job reserves the scratch space it expects to need (see
+    'estimate_scratch_size') before creating its temporary files,
+    and gets a private directory to create them in. There are two
+    tiers of scratch space:
+        fast: A RAM disk (e.g. tmpfs), for jobs whose files are no
+            larger than 'scratch_fast_max_size' in total.
+            Disabled unless 'scratch_fast_dir' is set.
+        disk: 'base_tmp_dir' (or the system's temporary directory),
+            for larger jobs, and when the fast tier is full.
+
+    The space reserved on each tier, by all the jobs on this host, is
+    recorded in a ledger file in the tier's directory. Each host has
+    its own ledger (named after the host), so quotas are per host even
+    if the directory is shared, and a host only ever has to check
+    whether its own processes are still alive. Jobs that would
+    take a tier over its quota ('scratch_fast_quota',
+    'scratch_disk_quota') wait until other jobs release enough space
+    (back-pressure), rather than filling the disk.
+
+    A job's directory is removed when its space is released, when
+    the program exits, or, if the program died, by the next job to
+    reserve space on the tier.
+"""
+import os
+import os.path
+import errno
+import json
+import time
+import atexit
+import shutil
+import socket
+import tempfile
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from toaster import config
+from toaster import utils
+from toaster import errors
+from toaster.utils import notify
+
+TIERS = ['fast', 'disk']
+
+# Name of the ledger files in each tier's directory (followed
+# by the host's name, see 'get_ledger_path')
+LEDGER_NAME = '.toaster_scratch_ledger'
+
+# Seconds between checks for free space while waiting
+SCRATCH_POLL_INTERVAL = 5
+
+# Scratch spaces reserved by this process, keyed by reservation ID
+active = {}
+
+
+def estimate_scratch_size(filesizes):
+    """Return the scratch space needed to process some raw files
+        together (e.g. a batch sharing a call to 'pat').
+
+        Each raw file's manipulated archive is kept until TOAs are
+        generated. While one file is manipulated, it needs up to
+        two more copies (the archive the ephemeris is installed in,
+        and the manipulator's working copy).
+
+        Input:
+            filesizes: A list of the sizes of the raw files, in bytes.
+
+        Output:
+            nbytes: The estimated scratch space, in bytes.
+    """
+    if not filesizes:
+        return 0
+    return sum(filesizes) + 2*max(filesizes)
+
+
+def get_tier_dir(tier):
+    """Return the directory of a scratch space tier.
+
+        Input:
+            tier: The tier's name.
+
+        Output:
+            tierdir: The directory. None if the tier is disabled.
+    """
+    if tier == 'fast':
+        return config.cfg.scratch_fast_dir
+    elif tier == 'disk':
+        return config.cfg.base_tmp_dir or tempfile.gettempdir()
+    else:
+        raise errors.UnrecognizedValueError("The scratch space tier '%s' "
+                                            "is not recognized. Valid "
+                                            "tiers are: '%s'" %
+                                            (tier, "', '".join(TIERS)))
+
+
+def get_tier_quota(tier):
+    """Return the quota of a scratch space tier, in bytes.
+
+        Input:
+            tier: The tier's name.
+
+        Output:
+            quota: The quota. None if there is no quota.
+    """
+    if tier == 'fast':
+        return config.cfg.scratch_fast_quota
+    return config.cfg.scratch_disk_quota
+
+
+def get_candidate_tiers(nbytes):
+    """Return the tiers that scratch space of a given size may be
+        reserved on, in order of preference.
+
+        Input:
+            nbytes: The size of the scratch space, in bytes.
+
+        Output:
+            tiers: A list of tier names.
+    """
+    tiers = []
+    if config.cfg.scratch_fast_dir and \
+            (nbytes <= config.cfg.scratch_fast_max_size):
+        tiers.append('fast')
+    tiers.append('disk')
+    return tiers
+
+
+def get_free_space(path):
+    """Return the free space on the filesystem containing a path.
+
+        Input:
+            path: The path.
+
+        Output:
+            nbytes: The space available to unprivileged users, in bytes.
+    """
+    st = os.statvfs(path)
+    return st.f_bavail*st.f_frsize
+
+
+def get_ledger_path(tierdir):
+    """Return the path of this host's ledger of a tier.
+
+        Input:
+            tierdir: The tier's directory.
+
+        Output:
+            fn: The ledger's file name.
+    """
+    return os.path.join(tierdir, "%s.%s" % (LEDGER_NAME,
+                                            socket.gethostname()))
+
+
+def is_alive(entry):
+    """Return True if the process that made a ledger entry is
+        still running. Entries made on other hosts (which aren't
+        in this host's ledger) are assumed to be alive.
+    """
+    if entry['host'] != socket.gethostname():
+        return True
+    try:
+        os.kill(entry['pid'], 0)
+    except OSError as exc:
+        return exc.errno == errno.EPERM
+    return True
+
+
+class Ledger(object):
+    """The reservations of scratch space on a tier by this host,
+        shared by all its processes through a locked file. Use in a
+        'with' statement; the ledger is locked inside the block.
+    """
+    def __init__(self, tierdir):
+        self.fn = get_ledger_path(tierdir)
+        self.ff = None
+        self.entries = {}
+
+    def __enter__(self):
+        self.ff = open(self.fn, 'a+')
+        if fcntl is not None:
+            fcntl.flock(self.ff.fileno(), fcntl.LOCK_EX)
+        self.ff.seek(0)
+        text = self.ff.read()
+        try:
+            self.entries = json.loads(text) if text.strip() else {}
+        except ValueError:
+            notify.print_debug("Ignoring corrupt scratch space ledger "
+                               "(%s)" % self.fn, 'scratch')
+            self.entries = {}
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        try:
+            if exc_type is None:
+                self.ff.seek(0)
+                self.ff.truncate()
+                self.ff.write(json.dumps(self.entries, sort_keys=True))
+                self.ff.flush()
+        finally:
+            # Closing the file releases the lock
+            self.ff.close()
+            self.ff = None
+
+    def purge(self):
+        """Remove the entries (and directories) of processes that
+            have died.
+        """
+        for resid in list(self.entries.keys()):
+            entry = self.entries[resid]
+            if is_alive(entry):
+                continue
+            notify.print_debug("Removing scratch space left by process %d "
+                               "(%s, %d bytes)" %
+                               (entry['pid'], entry['path'],
+                                entry['nbytes']), 'scratch')
+            shutil.rmtree(entry['path'], ignore_errors=True)
+            del self.entries[resid]
+
+    def get_used(self):
+        return sum([entry['nbytes'] for entry in self.entries.values()])
+
+
+class ScratchSpace(object):
+    """A private directory for a job's temporary files, with
+        space reserved for them. Use in a 'with' statement, or
+        call 'release' when done.
+    """
+    count = 0
+
+    def __init__(self, nbytes, name='job', timeout=None):
+        """Constructor for ScratchSpace objects. Wait until the
+            space can be reserved.
+
+            Inputs:
+                nbytes: The space to reserve, in bytes.
+                name: A description of the job (used in messages).
+                    (Default: 'job')
+                timeout: The maximum number of seconds to wait for
+                    space. (Default: 'scratch_wait_timeout')
+
+            Output:
+                scratch: The ScratchSpace object.
+        """
+        ScratchSpace.count += 1
+        self.resid = "%s:%d:%d" % (socket.gethostname(), os.getpid(),
+                                   ScratchSpace.count)
+        self.nbytes = nbytes
+        self.name = name
+        self.tier = None
+        self.path = None
+        if timeout is None:
+            timeout = config.cfg.scratch_wait_timeout
+        self.reserve(timeout)
+
+    def try_reserve(self, tier):
+        """Reserve the space on a tier, if it has room.
+
+            Input:
+                tier: The tier's name.
+
+            Output:
+                reserved: True if the space was reserved.
+        """
+        tierdir = get_tier_dir(tier)
+        if not os.path.isdir(tierdir):
+            os.makedirs(tierdir)
+        quota = get_tier_quota(tier)
+        with Ledger(tierdir) as ledger:
+            ledger.purge()
+            used = ledger.get_used()
+            # Always allow a job if the tier is otherwise unused,
+            # so jobs larger than the quota don't wait forever
+            if ledger.entries and (quota is not None) and \
+                    (used + self.nbytes > quota):
+                return False
+            if (tier == 'fast') and \
+                    (self.nbytes > get_free_space(tierdir)):
+                return False
+            self.path = tempfile.mkdtemp(prefix='toaster_scratch_',
+                                         dir=tierdir)
+            ledger.entries[self.resid] = {'host': socket.gethostname(),
+                                          'pid': os.getpid(),
+                                          'nbytes': self.nbytes,
+                                          'path': self.path,
+                                          'name': self.name,
+                                          'time': time.time()}
+        self.tier = tier
+        active[self.resid] = self
+        notify.print_debug("Reserved %d bytes of %s scratch space for %s "
+                           "(%s; %d of %s bytes in use)" %
+                           (self.nbytes, tier, self.name, self.path,
+                            used+self.nbytes, quota), 'scratch')
+        return True
+
+    def reserve(self, timeout=None):
+        """Reserve the space, waiting until a tier has room.
+
+            Input:
+                timeout: The maximum number of seconds to wait.
+                    (Default: wait forever)
+
+            Outputs:
+                None
+        """
+        start = time.time()
+        tiers = get_candidate_tiers(self.nbytes)
+        waiting = False
+        while True:
+            for tier in tiers:
+                if self.try_reserve(tier):
+                    if waiting:
+                        notify.print_info("Got scratch space for %s after "
+                                          "waiting %.0f s" %
+                                          (self.name, time.time()-start), 2)
+                    return
+            if (timeout is not None) and (time.time()-start > timeout):
+                raise errors.ScratchSpaceError("Timed out after %d s waiting "
+                                               "for %d bytes of scratch "
+                                               "space for %s." %
+                                               (timeout, self.nbytes,
+                                                self.name))
+            if not waiting:
+                notify.print_info("Waiting for %d bytes of scratch space "
+                                  "for %s (other jobs are using the %s "
+                                  "quota)" % (self.nbytes, self.name,
+                                              "/".join(tiers)), 1)
+                waiting = True
+            utils.sleep(SCRATCH_POLL_INTERVAL)
+
+    def mkstemp(self, suffix='', prefix='toaster_tmp'):
+        """Create a temporary file in the scratch space.
+
+            Inputs:
+                suffix: The file name's suffix. (Default: none)
+                prefix: The file name's prefix. (Default: 'toaster_tmp')
+
+            Output:
+                fn: The name of the (empty) file.
+        """
+        tmpfd, fn = tempfile.mkstemp(prefix=prefix, suffix=suffix,
+                                     dir=self.path)
+        os.close(tmpfd)
+        return fn
+
+    def release(self):
+        """Remove the scratch directory (and everything in it), and
+            release the reserved space.
+
+            Inputs:
+                None
+
+            Outputs:
+                None
+        """
+        if self.path is None:
+            return
+        shutil.rmtree(self.path, ignore_errors=True)
+        with Ledger(get_tier_dir(self.tier)) as ledger:
+            ledger.entries.pop(self.resid, None)
+        notify.print_debug("Released %d bytes of %s scratch space for %s "
+                           "(%s)" % (self.nbytes, self.tier, self.name,
+                                     self.path), 'scratch')
+        active.pop(self.resid, None)
+        self.path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.release()
+
+
+def release_all():
+    """Release the scratch space still held by this process.
+    """
+    for scratch in list(active.values()):
+        scratch.release()
+
+
+atexit.register(release_all)
@@ -0,0 +1,160 @@
+"""Staging of (possibly very large) files through the pipeline.
+
+    Stages of the pipeline each need their own copy of an archive,
+    but most of them never modify it. Rather than copying the data,
+    'stage_file' creates the new file as a reflink (a copy-on-write
+    clone, on filesystems that support it, e.g. btrfs, XFS), or a
+    hardlink, falling back to a regular copy.
+
+    Hardlinked files share their data with the original, so they
+    must be made private (see 'make_private') before being modified
+    in place. This only copies the data if the file is still shared.
+"""
+import os
+import os.path
+import errno
+import shutil
+import tempfile
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from toaster import config
+from toaster import errors
+from toaster.utils import notify
+
+# The Linux ioctl request to clone a file (_IOW(0x94, 9, int))
+FICLONE = 0x40049409
+
+STAGING_METHODS = ['auto', 'reflink', 'hardlink', 'copy']
+
+# Errors meaning a reflink/hardlink isn't possible here
+# (e.g. not supported by the filesystem, across filesystems,
+# or not permitted), so we should fall back to copying
+FALLBACK_ERRNOS = set([errno.EXDEV, errno.EPERM, errno.EACCES,
+                       errno.EINVAL, errno.ENOTTY, errno.EMLINK,
+                       errno.EOPNOTSUPP, errno.ENOSYS])
+
+
+def reflink(src, dest):
+    """Create 'dest' as a copy-on-write clone of 'src'.
+
+        Inputs:
+            src: The file to clone.
+            dest: The name of the clone. It is overwritten if it exists.
+
+        Outputs:
+            None
+    """
+    if fcntl is None:
+        raise OSError(errno.ENOSYS, "Reflinks are not supported")
+    with open(src, 'rb') as srcff:
+        with open(dest, 'wb') as destff:
+            try:
+                fcntl.ioctl(destff.fileno(), FICLONE, srcff.fileno())
+            except IOError as exc:
+                # Python 2 raises IOError, rather than OSError
+                raise OSError(exc.errno, exc.strerror)
+    shutil.copymode(src, dest)
+
+
+def hardlink(src, dest):
+    """Create 'dest' as a hardlink to 'src'.
+
+        Inputs:
+            src: The file to link to.
+            dest: The name of the link. It is replaced if it exists.
+
+        Outputs:
+            None
+    """
+    if os.path.lexists(dest):
+        os.remove(dest)
+    os.link(src, dest)
+
+
+def stage_file(src, dest, method=None):
+    """Provide the contents of 'src' as 'dest', copying the data
+        only if necessary.
+
+        NOTE: If 'dest' is modified in place 'make_private' must
+            be called first.
+
+        Inputs:
+            src: The file to stage.
+            dest: The staged file's name. It is replaced if it exists.
+            method: 'reflink', 'hardlink', 'copy', or 'auto' (i.e.
+                the first of these that works). The other methods
+                fall back to copying if they fail.
+                (Default: use the 'staging_method' configuration)
+
+        Output:
+            used: The method that was used.
+    """
+    if method is None:
+        method = config.cfg.staging_method
+    if method not in STAGING_METHODS:
+        raise errors.UnrecognizedValueError("The staging method '%s' is not "
+                                            "recognized. Valid methods are: "
+                                            "'%s'" % (method,
+                                                      "', '".join(STAGING_METHODS)))
+    if method == 'auto':
+        tries = [('reflink', reflink), ('hardlink', hardlink)]
+    elif method == 'reflink':
+        tries = [('reflink', reflink)]
+    elif method == 'hardlink':
+        tries = [('hardlink', hardlink)]
+    else:
+        tries = []
+    for name, func in tries:
+        try:
+            func(src, dest)
+        except OSError as exc:
+            if exc.errno not in FALLBACK_ERRNOS:
+                raise
+            notify.print_debug("Cannot %s %s to %s (%s)" %
+                               (name, src, dest, exc.strerror), 'staging')
+        else:
+            notify.print_debug("Staged %s as %s (%s)" % (src, dest, name),
+                               'staging', stepsback=2)
+            return name
+    shutil.copy(src, dest)
+    notify.print_debug("Staged %s as %s (copy)" % (src, dest),
+                       'staging', stepsback=2)
+    return 'copy'
+
+
+def make_private(fn):
+    """Ensure a file doesn't share its data with any other file
+        (i.e. it is not a hardlink), so it can be modified in place.
+
+        NOTE: Reflinked files are already private, the filesystem
+            copies their data on write.
+
+        Input:
+            fn: The file to make private.
+
+        Output:
+            copied: True if the data had to be copied.
+    """
+    if os.stat(fn).st_nlink <= 1:
+        return False
+    notify.print_debug("Making private copy of hardlinked file %s" % fn,
+                       'staging', stepsback=2)
+    tmpfd, tmpfn = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(fn)),
+                                    prefix='.toaster_private')
+    os.close(tmpfd)
+    try:
+        try:
+            reflink(fn, tmpfn)
+        except OSError as exc:
+            if exc.errno not in FALLBACK_ERRNOS:
+                raise
+            shutil.copy(fn, tmpfn)
+        os.rename(tmpfn, fn)
+    except:
+        if os.path.exists(tmpfn):
+            os.remove(tmpfn)
+        raise
+    return True
@@ -0,0 +1,254 @@
+"""Accounting of the resources used by external commands.
+
+    Every command run by 'utils.execute' is recorded here, with its
+    wall-clock time, user/system CPU time and maximum resident set
+    size, as well as the function that requested it.
+
+    The records of a run can be summarised (turn on the 'sysusage'
+    debug mode to print the summary when the program exits), and
+    loaded into the 'syscall_usage' DB table (set the
+    'record_syscall_usage' configuration).
+"""
+import sys
+import os
+import os.path
+import errno
+import atexit
+import subprocess
+import time
+import warnings
+
+from toaster import config
+from toaster import errors
+from toaster import debug
+from toaster.utils import notify
+
+# Records of the external commands run by this process
+usage_records = []
+
+# Identifies this run in the DB
+run_id = "%s-%d-%d" % (os.uname()[1], os.getpid(), int(time.time()))
+
+
+if hasattr(os, 'wait4'):
+    class ResourcePopen(subprocess.Popen):
+        """A 'subprocess.Popen' that reaps its child with 'os.wait4' so
+            the child's resource usage is available as 'self.rusage'.
+        """
+        rusage = None
+
+        def _try_wait(self, wait_flags):
+            # Used by Python 3's 'wait'
+            try:
+                pid, sts, rusage = os.wait4(self.pid, wait_flags)
+            except OSError as exc:
+                if exc.errno != errno.ECHILD:
+                    raise
+                return (self.pid, 0)
+            if pid == self.pid:
+                self.rusage = rusage
+            return (pid, sts)
+
+        if sys.version_info[0] < 3:
+            def wait(self):
+                while self.returncode is None:
+                    try:
+                        pid, sts, rusage = os.wait4(self.pid, 0)
+                    except OSError as exc:
+                        if exc.errno == errno.EINTR:
+                            continue
+                        if exc.errno != errno.ECHILD:
+                            raise
+                        pid, sts, rusage = self.pid, 0, None
+                    if pid == self.pid:
+                        self.rusage = rusage
+                        self._handle_exitstatus(sts)
+                return self.returncode
+else:
+    # Resource usage of individual children isn't available
+    class ResourcePopen(subprocess.Popen):
+        """A 'subprocess.Popen' whose 'rusage' is always None.
+        """
+        rusage = None
+
+
+def get_caller(stepsback=2):
+    """Return a short description of a function on the call stack.
+
+        Input:
+            stepsback: The number of frames to step back
+                from the caller of this function. (Default: 2)
+
+        Output:
+            caller: A string '<file>:<function>'.
+    """
+    try:
+        frame = sys._getframe(stepsback)
+    except ValueError:
+        return "unknown"
+    return "%s:%s" % (os.path.basename(frame.f_code.co_filename),
+                      frame.f_code.co_name)
+
+
+def record(cmd, pipe, wall, caller):
+    """Record the resources used by an external command.
+
+        Inputs:
+            cmd: The command (a list of arguments, or a string).
+            pipe: The (finished) Popen object that ran the command.
+            wall: The command's wall-clock time, in seconds.
+            caller: A description of the function that ran the command.
+
+        Output:
+            entry: The dictionary recorded.
+    """
+    if isinstance(cmd, (list, tuple)):
+        cmdline = " ".join([str(arg) for arg in cmd])
+        command = os.path.basename(str(cmd[0]))
+    else:
+        cmdline = str(cmd)
+        command = os.path.basename(cmdline.split()[0])
+    rusage = getattr(pipe, 'rusage', None)
+    entry = {'command': command,
+             'cmdline': cmdline,
+             'caller': caller,
+             'exit_status': pipe.returncode,
+             'wall': wall,
+             'utime': rusage.ru_utime if rusage else None,
+             'stime': rusage.ru_stime if rusage else None,
+             # ru_maxrss is in kilobytes on Linux
+             'maxrss_kb': rusage.ru_maxrss if rusage else None}
+    usage_records.append(entry)
+    notify.print_debug("%s (called by %s) took %.3f s wall, %s" %
+                       (command, caller, wall,
+                        "%.3f s user, %.3f s sys, %d kB max RSS" %
+                        (entry['utime'], entry['stime'], entry['maxrss_kb'])
+                        if rusage else "no resource usage available"),
+                       'sysusage', stepsback=3)
+    return entry
+
+
+def summarize(records=None, key='command'):
+    """Aggregate resource usage records.
+
+        Inputs:
+            records: A list of records. (Default: the records of
+                the current run)
+            key: The record field to aggregate by (e.g. 'command',
+                or 'caller'). (Default: 'command')
+
+        Output:
+            summary: A dictionary, keyed by the aggregation field, of
+                dictionaries with the number of calls, the total wall,
+                user and system times, and the largest max RSS.
+    """
+    if records is None:
+        records = usage_records
+    summary = {}
+    for entry in records:
+        agg = summary.setdefault(entry[key], {'calls': 0, 'wall': 0.0,
+                                              'utime': 0.0, 'stime': 0.0,
+                                              'maxrss_kb': 0})
+        agg['calls'] += 1
+        agg['wall'] += entry['wall']
+        agg['utime'] += entry['utime'] or 0.0
+        agg['stime'] += entry['stime'] or 0.0
+        agg['maxrss_kb'] = max(agg['maxrss_kb'], entry['maxrss_kb'] or 0)
+    return summary
+
+
+def format_report(records=None):
+    """Return a report of the resources used by external commands.
+
+        Input:
+            records: A list of records. (Default: the records of
+                the current run)
+
+        Output:
+            report: The report, as a string.
+    """
+    if records is None:
+        records = usage_records
+    lines = []
+    for key in ('command', 'caller'):
+        summary = summarize(records, key)
+        lines.append("%-40s %6s %10s %10s %10s %12s" %
+                     ("By %s" % key, "Calls", "Wall (s)", "User (s)",
+                      "Sys (s)", "MaxRSS (kB)"))
+        for name in sorted(summary, key=lambda name: summary[name]['wall'],
+                           reverse=True):
+            agg = summary[name]
+            lines.append("%-40s %6d %10.3f %10.3f %10.3f %12d" %
+                         (name, agg['calls'], agg['wall'], agg['utime'],
+                          agg['stime'], agg['maxrss_kb']))
+        lines.append("")
+    return "\n".join(lines)
+
+
+def save_records(existdb=None):
+    """Load this run's resource usage records into the DB, and
+        forget them.
+
+        Input:
+            existdb: A (optional) existing database connection object.
+                (Default: Establish a db connection)
+
+        Outputs:
+            None
+    """
+    if not usage_records:
+        return
+    from toaster import database
+    db = existdb or database.Database()
+    db.connect()
+    program = os.path.basename(sys.argv[0]) if sys.argv else "unknown"
+    values = []
+    for entry in usage_records:
+        row = dict(entry)
+        row['run_id'] = run_id
+        row['program'] = program[:64]
+        row['command'] = row['command'][:64]
+        row['caller'] = row['caller'][:128]
+        values.append(row)
+    result = db.execute(db.syscall_usage.insert(), values)
+    result.close()
+    notify.print_info("Recorded resource usage of %d external commands." %
+                      len(values), 3)
+    if not existdb:
+        db.close()
+    del usage_records[:]
+
+
+def finish_run():
+    """Report and/or save the resource usage records, as configured,
+        and forget them. This is called when the program exits, and
+        by long-running programs after each unit of work (e.g. by
+        'toaster_worker.py' after each job).
+
+        Inputs:
+            None
+
+        Outputs:
+            None
+    """
+    if not usage_records:
+        return
+    if debug.is_on('sysusage'):
+        sys.stderr.write("Resources used by external commands:\n")
+        sys.stderr.write(format_report() + "\n")
+        sys.stderr.flush()
+    try:
+        record_usage = config.cfg.record_syscall_usage
+    except errors.NoConfigError:
+        record_usage = False
+    if record_usage:
+        try:
+            save_records()
+        except Exception as exc:
+            warnings.warn("Could not record resource usage of external "
+                          "commands in the DB: %s" % str(exc),
+                          errors.ToasterWarning)
+    del usage_records[:]
+
+
+atexit.register(finish_run)
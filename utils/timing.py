@@ -0,0 +1,183 @@
+"""Wall-clock timing of the stages of the processing pipeline.
+
+    A StageTimer accumulates the time spent in each stage of a
+    processing run (see 'STAGES'). The timings are loaded into the
+    'process_timings' DB table with the run's results (set the
+    'record_process_timings' configuration), and can be summarised
+    with 'processing.py show -O timings'.
+"""
+import math
+import time
+import contextlib
+
+from toaster import config
+from toaster import errors
+from toaster import database
+from toaster.utils import notify
+
+# The stages of the pipeline, in the order they are run
+STAGES = ['md5_verify',         # Checking the MD5 sums of the input files
+          'ephemeris_install',  # Installing the parfile in the raw file
+          'manipulation',       # Running the manipulator
+          'pat',                # Generating TOAs
+          'header_read',        # Reading the manipulated archive's header
+          'toa_insert',         # Loading the TOAs into the DB
+          'diagnostics',        # Computing (or queueing) diagnostics
+          'plot_moves']         # Moving TOA diagnostic plots into place
+
+
+class StageTimer(object):
+    """The wall-clock time spent in each stage of a processing run.
+    """
+    def __init__(self):
+        self.seconds = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time the code run in a 'with' block as part of a stage.
+            Time spent in the same stage more than once is added up.
+
+            Input:
+                name: The name of the stage (see 'STAGES').
+        """
+        if name not in STAGES:
+            raise errors.UnrecognizedValueError("The pipeline stage '%s' "
+                                                "is not recognized. Valid "
+                                                "stages are: '%s'" %
+                                                (name, "', '".join(STAGES)))
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time()-start)
+
+    def add(self, name, seconds):
+        """Add time spent in a stage.
+
+            Inputs:
+                name: The name of the stage.
+                seconds: The time spent, in seconds.
+
+            Outputs:
+                None
+        """
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+    def merge(self, other):
+        """Add the times of another StageTimer to this one.
+
+            Input:
+                other: The StageTimer to add.
+
+            Outputs:
+                None
+        """
+        for name, seconds in other.seconds.items():
+            self.add(name, seconds)
+
+    def get_timings(self):
+        """Return the times spent in each stage.
+
+            Inputs:
+                None
+
+            Output:
+                timings: A list of (stage, seconds) tuples, in the
+                    order of 'STAGES'. Stages that weren't run are
+                    not included.
+        """
+        return [(name, self.seconds[name]) for name in STAGES
+                if name in self.seconds]
+
+    def __str__(self):
+        return ", ".join(["%s: %.3f s" % (name, seconds)
+                          for name, seconds in self.get_timings()])
+
+
+def store_process_timings(process_id, timer, existdb=None):
+    """Load the stage timings of a processing run into the DB
+        (if the 'record_process_timings' configuration is set).
+        Existing timings for the run's stages are replaced.
+
+        Inputs:
+            process_id: The ID number of the processing run.
+            timer: The run's StageTimer.
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+
+        Outputs:
+            None
+    """
+    notify.print_debug("Processing run (ID: %d) stage timings: %s" %
+                       (process_id, timer), 'timing')
+    timings = timer.get_timings()
+    if not (config.cfg.record_process_timings and timings):
+        return
+    db = existdb or database.Database()
+    db.connect()
+
+    delete = db.process_timings.delete().\
+                where((db.process_timings.c.process_id == process_id) &
+                      db.process_timings.c.stage.in_([name for name, seconds
+                                                      in timings]))
+    result = db.execute(delete)
+    result.close()
+    ins = db.process_timings.insert()
+    result = db.execute(ins, [{'process_id': process_id,
+                               'stage': name,
+                               'seconds': seconds}
+                              for name, seconds in timings])
+    result.close()
+    if not existdb:
+        db.close()
+
+
+def get_process_timings(process_ids, existdb=None, chunksize=1000):
+    """Return the stage timings of processing runs.
+
+        Inputs:
+            process_ids: A list of IDs of processing runs.
+            existdb: An (optional) existing database connection object.
+                (Default: Establish a db connection)
+            chunksize: The maximum number of runs to get timings
+                for with each query. (Default: 1000)
+
+        Output:
+            timings: A dictionary, keyed by process ID, of
+                dictionaries of seconds, keyed by stage. Runs with
+                no timings are not included.
+    """
+    db = existdb or database.Database()
+    db.connect()
+
+    process_ids = list(process_ids)
+    timings = {}
+    for ii in range(0, len(process_ids), chunksize):
+        select = db.select([db.process_timings]).\
+                    where(db.process_timings.c.process_id.\
+                            in_(process_ids[ii:ii+chunksize]))
+        result = db.execute(select)
+        for row in result.fetchall():
+            timings.setdefault(row['process_id'], {})[row['stage']] = \
+                    row['seconds']
+        result.close()
+    if not existdb:
+        db.close()
+    return timings
+
+
+def get_percentile(values, percent):
+    """Return a percentile of some values (using the nearest rank).
+
+        Inputs:
+            values: A list of numbers.
+            percent: The percentile (between 0 and 100).
+
+        Output:
+            value: The percentile. None if there are no values.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(math.ceil(percent/100.0*len(values)))
+    return values[min(max(rank-1, 0), len(values)-1)]
@@ -8,6 +8,10 @@ from toaster import utils
 from toaster.utils import notify
 from toaster import debug
 
+# Cache of the version fingerprint. This is only populated
+# by long-running processes (see 'warm_version_cache').
+version_cache = {}
+
 
 def is_gitrepo(repodir):
     """Return True if the given dir is a git repository.
@@ -70,18 +74,20 @@ def get_githash(repodir):
     return githash
 
 
-def get_version_id(existdb=None):
-    """Get the pipeline version number.
-        If the version number isn't in the database, add it.
+def get_version_fingerprint():
+    """Get the git hashes identifying the current pipeline/psrchive
+        combination. If the fingerprint has been cached (see
+        'warm_version_cache') the cached values are returned.
 
-        Input:
-            existdb: A (optional) existing database connection object.
-                (Default: Establish a db connection)
+        Inputs:
+            None
 
-        Output:
-            version_id: The version ID for the current pipeline/psrchive
-                combination.
+        Outputs:
+            pipeline_githash: The pipeline's git hash.
+            psrchive_githash: PSRCHIVE's git hash (or version string).
     """
+    if version_cache:
+        return version_cache['pipeline'], version_cache['psrchive']
     # Check to make sure the repositories are clean
     check_repos()
     # Get git hashes
@@ -96,6 +102,52 @@ def get_version_id(existdb=None):
         cmd = ["psrchive", "--version"]
         stdout, stderr = utils.execute(cmd)
         psrchive_githash = stdout.strip()
+    return pipeline_githash, psrchive_githash
+
+
+def warm_version_cache():
+    """Compute the version fingerprint once and cache it for
+        the rest of the process' lifetime. This is meant for
+        long-running processes (e.g. 'toasterd.py') whose code
+        cannot change underneath them.
+
+        Inputs:
+            None
+
+        Outputs:
+            None
+    """
+    clear_version_cache()
+    pipeline_githash, psrchive_githash = get_version_fingerprint()
+    version_cache['pipeline'] = pipeline_githash
+    version_cache['psrchive'] = psrchive_githash
+
+
+def clear_version_cache():
+    """Forget the cached version fingerprint.
+
+        Inputs:
+            None
+
+        Outputs:
+            None
+    """
+    version_cache.clear()
+
+
+def get_version_id(existdb=None):
+    """Get the pipeline version number.
+        If the version number isn't in the database, add it.
+
+        Input:
+            existdb: A (optional) existing database connection object.
+                (Default: Establish a db connection)
+
+        Output:
+            version_id: The version ID for the current pipeline/psrchive
+                combination.
+    """
+    pipeline_githash, psrchive_githash = get_version_fingerprint()
     
     # Use the exisitng DB connection, or open a new one if None was provided
     db = existdb or database.Database()